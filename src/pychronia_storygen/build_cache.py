@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import os
+
+
+def compute_digest(*parts):
+    """Return a hex digest of the given str/bytes parts (None values are accepted too)"""
+    hasher = hashlib.sha256()
+    for part in parts:
+        if part is None:
+            part = b"<none>"
+        elif isinstance(part, str):
+            part = part.encode("utf8")
+        assert isinstance(part, bytes), repr(part)
+        hasher.update(b"%d:" % len(part))  # Avoids collisions between concatenated parts
+        hasher.update(part)
+    return hasher.hexdigest()
+
+
+def compute_file_digest(path):
+    """Return the digest of the content of a file, or None if it doesn't exist"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return compute_digest(f.read())
+
+
+def _get_serializable_story_tags_registries(story_tags_registries):
+    # Sets and FactsRegistry are not JSON-serializable, but merge_story_tags_registries() accepts legacy forms
+    return dict(
+        facts_registry=story_tags_registries["facts_registry"].to_dict(),
+        symbols_registry={k: sorted(v) for (k, v) in story_tags_registries["symbols_registry"].items()},
+        items_registry={k: sorted(v) for (k, v) in story_tags_registries["items_registry"].items()},
+    )
+
+
+class BuildManifest:
+    """
+    Persistent registry of the digests of generated RST/PDF files, stored as a JSON file in the build folder.
+
+    When an output must be generated again with the same digest (e.g. same RST content and same rst2pdf
+    settings), and its files still exist, its generation can be skipped.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, manifest_file, entries=None):
+        self.manifest_file = manifest_file
+        self.entries = entries or {}  # (output key -> digest) mapping
+        self.updated_entries = {}  # Entries recorded during this run, e.g. to be sent back from worker processes
+
+    @classmethod
+    def load(cls, manifest_file):
+        entries = None
+        if os.path.exists(manifest_file):
+            try:
+                with open(manifest_file, "r", encoding="utf8") as f:
+                    data = json.load(f)
+                if data.get("version") == cls.FORMAT_VERSION:
+                    entries = data["entries"]
+                else:
+                    logging.info("Ignoring build manifest '%s' with obsolete format", manifest_file)
+            except (ValueError, KeyError) as exc:
+                logging.warning("Ignoring corrupted build manifest '%s': %r", manifest_file, exc)
+        return cls(manifest_file, entries=entries)
+
+    def save(self):
+        tmp_file = "%s.%d.tmp" % (self.manifest_file, os.getpid())  # Several processes might save it
+        with open(tmp_file, "w", encoding="utf8") as f:
+            json.dump(dict(version=self.FORMAT_VERSION, entries=self.entries), f, indent=1, sort_keys=True)
+        os.replace(tmp_file, self.manifest_file)  # Atomic, so that an interrupted build can't corrupt the manifest
+
+    def is_up_to_date(self, key, digest, *output_files):
+        return self.entries.get(key) == digest and all(os.path.exists(x) for x in output_files)
+
+    def record(self, key, digest):
+        self.entries[key] = self.updated_entries[key] = digest
+
+    def extract(self, keys):
+        """Return a new manifest restricted to the given keys, e.g. to be sent to worker processes"""
+        entries = {key: self.entries[key] for key in keys if key in self.entries}
+        return type(self)(self.manifest_file, entries=entries)
+
+    def merge_updated_entries(self, updated_entries):
+        for key, digest in updated_entries.items():
+            self.record(key, digest)
+
+
+class SheetDependencyManifest(BuildManifest):
+    """
+    Persistent registry of what each generated sheet depends on: the digest of its configuration
+    (variables, settings...), and the digests of all the templates loaded while rendering it.
+
+    The game-tags registries filled by each sheet are stored too, so that they can be replayed
+    when the rendering of an up-to-date sheet is skipped.
+    """
+
+    def is_sheet_up_to_date(self, key, config_digest, get_template_digest, *output_files):
+        entry = self.entries.get(key)
+        if not entry or entry["config_digest"] != config_digest:
+            return False
+        if not all(os.path.exists(x) for x in output_files):
+            return False
+        return all(get_template_digest(name) == digest for (name, digest) in entry["template_digests"].items())
+
+    def get_story_tags_registries(self, key):
+        return self.entries[key]["story_tags_registries"]
+
+    def record_sheet(self, key, config_digest, template_digests, story_tags_registries):
+        self.record(key, dict(config_digest=config_digest,
+                              template_digests=template_digests,
+                              story_tags_registries=_get_serializable_story_tags_registries(story_tags_registries)))
+
+
+class DocumentExtractionCache(BuildManifest):
+    """
+    Persistent registry of the text extracted from each ODT document bundle, along with the signature
+    of the ODT parts it was extracted from, the digests of all the templates loaded while rendering it,
+    and the game-tags registries that it filled.
+    """
+
+    def get_extracted_text(self, key, source_signature):
+        """Return the text previously extracted from an unchanged ODT file, or None"""
+        entry = self.entries.get(key)
+        if entry and entry["source_signature"] == source_signature:
+            return entry["text"]
+        return None
+
+    def get_replayable_story_tags_registries(self, key, source_signature, get_template_digest):
+        """Return the game-tags registries filled by an unchanged document, or None"""
+        entry = self.entries.get(key)
+        if not entry or entry["source_signature"] != source_signature:
+            return None
+        if not all(get_template_digest(name) == digest for (name, digest) in entry["template_digests"].items()):
+            return None
+        return entry["story_tags_registries"]
+
+    def record_document(self, key, source_signature, text, template_digests, story_tags_registries):
+        self.record(key, dict(source_signature=source_signature,
+                              text=text,
+                              template_digests=template_digests,
+                              story_tags_registries=_get_serializable_story_tags_registries(story_tags_registries)))
+
+
+class MacroIndex(BuildManifest):
+    """
+    Persistent (template name -> macro names) index, with the (mtime, size) signature of each template
+    file, so that unchanged templates don't need to be read again to discover the macros they define.
+    """
+
+    def get_macro_names(self, template_name, file_signature):
+        """Return the macro names of the template, or None if it's unknown or changed since its indexing"""
+        entry = self.entries.get(template_name)
+        if entry and entry["file_signature"] == file_signature:
+            return entry["macro_names"]
+        return None
+
+    def record_macro_names(self, template_name, file_signature, macro_names):
+        self.record(template_name, dict(file_signature=file_signature, macro_names=macro_names))
+
+    def forget_other_templates(self, template_names):
+        """Remove entries of templates which don't exist anymore"""
+        for obsolete_template_name in self.entries.keys() - set(template_names):
+            del self.entries[obsolete_template_name]
+            self.updated_entries[obsolete_template_name] = None
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 """A pythonic like make file """
 import dataclasses
+import functools
+import json
 import logging
 import os
+import time
 from collections import ChainMap
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
 from pprint import pprint
 
@@ -14,12 +18,25 @@ from dataclasses import dataclass
 from types import MappingProxyType
 
 
+from pychronia_storygen.build_cache import BuildManifest, SheetDependencyManifest, DocumentExtractionCache, \
+    compute_digest, compute_file_digest
 from pychronia_storygen.document_formats import load_yaml_file, load_jinja_environment, load_rst_file, \
     render_with_jinja_and_fact_tags, convert_rst_content_to_pdf, render_with_jinja, generate_rst_and_pdf_files, \
-    render_with_jinja_and_convert_to_pdf, extract_text_from_odt_file, split_odt_file_into_separate_documents
-from pychronia_storygen.inventory import analyze_and_normalize_game_items
+    render_with_jinja_and_convert_to_pdf, extract_text_from_odt_file, \
+    get_rst_and_pdf_file_paths, generate_with_jinja_and_fact_tags, OfficeListenerPool, get_odt_file_signature, \
+    ODT_TEXT_PARTS, split_odt_file_into_separate_documents_async, refresh_macros_from_template_file
+from pychronia_storygen.facts_matrix import FactKnowledgeMatrix, is_facts_matrix_available
+from pychronia_storygen.converter_jobs import ConverterJobRunner, DEFAULT_CONCURRENCY_LIMIT
+from pychronia_storygen.inventory import GameInventory
 from pychronia_storygen.story_tags import CURRENT_PLAYER_VARNAME, IS_CHEAT_SHEET_VARNAME, detect_game_item_errors, \
-    detect_game_symbol_errors, detect_game_fact_errors
+    detect_game_symbol_errors, detect_game_fact_errors, merge_story_tags_registries, \
+    isolated_story_tags_registries
+
+
+JINJA_BYTECODE_CACHE_DIRNAME = "jinja_bytecode_cache"  # Inside the build folder
+MACRO_INDEX_FILENAME = "macro_index.json"  # Inside the build folder
+OFFICE_PROFILES_DIRNAME = "office_profiles"  # Inside the build folder
+YAML_CACHE_DIRNAME = "yaml_cache"  # Inside the build folder
 
 
 def ___frozenmap(map, **kwargs):  # FIXME REMOVE
@@ -38,6 +55,11 @@ class StorygenSettings:
     jinja_env: object
     dynamic_variables: ChainMap
     dynamic_settings: ChainMap
+    build_manifest: BuildManifest = None  # If None, all output files are always regenerated
+    dependency_manifest: SheetDependencyManifest = None  # If None, all sheets are always rendered
+    office_listener_pool: OfficeListenerPool = None  # If None, each document conversion launches its own office
+    document_extraction_cache: DocumentExtractionCache = None  # If None, texts of documents are always extracted
+    converter_job_runner: ConverterJobRunner = None  # Only required for documents, else conversions are never deferred
 
     def derive(self, new_config_level, **extra_dynamic_variables):
         """Return a new StorygenSettings with nested variables/storygen_settings loaded from new_config_level fields"""
@@ -48,8 +70,37 @@ class StorygenSettings:
         return dataclasses.replace(self, dynamic_variables=dynamic_variables, dynamic_settings=dynamic_settings)
 
 
-def _recursively_generate_group_sheets(data_tree: dict, group_breadcrumb: tuple,
-                                       storygen_settings: StorygenSettings):
+@dataclass
+class SheetGenerationJob:
+    """Everything needed to render a single full sheet or cheat sheet, possibly in another process"""
+    sheet_parts: tuple
+    relative_filepath_base: Path
+    jinja_context: ChainMap  # Per-sheet variables layered over the (shared) variables of groups
+    storygen_settings: StorygenSettings
+
+    @property
+    def manifest_key(self):
+        return self.relative_filepath_base.as_posix()
+
+
+@dataclass
+class DocumentSplittingJob:
+    """Everything needed to split an ODT document bundle into separate PDF files, possibly in another thread"""
+    document_bundle_name: str
+    document_source: str
+    splits_config: list
+    output_dir: Path
+    backend: str
+    manifest_digest: str
+
+    @property
+    def manifest_key(self):
+        return self.output_dir.as_posix()
+
+
+def _recursively_list_group_sheets(data_tree: dict, group_breadcrumb: tuple,
+                                   storygen_settings: StorygenSettings):
+    """Yield a SheetGenerationJob for each sheet variant of this group and its subgroups, in config order"""
 
     group_storygen_settings = storygen_settings.derive(data_tree)
     del storygen_settings  # Safety
@@ -84,29 +135,21 @@ def _recursively_generate_group_sheets(data_tree: dict, group_breadcrumb: tuple,
             _sheet_name_tpl = "%s_cheat_sheet" if is_cheat_sheet else "%s_full_sheet"
             relative_filepath_base = relative_folders.joinpath(_sheet_name_tpl % sheet_name)
 
-            jinja_context = dict(
+            # No flattening of variables, jinja resolves them through the layers of the ChainMap
+            jinja_context = player_storygen_settings.dynamic_variables.new_child(dict(
                 group_breadcrumb=group_breadcrumb,
                 group_name=group_name,
                 sheet_name=sheet_name,
                 **{IS_CHEAT_SHEET_VARNAME: is_cheat_sheet},
-                **player_storygen_settings.dynamic_variables
-            )
+            ))
 
             # Be tolerant if a single string was entered
-            sheet_parts = (sheet_parts,) if isinstance(sheet_parts, str) else sheet_parts
+            sheet_parts = (sheet_parts,) if isinstance(sheet_parts, str) else tuple(sheet_parts)
 
-            full_rst_content = ""
-            for sheet_part in sheet_parts:
-                logging.debug("Rendering template file '%s' with jinja2", sheet_part)
-                rst_content = render_with_jinja_and_fact_tags(
-                    filename=sheet_part,
-                    jinja_env=player_storygen_settings.jinja_env,
-                    jinja_context=jinja_context)
-                full_rst_content += "\n\n" + rst_content
-
-            logging.debug("Writing RST and PDF files with filename base '%s'", relative_filepath_base)
-            generate_rst_and_pdf_files(
-                rst_content=full_rst_content, relative_path=relative_filepath_base, storygen_settings=player_storygen_settings)
+            yield SheetGenerationJob(sheet_parts=sheet_parts,
+                                     relative_filepath_base=relative_filepath_base,
+                                     jinja_context=jinja_context,
+                                     storygen_settings=player_storygen_settings)
 
         # convert_rst_content_to_pdf(filepath_base=filepath_base,
         #                            rst_content=full_rst_content,
@@ -117,10 +160,153 @@ def _recursively_generate_group_sheets(data_tree: dict, group_breadcrumb: tuple,
 
     if sub_data_tree:
         for group_name, group_data_tree in sub_data_tree.items():
-            _recursively_generate_group_sheets(group_data_tree,
-                                               group_breadcrumb=group_breadcrumb + (group_name,),
-                                               storygen_settings=group_storygen_settings)
+            yield from _recursively_list_group_sheets(group_data_tree,
+                                                      group_breadcrumb=group_breadcrumb + (group_name,),
+                                                      storygen_settings=group_storygen_settings)
+
+
+def _compute_sheet_config_digest(sheet_job: SheetGenerationJob):
+    """Digest of everything, apart from template files, which influences the generation of a sheet"""
+    dynamic_settings = dict(sheet_job.storygen_settings.dynamic_settings)
+    serialized_config = json.dumps([sheet_job.sheet_parts, dict(sheet_job.jinja_context), dynamic_settings],
+                                   sort_keys=True, default=repr)
+    return compute_digest(serialized_config, compute_file_digest(dynamic_settings.get("rst2pdf_conf_file")))
+
 
+def _generate_sheet_files(sheet_job: SheetGenerationJob):
+    """Render a sheet and generate its files, and return the game-tags registries that it filled"""
+    storygen_settings = sheet_job.storygen_settings
+    jinja_env = storygen_settings.jinja_env
+    template_digests = {}  # Filled once all sheet parts are rendered
+
+    with isolated_story_tags_registries(jinja_env) as sheet_registries, \
+            jinja_env.record_loaded_templates() as template_names:
+
+        def _generate_rst_chunks():
+            for sheet_part in sheet_job.sheet_parts:
+                logging.debug("Rendering template file '%s' with jinja2", sheet_part)
+                yield "\n\n"
+                yield from generate_with_jinja_and_fact_tags(
+                    filename=sheet_part,
+                    jinja_env=jinja_env,
+                    jinja_context=sheet_job.jinja_context)
+            template_digests.update((name, jinja_env.get_template_digest(name)) for name in sorted(template_names))
+
+        def _record_sheet_dependencies():
+            # Only called once the PDF file is generated, since its conversion may be deferred, and fail
+            if storygen_settings.dependency_manifest is not None:
+                storygen_settings.dependency_manifest.record_sheet(
+                    sheet_job.manifest_key,
+                    config_digest=_compute_sheet_config_digest(sheet_job),
+                    template_digests=template_digests,
+                    story_tags_registries=sheet_registries)
+
+        logging.debug("Streaming RST and PDF files with filename base '%s'", sheet_job.relative_filepath_base)
+        generate_rst_and_pdf_files(
+            rst_content=_generate_rst_chunks(), relative_path=sheet_job.relative_filepath_base,
+            storygen_settings=storygen_settings, on_generated=_record_sheet_dependencies)
+
+    return sheet_registries
+
+
+def _get_replayable_sheet_registries(sheet_job: SheetGenerationJob, get_template_digest):
+    """
+    If neither the config nor the templates of a sheet changed since it was last generated,
+    return the game-tags registries that it filled back then, else return None.
+    """
+    dependency_manifest = sheet_job.storygen_settings.dependency_manifest
+    if dependency_manifest is None:
+        return None
+    output_files = get_rst_and_pdf_file_paths(sheet_job.relative_filepath_base, sheet_job.storygen_settings)
+    if not dependency_manifest.is_sheet_up_to_date(sheet_job.manifest_key, _compute_sheet_config_digest(sheet_job),
+                                                   get_template_digest, *output_files):
+        return None
+    logging.info("Sheet '%s' is up-to-date, skipping its rendering", sheet_job.manifest_key)
+    return dependency_manifest.get_story_tags_registries(sheet_job.manifest_key)
+
+
+_worker_jinja_env = None  # Jinja environment of the current sheet-generation worker process
+
+
+def _init_sheet_generation_worker(build_root_dir, output_root_dir, log_level):
+    global _worker_jinja_env
+    logging.basicConfig(level=log_level)  # Useful for "spawned" worker processes
+    _worker_jinja_env = _load_project_jinja_environment(build_root_dir, output_root_dir=output_root_dir)
+
+
+def _generate_sheet_files_in_worker(sheet_job: SheetGenerationJob):
+    """Generate a sheet in a worker process, and return the game-tags registries and manifest entries it filled"""
+    jinja_env = _worker_jinja_env
+    jinja_env.facts_registry.clear()
+    jinja_env.symbols_registry.clear()
+    jinja_env.items_registry.clear()
+    storygen_settings = dataclasses.replace(sheet_job.storygen_settings, jinja_env=jinja_env)
+    sheet_registries = _generate_sheet_files(dataclasses.replace(sheet_job, storygen_settings=storygen_settings))
+    manifest_entries = [manifest.updated_entries if manifest is not None else {}
+                        for manifest in (storygen_settings.build_manifest, storygen_settings.dependency_manifest)]
+    return sheet_registries, manifest_entries
+
+
+def _prepare_sheet_job_for_worker(sheet_job: SheetGenerationJob):
+    """Jinja env, office listeners and job runners are not picklable, and only the relevant entries of manifests need to be sent to workers"""
+    storygen_settings = sheet_job.storygen_settings
+    keys = [sheet_job.manifest_key]
+    build_manifest, dependency_manifest = [manifest.extract(keys) if manifest is not None else None
+                                           for manifest in (storygen_settings.build_manifest,
+                                                            storygen_settings.dependency_manifest)]
+    storygen_settings = dataclasses.replace(storygen_settings, jinja_env=None, build_manifest=build_manifest,
+                                            dependency_manifest=dependency_manifest, office_listener_pool=None,
+                                            document_extraction_cache=None, converter_job_runner=None)
+    return dataclasses.replace(sheet_job, storygen_settings=storygen_settings)
+
+
+def _generate_group_sheets(data_tree: dict, storygen_settings: StorygenSettings, jobs: int = 1):
+    """
+    Generate all full sheets and cheat sheets, possibly spread over a pool of processes.
+
+    Sheets whose dependencies didn't change since the previous build are not rendered again, their
+    game-tags are just replayed from the dependency manifest.
+
+    Game-tags registries (and manifest entries) filled by worker processes get merged back,
+    in config order, into the registries of the main jinja environment.
+    """
+    jinja_env = storygen_settings.jinja_env
+    get_template_digest = functools.lru_cache(maxsize=None)(jinja_env.get_template_digest)  # Cached for this run
+
+    sheet_jobs = _recursively_list_group_sheets(data_tree, group_breadcrumb=(), storygen_settings=storygen_settings)
+
+    if jobs <= 1:
+        for sheet_job in sheet_jobs:
+            replayable_sheet_registries = _get_replayable_sheet_registries(sheet_job, get_template_digest)
+            if replayable_sheet_registries is not None:
+                merge_story_tags_registries(jinja_env, **replayable_sheet_registries)
+            else:
+                _generate_sheet_files(sheet_job)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs,
+                             initializer=_init_sheet_generation_worker,
+                             initargs=(storygen_settings.build_root_dir, storygen_settings.output_root_dir,
+                                       logging.getLogger().getEffectiveLevel())) as executor:
+        pending_results = []  # Either replayable registries, or futures of worker results
+        for sheet_job in sheet_jobs:
+            replayable_sheet_registries = _get_replayable_sheet_registries(sheet_job, get_template_digest)
+            if replayable_sheet_registries is not None:
+                pending_results.append(replayable_sheet_registries)
+            else:
+                pending_results.append(executor.submit(_generate_sheet_files_in_worker,
+                                                       _prepare_sheet_job_for_worker(sheet_job)))
+
+        for pending_result in pending_results:
+            if not isinstance(pending_result, Future):
+                merge_story_tags_registries(jinja_env, **pending_result)
+                continue
+            sheet_registries, (build_manifest_entries, dependency_manifest_entries) = pending_result.result()
+            merge_story_tags_registries(jinja_env, **sheet_registries)
+            if storygen_settings.build_manifest is not None:
+                storygen_settings.build_manifest.merge_updated_entries(build_manifest_entries)
+            if storygen_settings.dependency_manifest is not None:
+                storygen_settings.dependency_manifest.merge_updated_entries(dependency_manifest_entries)
 
 
 def _generate_inventory_files(inventory_name, inventory_config, storygen_settings: StorygenSettings):
@@ -130,9 +316,9 @@ def _generate_inventory_files(inventory_name, inventory_config, storygen_setting
     storygen_settings = storygen_settings.derive(inventory_config, inventory_name=inventory_name)
 
     inventory_data_path = Path(inventory_config["inventory_data"])
-    inventory_data = load_yaml_file(inventory_data_path)
-    game_items_per_section, game_items_per_crate = analyze_and_normalize_game_items(
-        inventory_data, important_marker="IMPORTANT")
+    inventory_data = load_yaml_file(inventory_data_path,
+                                    cache_dir=storygen_settings.build_root_dir.joinpath(YAML_CACHE_DIRNAME))
+    game_inventory = GameInventory.from_raw_data(inventory_data, important_marker="IMPORTANT")
 
     inventory_per_section_template_name = inventory_config["inventory_per_section_template"]
     inventory_per_section_destination = inventory_config["inventory_per_section_destination"]
@@ -142,7 +328,8 @@ def _generate_inventory_files(inventory_name, inventory_config, storygen_setting
 
     if inventory_per_section_template_name and inventory_per_section_destination:
         logging.info("Processing per-section sheet for game inventory '%s'" % inventory_name)
-        jinja_context = dict(items_per_section=game_items_per_section, **storygen_settings.dynamic_variables)
+        jinja_context = storygen_settings.dynamic_variables.new_child(
+            dict(items_per_section=game_inventory.items_per_section, inventory=game_inventory))
         render_with_jinja_and_convert_to_pdf(inventory_per_section_template_name,
                                              relative_path=Path(inventory_per_section_destination),
                                              jinja_context=jinja_context,
@@ -150,31 +337,118 @@ def _generate_inventory_files(inventory_name, inventory_config, storygen_setting
 
     if inventory_per_crate_template_name and inventory_per_crate_destination:
         logging.info("Processing per-crate sheet for game inventory '%s'" % inventory_name)
-        jinja_context = dict(items_per_crate=game_items_per_crate, **storygen_settings.dynamic_variables)
+        jinja_context = storygen_settings.dynamic_variables.new_child(
+            dict(items_per_crate=game_inventory.items_per_crate, inventory=game_inventory))
         render_with_jinja_and_convert_to_pdf(inventory_per_crate_template_name,
                                              relative_path=Path(inventory_per_crate_destination),
                                              jinja_context=jinja_context,
                                              storygen_settings=storygen_settings)
 
-def _generate_document_files(document_bundle_name, document_config, storygen_settings: StorygenSettings):
+def _extract_document_story_tags(document_bundle_name, document_source, source_signature,
+                                 storygen_settings: StorygenSettings):
+    """Fill game-tags registries from the text of an ODT document, reusing its cached text if it didn't change"""
+    jinja_env = storygen_settings.jinja_env
+    extraction_cache = storygen_settings.document_extraction_cache
+
+    document_text = None
+    if extraction_cache is not None:
+        document_text = extraction_cache.get_extracted_text(document_bundle_name, source_signature)
+    if document_text is None:
+        document_text = extract_text_from_odt_file(document_source)
+
+    with isolated_story_tags_registries(jinja_env) as document_registries, \
+            jinja_env.record_loaded_templates() as template_names:
+        # No need for rendered output, we just fill game-tags registries
+        render_with_jinja_and_fact_tags(
+            content=document_text,
+            jinja_env=jinja_env,
+            jinja_context=dict(document_bundle_name=document_bundle_name))
+
+    if extraction_cache is not None:
+        extraction_cache.record_document(
+            document_bundle_name,
+            source_signature=source_signature,
+            text=document_text,
+            template_digests={name: jinja_env.get_template_digest(name) for name in sorted(template_names)},
+            story_tags_registries=document_registries)
+
+
+def _prepare_document_files(document_bundle_name, document_config, storygen_settings: StorygenSettings):
+    """
+    Fill game-tags registries from the text of a document bundle, and return the DocumentSplittingJob
+    which generates its PDF files, or None if they're up-to-date.
+
+    If caches are available, the text of a document bundle whose ODT source and templates didn't change
+    isn't extracted nor rendered again (the game-tags registries it filled are just replayed).
+    """
     logging.info("Processing generation of game document bundle '%s'" % document_bundle_name)
     document_source = document_config["document_source"]
-    document_text = extract_text_from_odt_file(document_source)
-
-    # No need for rendered output, we just fill game-tags registries
-    render_with_jinja_and_fact_tags(
-        content=document_text,
-        jinja_env=storygen_settings.jinja_env,
-        jinja_context=dict(document_bundle_name=document_bundle_name))
+    jinja_env = storygen_settings.jinja_env
+    extraction_cache = storygen_settings.document_extraction_cache
+
+    source_signature = get_odt_file_signature(document_source, member_names=ODT_TEXT_PARTS)
+    replayable_document_registries = None
+    if extraction_cache is not None:
+        replayable_document_registries = extraction_cache.get_replayable_story_tags_registries(
+            document_bundle_name, source_signature, get_template_digest=jinja_env.get_template_digest)
+    if replayable_document_registries is not None:
+        logging.info("Text of game document bundle '%s' is up-to-date, skipping its extraction", document_bundle_name)
+        merge_story_tags_registries(jinja_env, **replayable_document_registries)
+    else:
+        _extract_document_story_tags(document_bundle_name, document_source=document_source,
+                                     source_signature=source_signature, storygen_settings=storygen_settings)
 
     # We then split the PDF into parts
     output_relative_dir, ext = os.path.splitext(document_source)  # The basename becomes the name of the target FOLDER
     output_dir = storygen_settings.output_root_dir.joinpath(output_relative_dir)
     document_splitting = document_config["document_splitting"]
-    split_odt_file_into_separate_documents(
-        document_config["document_source"],
+    splitting_backend = storygen_settings.dynamic_settings.get("document_splitting_backend", "unoconv")
+
+    splitting_job = DocumentSplittingJob(
+        document_bundle_name=document_bundle_name,
+        document_source=document_source,
         splits_config=document_splitting,
-        output_dir=output_dir)
+        output_dir=output_dir,
+        backend=splitting_backend,
+        manifest_digest=compute_digest(get_odt_file_signature(document_source), json.dumps(document_splitting),
+                                       splitting_backend))
+
+    build_manifest = storygen_settings.build_manifest
+    output_files = [output_dir.joinpath(basename + ".pdf") for (basename, page_count) in document_splitting]
+    if build_manifest is not None and build_manifest.is_up_to_date(splitting_job.manifest_key,
+                                                                   splitting_job.manifest_digest, *output_files):
+        logging.info("PDF files of game document bundle '%s' are up-to-date, skipping its splitting", document_bundle_name)
+        return None
+    return splitting_job
+
+
+async def _split_document_files(splitting_job: DocumentSplittingJob, storygen_settings: StorygenSettings):
+    logging.info("Splitting game document bundle '%s' into PDF files", splitting_job.document_bundle_name)
+    converter_job_runner = storygen_settings.converter_job_runner
+    await split_odt_file_into_separate_documents_async(
+        splitting_job.document_source,
+        splits_config=splitting_job.splits_config,
+        output_dir=splitting_job.output_dir,
+        office_listener_pool=storygen_settings.office_listener_pool,
+        backend=splitting_job.backend,
+        run_command=functools.partial(converter_job_runner.run_command, "unoconv"))
+    if storygen_settings.build_manifest is not None:
+        storygen_settings.build_manifest.record(splitting_job.manifest_key, splitting_job.manifest_digest)
+
+
+def _generate_document_files(document_generation_tree: dict, storygen_settings: StorygenSettings):
+    """
+    Fill game-tags registries from all document bundles, in config order, and queue the splitting
+    of their PDF files in the converter job runner.
+
+    Bundles are then split concurrently, each with its own office listener (and thus its own port
+    and user profile), so that the number of listeners limits the number of bundles split at once.
+    """
+    for document_bundle_name, document_config in document_generation_tree.items():
+        splitting_job = _prepare_document_files(document_bundle_name, document_config=document_config,
+                                                storygen_settings=storygen_settings)
+        if splitting_job is not None:
+            storygen_settings.converter_job_runner.add_job(_split_document_files, splitting_job, storygen_settings)
 
 
 def _generate_summary_files(summary_config, storygen_settings: StorygenSettings):
@@ -184,11 +458,17 @@ def _generate_summary_files(summary_config, storygen_settings: StorygenSettings)
     if summary_config["game_facts_template"] and summary_config["game_facts_destination"]:
         logging.info("Processing special sheet for game facts")
         game_facts_template_name = summary_config["game_facts_template"]
-        has_serious_errors1, error_messages1 = detect_game_fact_errors(storygen_settings.jinja_env.facts_registry)
-        jinja_context = dict(facts_registry=storygen_settings.jinja_env.facts_registry,
-                             has_serious_errors=has_serious_errors1,
-                             error_messages=error_messages1,
-                             **storygen_settings.dynamic_variables)
+        facts_registry = storygen_settings.jinja_env.facts_registry
+        # Characters default to all players, including e.g. the game master and lore sheets
+        facts_matrix = (FactKnowledgeMatrix.from_registry(facts_registry,
+                                                          character_ids=summary_config.get("game_facts_characters"))
+                        if is_facts_matrix_available() else None)
+        has_serious_errors1, error_messages1 = detect_game_fact_errors(facts_registry, facts_matrix=facts_matrix)
+        jinja_context = storygen_settings.dynamic_variables.new_child(dict(
+            facts_registry=facts_registry,
+            facts_matrix=facts_matrix,  # For aggregate queries, None if NumPy is not installed
+            has_serious_errors=has_serious_errors1,
+            error_messages=error_messages1))
         render_with_jinja_and_convert_to_pdf(game_facts_template_name,
                                              relative_path=Path(summary_config["game_facts_destination"]),
                                              jinja_context=jinja_context,
@@ -198,10 +478,10 @@ def _generate_summary_files(summary_config, storygen_settings: StorygenSettings)
         logging.info("Processing special sheet for game symbols")
         game_symbols_template_name = summary_config["game_symbols_template"]
         has_serious_errors2, error_messages2 = detect_game_symbol_errors(storygen_settings.jinja_env.symbols_registry)
-        jinja_context = dict(symbols_registry=storygen_settings.jinja_env.symbols_registry,
-                             has_serious_errors=has_serious_errors2,
-                             error_messages=error_messages2,
-                             **storygen_settings.dynamic_variables)
+        jinja_context = storygen_settings.dynamic_variables.new_child(dict(
+            symbols_registry=storygen_settings.jinja_env.symbols_registry,
+            has_serious_errors=has_serious_errors2,
+            error_messages=error_messages2))
         render_with_jinja_and_convert_to_pdf(game_symbols_template_name,
                                              relative_path=Path(summary_config["game_symbols_destination"]),
                                              jinja_context=jinja_context,
@@ -211,10 +491,10 @@ def _generate_summary_files(summary_config, storygen_settings: StorygenSettings)
         logging.info("Processing special sheet for game items")
         game_items_template_name = summary_config["game_items_template"]
         has_serious_errors3, error_messages3 = detect_game_item_errors(storygen_settings.jinja_env.items_registry)
-        jinja_context = dict(items_registry=storygen_settings.jinja_env.items_registry,
-                             has_serious_errors=has_serious_errors3,
-                             error_messages=error_messages3,
-                             **storygen_settings.dynamic_variables)
+        jinja_context = storygen_settings.dynamic_variables.new_child(dict(
+            items_registry=storygen_settings.jinja_env.items_registry,
+            has_serious_errors=has_serious_errors3,
+            error_messages=error_messages3))
         render_with_jinja_and_convert_to_pdf(game_items_template_name,
                                              relative_path=Path(summary_config["game_items_destination"]),
                                              jinja_context=jinja_context,
@@ -235,22 +515,27 @@ def _handle_analysis_results(has_serious_errors, error_messages):
         logger_func(message)
 
 
-@click.command()
-@click.argument('project_dir', type=click.Path(exists=True, file_okay=False))
-@click.option('--verbose', '-v', is_flag=True, help="Print more output.")
-@click.option("-t", "--type", "selected_asset_types", type=click.Choice(['sheets', 'documents', 'inventories'], case_sensitive=False),
-                            multiple=True, help="Select the types of assets to generate")
-def cli(project_dir, verbose, selected_asset_types):
-    ##print("HELLO STARTING", selected_asset_types)
-    project_dir = os.path.abspath(project_dir).rstrip("\\/") + os.path.sep
+def _load_project_jinja_environment(build_root_dir, output_root_dir):
+    """Load the jinja environment of the project in current directory, with its caches in the build folder"""
+    # FIXME here add TEMPLATES_COMMON too
+    return load_jinja_environment(["."], use_macro_tags=True,
+                                  bytecode_cache_dir=build_root_dir.joinpath(JINJA_BYTECODE_CACHE_DIRNAME),
+                                  macro_index_file=build_root_dir.joinpath(MACRO_INDEX_FILENAME),
+                                  excluded_dirs=(build_root_dir, output_root_dir))
 
-    def _is_asset_type_enabled(_type):
-        assert _type.lower() == _type, _type
-        if _type == "summaries":
-            return (not selected_asset_types)  # We only generate summaries if ALL other assets have been generated too!
-        return (not selected_asset_types) or (_type in selected_asset_types)
 
-    logging.basicConfig(level=(logging.DEBUG if verbose else logging.INFO))
+def _prepare_project_settings(project_dir, force, office_listeners=0, converter_jobs=DEFAULT_CONCURRENCY_LIMIT):
+    """
+    Switch to the project directory, and return root StorygenSettings, with a fresh jinja environment
+    and build manifests, but not yet loaded from the project configuration.
+
+    If office_listeners > 0, a pool of persistent LibreOffice listeners is set up (and launched on first use),
+    it must be stopped by the caller.
+
+    At most converter_jobs rst2pdf subprocesses, and (at least one) office_listeners unoconv subprocesses,
+    are run at once by the converter job runner.
+    """
+    project_dir = os.path.abspath(project_dir).rstrip("\\/") + os.path.sep
 
     logging.debug("Switching to current working directory: %s", project_dir)
     os.chdir(project_dir)
@@ -261,40 +546,73 @@ def cli(project_dir, verbose, selected_asset_types):
     build_root_dir = Path("./_build") # FIXME
     os.makedirs(build_root_dir, exist_ok=True)
 
-    yaml_conf_file = "./configuration.yaml"   # FIXME
+    build_manifest_file = build_root_dir.joinpath("build_manifest.json")
+    build_manifest = BuildManifest(build_manifest_file) if force else BuildManifest.load(build_manifest_file)
+    dependency_manifest_file = build_root_dir.joinpath("sheet_dependencies.json")
+    dependency_manifest = (SheetDependencyManifest(dependency_manifest_file) if force
+                           else SheetDependencyManifest.load(dependency_manifest_file))
+    document_extraction_cache_file = build_root_dir.joinpath("document_extractions.json")
+    document_extraction_cache = (DocumentExtractionCache(document_extraction_cache_file) if force
+                                 else DocumentExtractionCache.load(document_extraction_cache_file))
 
-    # FIXME here add TEMPLATES_COMMON too
-    jinja_env = load_jinja_environment(["."], use_macro_tags=True)
+    jinja_env = _load_project_jinja_environment(build_root_dir, output_root_dir=output_root_dir)
 
-    project_data_tree = load_yaml_file(yaml_conf_file)
+    office_listener_pool = None
+    if office_listeners:
+        office_listener_pool = OfficeListenerPool(office_listeners,
+                                                  profiles_root_dir=build_root_dir.joinpath(OFFICE_PROFILES_DIRNAME))
 
-    storygen_settings = StorygenSettings(
+    return StorygenSettings(
         project_root_dir=project_dir,
         build_root_dir=build_root_dir,
         output_root_dir=output_root_dir,
         jinja_env=jinja_env,
         dynamic_variables=ChainMap(),
         dynamic_settings=ChainMap(),
+        build_manifest=build_manifest,
+        dependency_manifest=dependency_manifest,
+        office_listener_pool=office_listener_pool,
+        document_extraction_cache=document_extraction_cache,
+        converter_job_runner=ConverterJobRunner(concurrency_limits=dict(rst2pdf=converter_jobs,
+                                                                        unoconv=max(1, office_listeners))),
     )
-    storygen_settings = storygen_settings.derive(project_data_tree,
-                                                 project_dir=project_dir.replace("\\", "/"))
+
+
+def _load_project_configuration(root_storygen_settings: StorygenSettings):
+    """Return the project data tree, and the StorygenSettings derived from its root level"""
+    yaml_conf_file = "./configuration.yaml"   # FIXME
+
+    project_data_tree = load_yaml_file(yaml_conf_file,
+                                       cache_dir=root_storygen_settings.build_root_dir.joinpath(YAML_CACHE_DIRNAME))
+
+    project_dir = root_storygen_settings.project_root_dir
+    storygen_settings = root_storygen_settings.derive(project_data_tree,
+                                                      project_dir=project_dir.replace("\\", "/"))
     ####print(">>>>>>>>>>>", storygen_settings.dynamic_settings)
+    return project_data_tree, storygen_settings
 
-    if _is_asset_type_enabled("sheets"):
+
+def _generate_project_assets(project_data_tree, storygen_settings: StorygenSettings, is_asset_type_enabled,
+                             jobs=1):
+    """Generate all enabled assets, with deferred conversions (e.g. document splitting) being run concurrently at the end"""
+
+    converter_job_runner = storygen_settings.converter_job_runner
+    converter_job_runner.discard_pending_jobs()  # Leftovers of a previous failed generation
+
+    if is_asset_type_enabled("sheets"):
         # GENERATE FULL SHEETS AND CHEAT SHEETS
-        _recursively_generate_group_sheets(project_data_tree["sheet_generation"],
-                                           group_breadcrumb=(),
-                                           storygen_settings=storygen_settings)
+        _generate_group_sheets(project_data_tree["sheet_generation"],
+                               storygen_settings=storygen_settings,
+                               jobs=jobs)
 
-    if _is_asset_type_enabled("documents"):
+    if is_asset_type_enabled("documents"):
         # GENERATE GAME DOCUMENTS
         # No drivation of storygen_settings here, since jinja/rst2pdf is not used
         document_generation_tree = project_data_tree["document_generation"]
         if document_generation_tree:
-            for document_bundle_name, document_config in document_generation_tree.items():
-                _generate_document_files(document_bundle_name, document_config=document_config, storygen_settings=storygen_settings)
+            _generate_document_files(document_generation_tree, storygen_settings=storygen_settings)
 
-    if _is_asset_type_enabled("inventories"):
+    if is_asset_type_enabled("inventories"):
         # GENERATE INVENTORIES
         inventory_generation_tree = project_data_tree["inventory_generation"]
         if inventory_generation_tree:
@@ -303,12 +621,170 @@ def cli(project_dir, verbose, selected_asset_types):
                                           inventory_config=inventory_config,
                                           storygen_settings=storygen_settings)
 
-    if _is_asset_type_enabled("summaries"):
+    if is_asset_type_enabled("summaries"):
         # GENERATE SUMMARIES
         summary_config = project_data_tree["summary_generation"]
         _generate_summary_files(summary_config, storygen_settings=storygen_settings)
 
+    converter_job_runner.run_pending_jobs()
+
+    jinja_env = storygen_settings.jinja_env  # Sheets rendered in worker processes are not counted
+    logging.debug("Memoized renderings of template files: %d hits, %d misses",
+                  jinja_env.render_cache.hits, jinja_env.render_cache.misses)
+    logging.debug("Templates compiled from strings: %d hits, %d misses",
+                  jinja_env.string_template_cache.hits, jinja_env.string_template_cache.misses)
+
+
+def _save_build_manifests(storygen_settings: StorygenSettings):
+    storygen_settings.build_manifest.save()
+    storygen_settings.dependency_manifest.save()
+    storygen_settings.document_extraction_cache.save()
+
+
+def _stop_office_listeners(storygen_settings: StorygenSettings):
+    if storygen_settings.office_listener_pool is not None:
+        storygen_settings.office_listener_pool.stop()
+
+
+_converter_jobs_option = click.option(
+    "--converter-jobs", type=click.IntRange(min=1), default=DEFAULT_CONCURRENCY_LIMIT, show_default=True,
+    help="Maximum number of rst2pdf subprocesses running at once (with the \"subprocess\" rst2pdf backend).")
+
+_office_listeners_option = click.option(
+    "--office-listeners", type=click.IntRange(min=0), default=1, show_default=True,
+    help="Number of persistent LibreOffice instances, each with its own port and user profile, "
+         "i.e. of document bundles converted in parallel (0 to launch a new instance for each conversion).")
+
+
+@click.command()
+@click.argument('project_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--verbose', '-v', is_flag=True, help="Print more output.")
+@click.option("-t", "--type", "selected_asset_types", type=click.Choice(['sheets', 'documents', 'inventories'], case_sensitive=False),
+                            multiple=True, help="Select the types of assets to generate")
+@click.option("-j", "--jobs", type=click.IntRange(min=1), default=1, show_default=True,
+              help="Number of processes used to generate sheets in parallel.")
+@click.option("-f", "--force", is_flag=True, help="Regenerate all output files, even those which seem up-to-date.")
+@_office_listeners_option
+@_converter_jobs_option
+def cli(project_dir, verbose, selected_asset_types, jobs, force, office_listeners, converter_jobs):
+    """Generate all (or only some types of) assets of the project."""
+    ##print("HELLO STARTING", selected_asset_types)
+
+    def _is_asset_type_enabled(_type):
+        assert _type.lower() == _type, _type
+        if _type == "summaries":
+            return (not selected_asset_types)  # We only generate summaries if ALL other assets have been generated too!
+        return (not selected_asset_types) or (_type in selected_asset_types)
+
+    logging.basicConfig(level=(logging.DEBUG if verbose else logging.INFO))
+
+    root_storygen_settings = _prepare_project_settings(project_dir, force=force, office_listeners=office_listeners,
+                                                       converter_jobs=converter_jobs)
+    project_data_tree, storygen_settings = _load_project_configuration(root_storygen_settings)
+
+    try:
+        _generate_project_assets(project_data_tree, storygen_settings=storygen_settings,
+                                 is_asset_type_enabled=_is_asset_type_enabled, jobs=jobs)
+    finally:
+        # Even on failure, we keep track of the files which were successfully generated
+        _save_build_manifests(root_storygen_settings)
+        _stop_office_listeners(root_storygen_settings)
+
+
+def _snapshot_project_files(excluded_dirs):
+    """Return a (relative path -> (mtime, size)) mapping for all files of the project, in current directory"""
+    excluded_dirs = set(os.path.normpath(x) for x in excluded_dirs)
+    snapshot = {}
+    for dirpath, dirnames, filenames in os.walk("."):
+        dirnames[:] = [x for x in dirnames if os.path.normpath(os.path.join(dirpath, x)) not in excluded_dirs
+                       and not x.startswith(".")]
+        for filename in filenames:
+            path = os.path.normpath(os.path.join(dirpath, filename))
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # Deleted meanwhile
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+    return snapshot
+
+
+@click.command()
+@click.argument('project_dir', type=click.Path(exists=True, file_okay=False))
+@click.option('--verbose', '-v', is_flag=True, help="Print more output.")
+@click.option("-i", "--interval", type=click.FloatRange(min=0.1), default=1.0, show_default=True,
+              help="Delay in seconds between two polls of project files.")
+@_office_listeners_option
+@_converter_jobs_option
+def watch(project_dir, verbose, interval, office_listeners, converter_jobs):
+    """
+    Keep generating all assets of the project, each time its files change.
+
+    The jinja environment (with its compiled templates), rst2pdf renderers (until their stylesheets change)
+    and office listeners are kept alive between builds, and only sheets, documents and PDF files impacted by the changes get regenerated.
+    """
+    logging.basicConfig(level=(logging.DEBUG if verbose else logging.INFO))
+
+    root_storygen_settings = _prepare_project_settings(project_dir, force=False, office_listeners=office_listeners,
+                                                       converter_jobs=converter_jobs)
+    jinja_env = root_storygen_settings.jinja_env
+    excluded_dirs = (root_storygen_settings.build_root_dir, root_storygen_settings.output_root_dir)
+
+    project_data_tree = storygen_settings = None
+    previous_snapshot = {}
+
+    try:
+        while True:
+            snapshot = _snapshot_project_files(excluded_dirs)
+            if snapshot != previous_snapshot:
+                changed_files = sorted(path for path in (snapshot.keys() | previous_snapshot.keys())
+                                       if snapshot.get(path) != previous_snapshot.get(path))
+                if previous_snapshot:
+                    logging.info("Detected changes in project files: %s", ", ".join(changed_files))
+                try:
+                    has_macros_changes = False
+                    # On the first build, macros were all just registered by the jinja environment
+                    for path in (changed_files if previous_snapshot else ()):
+                        template_name = Path(path).as_posix()
+                        if template_name.endswith((".rst", ".txt")):  # Macros might be added, renamed or deleted
+                            has_macros_changes |= refresh_macros_from_template_file(jinja_env, template_name)
+                    if has_macros_changes:
+                        jinja_env.cache.clear()  # Compiled templates embed the imports of the macros they use
+                    if storygen_settings is None or "configuration.yaml" in changed_files:
+                        project_data_tree, storygen_settings = _load_project_configuration(root_storygen_settings)
+
+                    # Registries are filled again from scratch, most entries being replayed from caches
+                    jinja_env.facts_registry.clear()
+                    jinja_env.symbols_registry.clear()
+                    jinja_env.items_registry.clear()
+                    jinja_env.render_cache.clear()  # Templates might have changed
+
+                    _generate_project_assets(project_data_tree, storygen_settings=storygen_settings,
+                                             is_asset_type_enabled=lambda _type: True)
+                except Exception:
+                    storygen_settings = None  # Reload everything next time
+                    logging.exception("Error during the generation of project assets, waiting for further changes")
+                finally:
+                    _save_build_manifests(root_storygen_settings)
+
+                previous_snapshot = snapshot
+                logging.info("Watching project files for changes (press Ctrl-C to stop)...")
+
+            time.sleep(interval)
+
+    except KeyboardInterrupt:
+        logging.info("Stopping watch mode")
+    finally:
+        _stop_office_listeners(root_storygen_settings)
+
+
+@click.group()
+def storygen():
+    """Generate game sheets, documents, inventories and summaries from a storygen project."""
+
+
+storygen.add_command(cli, name="build")
+storygen.add_command(watch)
 
 
 if __name__ == "__main__":
-    cli()
\ No newline at end of file
+    cli()
@@ -0,0 +1,91 @@
+"""
+Asyncio-based execution of external converter commands (rst2pdf, unoconv...).
+
+Commands are launched from argument lists (no shell involved), and their stderr is captured, to be attached
+to errors. A ConverterJobRunner keeps many such commands in flight at once, with a concurrency limit per tool.
+"""
+import asyncio
+import logging
+import os
+
+DEFAULT_CONCURRENCY_LIMIT = os.cpu_count() or 1
+
+
+class ConverterCommandError(RuntimeError):
+    """An external converter command failed"""
+
+    def __init__(self, cmd, returncode, stderr):
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+        message = "Command %s failed with exit code %s" % (cmd, returncode)
+        if stderr.strip():
+            message += ", its error output was:\n%s" % stderr.rstrip()
+        super().__init__(message)
+
+
+async def run_converter_command(cmd):
+    """Run the command (a list of arguments), killing it if cancelled, and raise ConverterCommandError on failure"""
+    logging.debug("Executing command: %s", cmd)
+    process = await asyncio.create_subprocess_exec(*cmd, stderr=asyncio.subprocess.PIPE)
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    stderr = stderr.decode("utf8", errors="replace")
+    if process.returncode:
+        raise ConverterCommandError(cmd, returncode=process.returncode, stderr=stderr)
+    if stderr.strip():
+        logging.warning("Error output of successful command %s:\n%s", cmd, stderr.rstrip())
+
+
+def run_converter_command_sync(cmd):
+    """Same as run_converter_command(), for code not running in an event loop"""
+    asyncio.run(run_converter_command(cmd))
+
+
+class ConverterJobRunner:
+    """
+    Collects converter jobs (functions returning coroutines, which typically launch commands
+    through run_command()), and then runs them all concurrently in an event loop.
+
+    On the first failure, all other jobs are cancelled, and their commands killed.
+    """
+
+    def __init__(self, concurrency_limits=None):
+        self.concurrency_limits = dict(concurrency_limits or {})  # Tool name -> max number of running commands
+        self._pending_jobs = []
+        self._semaphores = {}
+
+    def add_job(self, job_function, *args):
+        self._pending_jobs.append((job_function, args))
+
+    def discard_pending_jobs(self):
+        self._pending_jobs = []
+
+    async def run_command(self, tool, cmd):
+        semaphore = self._semaphores.get(tool)
+        if semaphore is None:
+            limit = self.concurrency_limits.get(tool, DEFAULT_CONCURRENCY_LIMIT)
+            semaphore = self._semaphores[tool] = asyncio.Semaphore(limit)
+        async with semaphore:
+            await run_converter_command(cmd)
+
+    async def _run_jobs(self, jobs):
+        self._semaphores = {}  # Semaphores get bound to the event loop of each run
+        async with asyncio.TaskGroup() as task_group:
+            for job_function, args in jobs:
+                task_group.create_task(job_function(*args))
+
+    def run_pending_jobs(self):
+        jobs, self._pending_jobs = self._pending_jobs, []
+        if not jobs:
+            return
+        logging.info("Running %d pending converter jobs", len(jobs))
+        try:
+            asyncio.run(self._run_jobs(jobs))
+        except ExceptionGroup as exc_group:
+            raise exc_group.exceptions[0]  # The first failure, since other jobs then got cancelled
@@ -1,20 +1,43 @@
+import argparse
+import asyncio
+import atexit
+import collections
+import collections.abc
+import configparser
+import contextlib
 import copy
 import functools
+import hashlib
+import inspect
 import logging
 from pathlib import Path
 
 import jinja2
 import os
+import pickle
+import queue
 import re
+import shlex
+import shutil
+import socket
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 import textwrap
 import yaml
+import zipfile
 from jinja2 import nodes, lexer, Template, pass_context
 from jinja2.ext import Extension
 from jinja2.runtime import Context
 from markupsafe import Markup
 
-from pychronia_storygen.story_tags import StoryChecksExtension
+from pychronia_storygen.build_cache import MacroIndex, compute_digest, compute_file_digest
+from pychronia_storygen.converter_jobs import ConverterCommandError, run_converter_command, run_converter_command_sync
+from pychronia_storygen.pdf_annotations import remove_annotations_from_pdf_file, UnsupportedPdfStructure
+from pychronia_storygen.render_cache import RenderCache, RenderRecording, TrackingContext, StringTemplateCache
+from pychronia_storygen.story_tags import StoryChecksExtension, get_fact_recipient
 
 
 ###################################
@@ -22,10 +45,41 @@ from pychronia_storygen.story_tags import StoryChecksExtension
 ###################################
 
 
-def load_yaml_file(yaml_file):
-    with open(yaml_file, "r", encoding="utf8") as f:
-        data = yaml.load(f, Loader=yaml.SafeLoader)
-        return data
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)  # C-accelerated when PyYAML is built with libyaml
+
+YAML_CACHE_FORMAT_VERSION = 1
+
+
+def load_yaml_file(yaml_file, cache_dir=None):
+    """
+    If cache_dir is provided, parsed data is persisted there as pickle files, and reused
+    as long as the size, mtime and content digest of the YAML file are unchanged.
+    """
+    with open(yaml_file, "rb") as f:
+        stat = os.fstat(f.fileno())
+        raw_data = f.read()
+    if not cache_dir:
+        return yaml.load(raw_data.decode("utf8"), Loader=YAML_LOADER)
+
+    cache_key = (YAML_CACHE_FORMAT_VERSION, stat.st_size, stat.st_mtime_ns, compute_digest(raw_data))
+    cache_file = os.path.join(cache_dir, "%s.pickle" % compute_digest(os.path.abspath(yaml_file)))
+    try:
+        with open(cache_file, "rb") as f:
+            if pickle.load(f) == cache_key:  # Data is only unpickled if the key matches
+                return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as exc:  # Unpickling may raise about anything on corrupted data
+        logging.warning("Ignoring corrupted YAML cache file '%s': %r", cache_file, exc)
+
+    data = yaml.load(raw_data.decode("utf8"), Loader=YAML_LOADER)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+    with open(tmp_file, "wb") as f:
+        pickle.dump(cache_key, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_file, cache_file)  # Atomic, so that an interrupted build can't corrupt the cache
+    return data
 
 
 def load_rst_file(rst_file):
@@ -41,30 +95,82 @@ def _create_missing_parent_folders(path):
     if not os.path.exists(folder):
         os.makedirs(folder)
 
-def _convert_special_markups_and_punctuations(text):
-    text = text.replace("[BR]",
-                                textwrap.dedent("""
+_SPECIAL_MARKUP_REPLACEMENTS = {
+    "[BR]": textwrap.dedent("""
 
                                         .. raw:: pdf
 
                                            Spacer 0 15
 
-                                           """))
-    text = text.replace("[PAGEBREAK]",
-                                textwrap.dedent("""
+                                           """),
+    "[PAGEBREAK]": textwrap.dedent("""
 
                                         .. raw:: pdf
 
                                            PageBreak   
 
-                                        """))
-
+                                        """),
     # Basic fixing of orphan punctuation marks for FR language...
-    text = (text.replace(" !", u"\u00A0!")
-                .replace(" ?", u"\u00A0?")
-                .replace(" ;", u"\u00A0;")
-                .replace(" :\n", u"\u00A0:\n"))  # beware about RST directives here...
-    return text
+    " !": u"\u00A0!",
+    " ?": u"\u00A0?",
+    " ;": u"\u00A0;",
+    " :": u"\u00A0:",  # Only before a newline, beware about RST directives here...
+}
+
+# Single-pass equivalent of successive str.replace() calls; since [BR] and [PAGEBREAK] are replaced
+# by texts starting with a newline, a " :" just before them must be fixed too
+_SPECIAL_MARKUP_PATTERN = re.compile(r"\[BR\]|\[PAGEBREAK\]| [!?;]| :(?=\n|\[BR\]|\[PAGEBREAK\])")
+_SPECIAL_MARKUP_MAX_LENGTH = len(" :[PAGEBREAK]")  # Including lookahead
+
+RST_CHUNKS_MIN_SIZE = 64 * 1024  # Jinja generates lots of tiny chunks, we process them by blocks
+
+
+def _coalesce_chunks(chunks, min_size=RST_CHUNKS_MIN_SIZE):
+    """Group small string chunks into blocks of at least min_size characters (except the last one)"""
+    pieces = []
+    size = 0
+    for chunk in chunks:
+        pieces.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            yield "".join(pieces)
+            pieces = []
+            size = 0
+    if pieces:
+        yield "".join(pieces)
+
+
+def _iterate_converted_special_markups_and_punctuations(chunks):
+    """
+    Convert [BR] and [PAGEBREAK] to pdf spacings, and fix punctuation spaces, in a stream of text chunks.
+
+    The end of each chunk is kept pending until next chunk, in case a markup straddles their boundary.
+    """
+    pending_text = ""
+    for chunk in chunks:
+        buffer = pending_text + chunk if pending_text else chunk
+        limit = len(buffer) - _SPECIAL_MARKUP_MAX_LENGTH  # Matches starting before are fully determined
+        if limit <= 0:
+            pending_text = buffer
+            continue
+        pieces = []
+        position = 0
+        for match in _SPECIAL_MARKUP_PATTERN.finditer(buffer):
+            if match.start() >= limit:
+                break
+            pieces.append(buffer[position:match.start()])
+            pieces.append(_SPECIAL_MARKUP_REPLACEMENTS[match.group()])
+            position = match.end()
+        end = max(limit, position)
+        pieces.append(buffer[position:end])
+        pending_text = buffer[end:]
+        yield "".join(pieces)
+    if pending_text:
+        yield _SPECIAL_MARKUP_PATTERN.sub(lambda match: _SPECIAL_MARKUP_REPLACEMENTS[match.group()], pending_text)
+
+
+def _convert_special_markups_and_punctuations(text):
+    return "".join(_iterate_converted_special_markups_and_punctuations((text,)))
 
 
 def write_rst_file(rst_file, data):
@@ -88,14 +194,247 @@ def write_rst_file(rst_file, data):
         f.write(full_rst)
 
 
+def write_rst_chunks_to_file(rst_file, chunks):
+    """
+    Streaming variant of write_rst_file(), which consumes an iterable of text chunks, and
+    returns the digest of the written content.
+
+    Creates missing folders along the way.
+    """
+
+    _create_missing_parent_folders(rst_file)
+
+    hasher = hashlib.sha256()
+    with open(rst_file, "w", encoding="utf8") as f:
+        for chunk in _iterate_converted_special_markups_and_punctuations(_coalesce_chunks(chunks)):
+            hasher.update(chunk.encode("utf8"))
+            f.write(chunk)
+    return hasher.hexdigest()
+
+
 ####################################
 #     PROCESS DATA WITH JINJA2     #
 ####################################
 
 
-def load_jinja_environment(templates_root: list, use_macro_tags: bool):
+class StorygenEnvironment(jinja2.Environment):
+    """
+    Jinja environment able to record the names of all templates loaded during some renderings
+    (sheet parts, but also included/imported templates and macro files), for dependency tracking.
+
+    It can also memoize renderings of template files, along with their game-tags events, see RenderCache.
+    """
+
+    context_class = TrackingContext
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loaded_template_recorders = []
+        self.render_cache = RenderCache()  # Must be cleared when templates change
+        self.string_template_cache = StringTemplateCache()
+        self.active_render_recording = None
+        self._macros_signature = None  # Lazily computed, see get_macros_signature()
+
+    def _load_template(self, name, globals):
+        # Called even when the compiled template is already in cache
+        for recorder in self._loaded_template_recorders:
+            recorder.add(name)
+        if self.active_render_recording is not None:
+            self.active_render_recording.template_names.add(name)
+        return super()._load_template(name, globals)
+
+    def get_macros_signature(self):
+        """
+        Return a digest of the macro registry of jinja-macro-tags (if any), which can change e.g. in watch mode.
+
+        It is cached, so invalidate_macros_signature() must be called after each change of this registry.
+        """
+        macros = getattr(self, "macros", None)
+        if not macros:
+            return None
+        if self._macros_signature is None:
+            self._macros_signature = compute_digest(
+                repr((sorted(macros.templates.items()), sorted(macros.aliases.items()))))
+        return self._macros_signature
+
+    def invalidate_macros_signature(self):
+        self._macros_signature = None
+
+    def get_string_template(self, source):
+        """Like from_string(), but templates are only compiled once per distinct source (and macro registry)"""
+        return self.string_template_cache.get_template(source, compile_template=self.from_string,
+                                                       environment_signature=self.get_macros_signature())
+
+    def generate_with_render_cache(self, filename, jinja_context):
+        """
+        Like generate_with_jinja(), but reuse the output of a previous rendering of the same template,
+        if the context variables it read have the same values, and replay its game-tags events.
+        """
+        if self.active_render_recording is not None:  # Nested renderings are part of the outer recording
+            yield from _generate_from_template(self.get_template(filename), jinja_context)
+            return
+
+        fact_recipient = get_fact_recipient(jinja_context)
+        render_result = self.render_cache.lookup(filename, jinja_context, self.globals, fact_recipient=fact_recipient)
+        if render_result is not None:
+            for recorder in self._loaded_template_recorders:
+                recorder.update(render_result.template_names)
+            self.replay_story_tag_events(render_result, fact_recipient=fact_recipient)
+            yield render_result.output
+            return
+
+        recording = RenderRecording(fact_recipient=fact_recipient, template_names={filename})
+        output_chunks = []
+        template_chunks = None
+        while True:
+            # Only active while generating a chunk, since generation might be interleaved with other renderings
+            self.active_render_recording = recording
+            try:
+                if template_chunks is None:
+                    template_chunks = _generate_from_template(self.get_template(filename), jinja_context)
+                chunk = next(template_chunks, None)
+            finally:
+                self.active_render_recording = None
+            if chunk is None:
+                break
+            output_chunks.append(chunk)
+            yield chunk
+        self.render_cache.store(filename, jinja_context, self.globals, recording=recording, output="".join(output_chunks))
+
+    @contextlib.contextmanager
+    def record_loaded_templates(self):
+        """Yield a set which gets filled with the names of templates loaded while in this context"""
+        template_names = set()
+        self._loaded_template_recorders.append(template_names)
+        try:
+            yield template_names
+        finally:
+            self._loaded_template_recorders.remove(template_names)
+
+    def get_template_digest(self, name):
+        """Return the digest of the source of a template, or None if it doesn't exist (anymore)"""
+        try:
+            source, _filename, _uptodate = self.loader.get_source(self, name)
+        except jinja2.TemplateNotFound:
+            return None
+        return compute_digest(source)
+
+
+class StorygenBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """
+    On-disk cache of compiled templates, for faster cold starts.
+
+    Jinja already checks that the source of a template didn't change, but cache keys must also depend
+    on the configuration of the environment, since extensions (e.g. StoryChecksExtension) and the
+    macro registry of jinja-macro-tags change the python code generated for templates.
+    """
+
+    def __init__(self, directory, jinja_env):
+        os.makedirs(directory, exist_ok=True)
+        super().__init__(directory=str(directory))
+        self.jinja_env = jinja_env
+        extension_names = sorted(jinja_env.extensions.keys())
+        extension_sources_digests = [compute_file_digest(inspect.getsourcefile(type(extension)))
+                                     for (_name, extension) in sorted(jinja_env.extensions.items())]
+        self._static_environment_signature = compute_digest(
+            jinja2.__version__,
+            repr([jinja_env.trim_blocks, jinja_env.lstrip_blocks, jinja_env.keep_trailing_newline,
+                  jinja_env.block_start_string, jinja_env.variable_start_string, jinja_env.comment_start_string]),
+            repr(extension_names),
+            repr(extension_sources_digests))
+
+    def _get_environment_signature(self):
+        return compute_digest(self._static_environment_signature, self.jinja_env.get_macros_signature())
+
+    def get_cache_key(self, name, filename=None):
+        return compute_digest(self._get_environment_signature(), name, filename)
+
+
+def _register_macros_from_template_files(jinja_env, templates_root: list, excluded_dirs=(), macro_index=None):
+    """
+    Register in the jinja-macro-tags registry the macros defined in RST/TXT templates, without compiling
+    these templates (they only get compiled when a macro is first imported).
+
+    We do similarly to jinja_env.macros.register_from_environment(), but for RST files, and template
+    files are only read if they changed since they were indexed in macro_index; they are then cheaply
+    pre-filtered on the "macro" keyword, before being scanned with a regex.
+    """
+    excluded_dirs = set(os.path.abspath(x) for x in excluded_dirs)
+    template_names = set()
+
+    for templates_dir in templates_root:
+        for dirpath, dirnames, filenames in os.walk(templates_dir):
+            dirnames[:] = sorted(x for x in dirnames if os.path.abspath(os.path.join(dirpath, x)) not in excluded_dirs)
+
+            for filename in sorted(filenames):
+                if not filename.endswith((".rst", ".txt")):  # FIXME add .j2/.jinja extensions here!
+                    continue
+                template_path = os.path.join(dirpath, filename)
+                template_name = Path(os.path.relpath(template_path, templates_dir)).as_posix()
+                if template_name in template_names:
+                    continue  # Shadowed by the same template in a previous templates dir
+                template_names.add(template_name)
+
+                stat = os.stat(template_path)
+                file_signature = [stat.st_mtime_ns, stat.st_size]
+                macro_names = macro_index.get_macro_names(template_name, file_signature) if macro_index else None
+
+                if macro_names is None:
+                    logging.debug("Searching for jinja2 macros in template %s", template_name)
+                    with open(template_path, "rb") as f:
+                        data = f.read()
+                    macro_names = (jinja_env.macros.macro_regexp.findall(data.decode("utf8"))
+                                   if b"macro" in data else [])
+                    if macro_index:
+                        macro_index.record_macro_names(template_name, file_signature, macro_names)
+
+                for macro_name in macro_names:
+                    jinja_env.macros.register(macro_name, template_name)
+    jinja_env.invalidate_macros_signature()
+
+    if macro_index:
+        macro_index.forget_other_templates(template_names)
+        if macro_index.updated_entries:
+            macro_index.save()
+
+
+def refresh_macros_from_template_file(jinja_env, template_name):
+    """
+    Register again the macros of a template file which changed or was deleted, so that macros it
+    doesn't define anymore get unregistered. Return True if the macro registry changed.
+    """
+    macros = jinja_env.macros
+    previous_macro_templates = dict(macros.templates)
+    for macro_name, macro_template_name in previous_macro_templates.items():
+        if macro_template_name == template_name:
+            del macros.templates[macro_name]
+    try:
+        macros.register_from_template(template_name, replace=True)
+    except jinja2.TemplateNotFound:
+        pass  # Deleted template
+    jinja_env.invalidate_macros_signature()
+    return macros.templates != previous_macro_templates
+
+
+def _convert_to_json_compatible(value):
+    """Let the |tojson filter serialize read-only views (e.g. inventory items) like the dicts/lists they replace"""
+    if isinstance(value, collections.abc.Mapping):
+        return dict(value)
+    if isinstance(value, (collections.abc.Sequence, collections.abc.Set)):
+        return list(value)
+    raise TypeError("Object of type %s is not JSON serializable" % type(value).__name__)
+
+
+def load_jinja_environment(templates_root: list, use_macro_tags: bool, bytecode_cache_dir=None,
+                           macro_index_file=None, excluded_dirs=()):
+    """
+    If bytecode_cache_dir is provided, compiled templates are persisted there between runs.
+
+    If macro_index_file is provided, the macros defined by each template are persisted there between runs.
+    Folders in excluded_dirs (e.g. build folders) are not searched for macros.
+    """
     # IMPORTANT - we refuse undefined template vars: exceptions get raised instead
-    jinja_env = jinja2.Environment(undefined=jinja2.StrictUndefined,
+    jinja_env = StorygenEnvironment(undefined=jinja2.StrictUndefined,
                                    loader=jinja2.FileSystemLoader(templates_root),
                                    trim_blocks=False,
                                    lstrip_blocks=False,
@@ -106,49 +445,120 @@ def load_jinja_environment(templates_root: list, use_macro_tags: bool):
         return render_with_jinja_and_fact_tags(content=value, jinja_env=jinja_env, jinja_context=context)
 
     jinja_env.filters['dangerous_render'] = dangerous_render
+    jinja_env.policies["json.dumps_kwargs"] = dict(jinja_env.policies["json.dumps_kwargs"],
+                                                   default=_convert_to_json_compatible)
 
     if use_macro_tags:
         # Requires https://github.com/frascoweb/jinja-macro-tags or a fork
         from jinja_macro_tags import configure_environment
         configure_environment(jinja_env)
 
-        # We do similarly to jinja_env.macros.register_from_environment(), but for RST files!
-        templates = jinja_env.macros.environment.list_templates(extensions=("rst", "txt"))  # FIXME add .j2/.jinja extensions here!
-        for tpl in templates:
-            logging.debug("Searching for jinja2 macros in template %s", tpl)
-            jinja_env.macros.register_from_template(tpl)
+        macro_index = MacroIndex.load(macro_index_file) if macro_index_file else None
+        _register_macros_from_template_files(jinja_env, templates_root=templates_root,
+                                             excluded_dirs=excluded_dirs, macro_index=macro_index)
+
+    if bytecode_cache_dir:
+        # Must be set up once the environment is fully configured
+        jinja_env.bytecode_cache = StorygenBytecodeCache(bytecode_cache_dir, jinja_env=jinja_env)
 
     return jinja_env
 
 
-def render_with_jinja(content=None, filename=None, *, jinja_env, jinja_context):
-    """Simple rendering, without extra steps"""
-    assert isinstance(jinja_context, (dict, Context)), type(jinja_context)
+def _generate_from_template(template, jinja_context):
+    """
+    Like template.generate(jinja_context), but ChainMap (and jinja Context) variables are resolved lazily
+    through their layers, template globals being the last one, instead of being flattened into new dicts.
+    """
+    if isinstance(jinja_context, Context):
+        jinja_context = collections.ChainMap(jinja_context.vars, jinja_context.parent)
+    if not isinstance(jinja_context, collections.ChainMap):
+        return template.generate(jinja_context)
+    context = template.new_context(collections.ChainMap(*jinja_context.maps, template.globals), shared=True)
+    return _generate_from_context(template, context)
+
+
+def _generate_from_context(template, context):
+    try:
+        yield from template.root_render_func(context)
+    except Exception:
+        yield template.environment.handle_exception()
+
+
+def _load_jinja_template(content=None, filename=None, *, jinja_env, jinja_context):
+    assert isinstance(jinja_context, (dict, Context, collections.ChainMap)), type(jinja_context)
     assert bool(content) ^ bool(filename), (content, filename)
     assert content is None or isinstance(content, (str, bytes)), repr(content)
     #print("<<<RENDERING CONTENT>>>\n %s" % content[:1000].encode("ascii", "ignore"))
     if filename:
         template = jinja_env.get_template(filename)
+    elif isinstance(jinja_env, StorygenEnvironment):
+        template = jinja_env.get_string_template(content)
     else:
         template = jinja_env.from_string(content)
-    output = template.render(jinja_context)
+    return template
+
+
+def render_with_jinja(content=None, filename=None, *, jinja_env, jinja_context):
+    """Simple rendering, without extra steps"""
+    template = _load_jinja_template(content=content, filename=filename, jinja_env=jinja_env, jinja_context=jinja_context)
+    output = "".join(_generate_from_template(template, jinja_context))
     return output
 
 
+def generate_with_jinja(content=None, filename=None, *, jinja_env, jinja_context):
+    """Like render_with_jinja(), but return an iterator over chunks of output"""
+    template = _load_jinja_template(content=content, filename=filename, jinja_env=jinja_env, jinja_context=jinja_context)
+    return _generate_from_template(template, jinja_context)
+
+
+def _generate_with_jinja_and_render_cache(content=None, filename=None, *, jinja_env, jinja_context):
+    """Renderings of template files are memoized, when the environment supports it"""
+    if filename and isinstance(jinja_env, StorygenEnvironment):
+        assert isinstance(jinja_context, (dict, Context, collections.ChainMap)), type(jinja_context)
+        return jinja_env.generate_with_render_cache(filename, jinja_context)
+    return generate_with_jinja(content=content, filename=filename, jinja_env=jinja_env, jinja_context=jinja_context)
+
+
 def render_with_jinja_and_fact_tags(content=None, filename=None, *, jinja_env, jinja_context):  # FIXME rename this
     """
-    Renders content and analyses/removes the {% fact %} markers from output.
+    Renders content while registering its {% fact %} tags.
+
+    Fact tags report their facts directly during generation, so the output doesn't need to be scanned for markers.
     """
-    output_tagged = render_with_jinja(content=content, filename=filename, jinja_env=jinja_env, jinja_context=jinja_context)
-    output = jinja_env.extract_facts_from_intermediate_markup(output_tagged)  # must exist
+    output_chunks = _generate_with_jinja_and_render_cache(content=content, filename=filename, jinja_env=jinja_env, jinja_context=jinja_context)
+    output = "".join(jinja_env.iterate_with_fact_events(output_chunks))  # must exist
     return output
 
 
+def generate_with_jinja_and_fact_tags(content=None, filename=None, *, jinja_env, jinja_context):
+    """
+    Like render_with_jinja_and_fact_tags(), but return an iterator over (coalesced) chunks of cleaned output.
+
+    Facts are only registered once this iterator is exhausted.
+    """
+    output_chunks = _generate_with_jinja_and_render_cache(content=content, filename=filename, jinja_env=jinja_env, jinja_context=jinja_context)
+    return _coalesce_chunks(jinja_env.iterate_with_fact_events(output_chunks))  # must exist
+
+
 ###################################
 #      LOAD DOCUMENT FILES        #
 ###################################
 
 
+ODT_TEXT_PARTS = ("content.xml", "styles.xml")  # Zip members which the extracted text depends on
+
+
+def get_odt_file_signature(odt_file, member_names=None):
+    """
+    Return a signature of some (by default, all) members of the ODT zip archive, made of the CRC32 checksums
+    and sizes stored in its central directory, so that nothing needs to be decompressed.
+    """
+    with zipfile.ZipFile(odt_file) as odt_zip:
+        infos = ([odt_zip.getinfo(name) for name in member_names] if member_names is not None
+                 else sorted(odt_zip.infolist(), key=lambda info: info.filename))
+        return ";".join("%s:%08x:%d" % (info.filename, info.CRC, info.file_size) for info in infos)
+
+
 def extract_text_from_odt_file(clues_file):
     """
     Extract texts and comments from LibreOffice ODT file.
@@ -160,81 +570,467 @@ def extract_text_from_odt_file(clues_file):
 
 
 
-def split_odt_file_into_separate_documents(input_filename, splits_config, output_dir):
+UNOCONV_SCRIPT = os.path.join(os.path.dirname(__file__), 'unoconv.py')
+
+
+OFFICE_LISTENER_LAUNCH_ATTEMPTS = 3
+
+
+def is_tcp_port_listened(port):
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+def find_free_tcp_port():
+    """Return a local TCP port that nothing listens on, as chosen by the OS"""
+    while True:
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        if not is_tcp_port_listened(port):  # Could have been taken meanwhile
+            return port
+
+
+class OfficeListenerPool:
+    """
+    Pool of persistent headless LibreOffice instances, each launched once (through "unoconv --listener")
+    with its own free port and temporary user profile, so that document conversions don't pay the office
+    startup cost, and concurrent storygen runs never share office instances.
+
+    Listeners are only launched on first use, and must be shut down with stop().
+    """
+
+    def __init__(self, size, profiles_root_dir, startup_timeout=60):
+        assert size >= 1, size
+        self.size = size
+        self.profiles_root_dir = os.path.abspath(profiles_root_dir)
+        self.startup_timeout = startup_timeout
+        self._processes = []
+        self._profile_dirs = []
+        self._available_ports = queue.Queue()
+        self._lock = threading.Lock()
+
+    def _start_listener(self):
+        port = find_free_tcp_port()
+        os.makedirs(self.profiles_root_dir, exist_ok=True)
+        profile_dir = tempfile.mkdtemp(prefix="listener_%d_" % port, dir=self.profiles_root_dir)
+        self._profile_dirs.append(profile_dir)
+        cmd = [sys.executable, UNOCONV_SCRIPT, "--listener", "--port", str(port), "--user-profile", profile_dir]
+        logging.info("Launching persistent LibreOffice listener on port %s", port)
+        logging.debug("Listener command: %s", cmd)
+        process = subprocess.Popen(cmd)
+        self._processes.append(process)
+        return process, port
+
+    def _wait_for_listener(self, process, port):
+        """
+        Return True once the listener accepts connections, or False if it exited instead (e.g. because
+        another office instance started listening on the same port meanwhile).
+        """
+        deadline = time.monotonic() + self.startup_timeout
+        while process.poll() is None:
+            if is_tcp_port_listened(port):
+                return process.poll() is None  # Else, the office instance answering isn't ours
+            if time.monotonic() >= deadline:
+                raise RuntimeError("LibreOffice listener on port %s didn't start within %s seconds"
+                                   % (port, self.startup_timeout))
+            time.sleep(0.5)
+        return False
+
+    def start(self):
+        with self._lock:
+            if self._processes:
+                return  # Already started
+            atexit.register(self.stop)  # In case stop() isn't called explicitly
+            listeners = [self._start_listener() for _idx in range(self.size)]
+            for process, port in listeners:
+                attempt = 1
+                while not self._wait_for_listener(process, port):
+                    if attempt >= OFFICE_LISTENER_LAUNCH_ATTEMPTS:
+                        raise RuntimeError("LibreOffice listener on port %s exited with code %s (is another office "
+                                           "instance using this port?)" % (port, process.returncode))
+                    logging.warning("LibreOffice listener on port %s exited with code %s, launching it on another port",
+                                    port, process.returncode)
+                    process, port = self._start_listener()
+                    attempt += 1
+                self._available_ports.put(port)
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """Yield the port of a running listener, reserved for the caller until the end of the block"""
+        self.start()
+        port = self._available_ports.get()
+        try:
+            yield port
+        finally:
+            self._available_ports.put(port)
+
+    @contextlib.asynccontextmanager
+    async def acquire_async(self):
+        """Same as acquire(), but waiting for a listener without blocking the event loop"""
+        await asyncio.to_thread(self.start)
+        while True:
+            try:
+                port = self._available_ports.get_nowait()
+                break
+            except queue.Empty:
+                await asyncio.sleep(0.1)
+        try:
+            yield port
+        finally:
+            self._available_ports.put(port)
+
+    def stop(self):
+        with self._lock:
+            for process in self._processes:
+                process.terminate()  # unoconv terminates its office instance on SIGTERM
+            for process in self._processes:
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    logging.warning("LibreOffice listener (pid=%s) didn't stop in time, killing it", process.pid)
+                    process.kill()
+                    process.wait()
+            for profile_dir in self._profile_dirs:
+                shutil.rmtree(profile_dir, ignore_errors=True)
+            self._processes = []
+            self._profile_dirs = []
+            self._available_ports = queue.Queue()
+            atexit.unregister(self.stop)
+
+
+# How ODT files are split into separate PDF documents: either by exporting each page range with
+# LibreOffice ("unoconv" backend), or by exporting the whole document once and then splitting
+# its pages in pure python ("pypdf" backend)
+DOCUMENT_SPLITTING_BACKENDS = ("unoconv", "pypdf")
+
+
+def split_odt_file_into_separate_documents(input_filename, splits_config, output_dir, office_listener_pool=None,
+                                           backend="unoconv"):
+    """
+    Export each page range of the ODT file to a separate PDF file.
+
+    If an office_listener_pool is given, its persistent LibreOffice instances are used, else each
+    unoconv call launches its own.
+    """
+    asyncio.run(split_odt_file_into_separate_documents_async(input_filename, splits_config, output_dir,
+                                                             office_listener_pool=office_listener_pool,
+                                                             backend=backend))
+
+
+async def split_odt_file_into_separate_documents_async(input_filename, splits_config, output_dir,
+                                                       office_listener_pool=None, backend="unoconv",
+                                                       run_command=run_converter_command):
+    """
+    Same as split_odt_file_into_separate_documents(), but as a coroutine, whose unoconv commands are
+    launched by the run_command coroutine function (e.g. that of a ConverterJobRunner).
+    """
+    assert backend in DOCUMENT_SPLITTING_BACKENDS, backend
+    if office_listener_pool is not None:
+        async with office_listener_pool.acquire_async() as port:
+            return await _split_odt_file_into_separate_documents(input_filename, splits_config, output_dir,
+                                                                 unoconv_args=["--port", str(port), "--no-launch"],
+                                                                 backend=backend, run_command=run_command)
+    return await _split_odt_file_into_separate_documents(input_filename, splits_config, output_dir, unoconv_args=[],
+                                                         backend=backend, run_command=run_command)
+
+
+async def _split_odt_file_into_separate_documents(input_filename, splits_config, output_dir, unoconv_args, backend,
+                                                  run_command):
     input_filename = os.path.abspath(os.path.normpath(input_filename))
     output_dir = os.path.abspath(os.path.normpath(output_dir))
     os.makedirs(output_dir, exist_ok=True)
 
-    unoconv_script = os.path.join(os.path.dirname(__file__), 'unoconv.py')
-
+    page_splits = []  # (output filename, first page, last page) tuples, with 1-based inclusive page numbers
     current_page = 1
     for idx, (basename, page_count) in enumerate(splits_config):
         prefix = ""  # or ("%02d_" % idx) if debugging needed
         output_filename = os.path.join(output_dir, prefix + basename + ".pdf")
-        variables = dict(python_executable=sys.executable,
-                         unoconv_script=unoconv_script,
-                         input=input_filename,
-                         output=output_filename,
-                         page_range='%s-%s' % (current_page, current_page + page_count - 1))
-        cmd = '%(python_executable)s "%(unoconv_script)s" -f pdf -o "%(output)s" -e PageRange=%(page_range)s "%(input)s"' % variables
-        logging.debug("Splitting PDF with command: %s", cmd)
-        res = os.system(cmd)
-        assert res == 0, "Error during pdf-splitting command execution"
-
-        # IMPORTANT - remove GAMEMASTER ANNOTATIONS from PDF file
-        # (BEWARE, this seems to CORRUPT a bit the PDF, find a better REGEX someday?)
-        with open(output_filename, 'rb') as f:
-            data = f.read()
-        if b'Annots' not in data :
-            logging.warning("No annotations/comments found in PDF document '%s', each separate game document should have its own for the gamemasters",output_filename)
-        else:
-            regex = br'/Annots\s*\[[^]]+\]'
-            data = re.sub(regex, b'', data, flags=re.MULTILINE)
-            assert b'Annots' not in data  # no more clues VISIBLE (but they are still hidden in PDF file alas)
-            with open(output_filename, 'wb') as f:
-                f.write(data)
-
+        page_splits.append((output_filename, current_page, current_page + page_count - 1))
         current_page += page_count
 
+    if backend == "pypdf":
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            full_pdf_file = os.path.join(tmp_dir, "full_document.pdf")
+            await run_command(_get_unoconv_command(input_filename, unoconv_args, "-o", full_pdf_file))
+            await asyncio.to_thread(_split_pdf_file_by_page_ranges, full_pdf_file, page_splits)
+    else:
+        try:
+            # Export all page ranges with a single unoconv call, which loads the document only once
+            split_args = []
+            for output_filename, first_page, last_page in page_splits:
+                split_args += ["--split", "%s-%s:%s" % (first_page, last_page, output_filename)]
+            await run_command(_get_unoconv_command(input_filename, unoconv_args, *split_args))
+        except ConverterCommandError as exc:
+            logging.warning("Batch splitting of '%s' failed, falling back to one export per page range (%s)",
+                            input_filename, exc)
+            for output_filename, first_page, last_page in page_splits:
+                await run_command(_get_unoconv_command(input_filename, unoconv_args, "-o", output_filename,
+                                                       "-e", "PageRange=%s-%s" % (first_page, last_page)))
+
+    for output_filename, first_page, last_page in page_splits:
+        await asyncio.to_thread(_remove_annotations_from_pdf_file, output_filename)
+
+
+def _get_unoconv_command(input_filename, unoconv_args, *export_args):
+    return [sys.executable, UNOCONV_SCRIPT, "-f", "pdf", *export_args, *unoconv_args, input_filename]
+
+
+def _split_pdf_file_by_page_ranges(pdf_file, page_splits):
+    """Write each (1-based, inclusive) page range of the PDF file to its own output file"""
+    import pypdf
+    reader = pypdf.PdfReader(pdf_file)
+    total_page_count = len(reader.pages)
+    expected_page_count = sum(last_page - first_page + 1 for (_, first_page, last_page) in page_splits)
+    assert expected_page_count == total_page_count, \
+        "Document splitting config covers %d pages, but exported PDF '%s' has %d pages" % (
+            expected_page_count, pdf_file, total_page_count)
+    for output_filename, first_page, last_page in page_splits:
+        writer = pypdf.PdfWriter()
+        for page in reader.pages[first_page - 1:last_page]:
+            writer.add_page(page)
+        with open(output_filename, "wb") as f:
+            writer.write(f)
+
+
+def _remove_annotations_from_pdf_file(pdf_file):
+    # IMPORTANT - remove GAMEMASTER ANNOTATIONS from PDF file
+    try:
+        annotated_page_count = remove_annotations_from_pdf_file(pdf_file)
+    except UnsupportedPdfStructure as exc:
+        logging.debug("Falling back to pypdf to remove annotations from PDF document '%s' (%s)", pdf_file, exc)
+        annotated_page_count = _remove_annotations_from_pdf_file_with_pypdf(pdf_file)
+    if not annotated_page_count:
+        logging.warning("No annotations/comments found in PDF document '%s', each separate game document should have its own for the gamemasters", pdf_file)
+
+
+def _remove_annotations_from_pdf_file_with_pypdf(pdf_file):
+    """Slower fallback, which loads the whole PDF file in memory"""
+    import pypdf
+    writer = pypdf.PdfWriter(clone_from=pdf_file)
+    annotated_page_count = 0
+    for page in writer.pages:
+        if "/Annots" in page:
+            del page["/Annots"]
+            annotated_page_count += 1
+    if annotated_page_count:
+        with open(pdf_file, "wb") as f:
+            writer.write(f)
+    return annotated_page_count
+
 
 
 ####################################
 #      CONVERT MARKUP TO PDF       #
 ####################################
 
-def convert_rst_file_to_pdf(rst_file, pdf_file, conf_file="", extra_args=""):
+# Options always given to rst2pdf, whatever the rendering backend
+# (fit-background-mode=scale doesn't work in config file, at the moment...)
+# other options: --very-verbose --show-frame-boundary or just "-v"
+RST2PDF_COMMON_ARGS = ["--fit-background-mode=scale", "--first-page-on-right", "--smart-quotes=2", "--break-side=any",
+                       "-e", "dotted_toc", "--fit-literal-mode=shrink"]
+
+RST2PDF_BACKENDS = ("library", "subprocess")
+
+
+class Rst2pdfRenderer:
+    """
+    In-process rst2pdf converter, which imports ReportLab/docutils, parses the config
+    file and loads stylesheets only once, and then renders any number of RST files.
+    """
+
+    def __init__(self, conf_file="", extra_args=""):
+        from rst2pdf import config, createpdf  # Heavy imports, only done when this backend is used
+
+        args = ["--config=%s" % conf_file] + RST2PDF_COMMON_ARGS + shlex.split(extra_args)
+
+        if conf_file:
+            # Like in createpdf.main(), the config file changes the defaults of the commandline parser
+            config.parseConfig(conf_file)
+        options, positional_args = createpdf.parse_commandline().parse_args(args)
+        assert not positional_args, positional_args  # Input/output files are given to convert() instead
+
+        # Same normalization of options as in createpdf.main()
+        options.style = [x for x in ",".join(options.style).split(",") if x]
+        options.fpath = (options.fpath.split(os.pathsep) if options.fpath else []) + \
+                        ([options.ffolder] if options.ffolder else [])
+        options.stylepath = options.stylepath.split(os.pathsep) if options.stylepath else []
+        if options.real_footnotes:
+            options.inline_footnotes = True
+        createpdf.add_extensions(options)
+
+        self.options = options
+        self.renderer = createpdf.RstToPdf(
+            stylesheets=options.style,
+            language=options.language,
+            header=options.header,
+            footer=options.footer,
+            inlinelinks=options.inlinelinks,
+            breaklevel=int(options.breaklevel),
+            baseurl=options.baseurl,
+            fit_mode=options.fit_mode,
+            background_fit_mode=options.background_fit_mode,
+            smarty=str(options.smarty),
+            font_path=options.fpath,
+            style_path=options.stylepath,
+            repeat_table_rows=options.repeattablerows,
+            footnote_backlinks=options.footnote_backlinks,
+            inline_footnotes=options.inline_footnotes,
+            real_footnotes=options.real_footnotes,
+            def_dpi=int(options.def_dpi),
+            show_frame=options.show_frame,
+            splittables=options.splittables,
+            blank_first_page=options.blank_first_page,
+            first_page_on_right=options.first_page_on_right,
+            breakside=options.breakside,
+            custom_cover=options.custom_cover,
+            floating_images=options.floating_images,
+            numbered_links=options.numbered_links,
+            raw_html=options.raw_html,
+            section_header_depth=int(options.section_header_depth),
+            strip_elements_with_classes=options.strip_elements_with_classes,
+        )
+
+    def convert(self, rst_file, pdf_file):
+        renderer = self.renderer
+
+        # Reset the per-document state that RstToPdf.createPdf() doesn't reinitialize by itself
+        renderer.basedir = os.path.dirname(os.path.abspath(rst_file))
+        renderer.doc_title = renderer.doc_title_clean = renderer.doc_subtitle = renderer.doc_author = ""
+        renderer.toc_depth = 0
+        renderer.mustMultiBuild = renderer.real_footnotes
+
+        with open(rst_file, "rb") as f:
+            rst_data = f.read()
+
+        res = renderer.createPdf(text=rst_data,
+                                 source_path=str(rst_file),
+                                 output=str(pdf_file),
+                                 compressed=self.options.compressed)
+        assert not res, "Error when calling rst2pdf library on %s" % rst_file
+
+
+@functools.lru_cache(maxsize=16)
+def _load_rst2pdf_renderer(conf_file, extra_args, settings_digest):
+    logging.debug("Loading in-process rst2pdf renderer with config file '%s' and extra args '%s'", conf_file, extra_args)
+    return Rst2pdfRenderer(conf_file=conf_file, extra_args=extra_args)
+
+
+def _get_rst2pdf_renderer(conf_file, extra_args):
+    """
+    Renderers are reused, one per distinct rst2pdf configuration, until the config file
+    or stylesheets they loaded change (e.g. in watch mode).
+    """
+    settings_digest = compute_rst2pdf_settings_digest(conf_file, extra_args=extra_args)
+    return _load_rst2pdf_renderer(conf_file, extra_args, settings_digest)
+
+
+def convert_rst_file_to_pdf(rst_file, pdf_file, conf_file="", extra_args="", backend="library"):
     """
-    Use rst2pdf executable to convert rst file to pdf.
+    Use rst2pdf to convert rst file to pdf, either in-process ("library" backend)
+    or by launching its executable ("subprocess" backend).
 
     IMPORTANT : you can output default styles with "rst2pdf --print-stylesheet"
     """
+    assert backend in RST2PDF_BACKENDS, backend
 
     conf_file = conf_file or ""
     assert not conf_file or os.path.exists(conf_file), conf_file  # must be in CWD
 
     extra_args = extra_args or ""
 
-    vars = dict(rst_file=rst_file,
-                pdf_file=pdf_file,
-                conf_file=conf_file,
-                extra_args=extra_args)
-
     _create_missing_parent_folders(pdf_file)
 
-    # fit-background-mode=scale doesn't work in config file, at the moment...
-    # other options: --very-verbose --show-frame-boundary or just "-v"
-    # FIXME replace this by lIBRARY CALL!!
-    command = r'''python -m rst2pdf.createpdf "%(rst_file)s" -o "%(pdf_file)s" --config=%(conf_file)s --fit-background-mode=scale --first-page-on-right --smart-quotes=2 --break-side=any  -e dotted_toc --fit-literal-mode=shrink %(extra_args)s''' % vars
+    if backend == "library":
+        logging.debug("Converting %s to %s with rst2pdf library", rst_file, pdf_file)
+        renderer = _get_rst2pdf_renderer(conf_file, extra_args)
+        renderer.convert(rst_file, pdf_file)
+        return
+
+    run_converter_command_sync(get_rst2pdf_command(rst_file, pdf_file, conf_file=conf_file, extra_args=extra_args))
+
+
+def get_rst2pdf_command(rst_file, pdf_file, conf_file="", extra_args=""):
+    """Return the arguments list launching the rst2pdf executable (for the "subprocess" backend)"""
+    return ([sys.executable, "-m", "rst2pdf.createpdf", str(rst_file), "-o", str(pdf_file),
+             "--config=%s" % (conf_file or "")] + RST2PDF_COMMON_ARGS + shlex.split(extra_args or ""))
+
+
+RST2PDF_STYLESHEET_EXTENSIONS = ("", ".yaml", ".yml", ".style", ".json")  # Tried in this order by rst2pdf
+
+# Targets of image/figure directives (also in substitution definitions)
+_RST_IMAGE_REGEX = re.compile(r"^[ \t]*\.\.[ \t]+(?:\|[^|\n]+\|[ \t]+)?(?:image|figure)::[ \t]*(\S[^\n]*?)[ \t]*$",
+                              re.MULTILINE)
+
+
+def _get_rst2pdf_conf_value(conf_parser, key):
+    """Same parsing as rst2pdf.config.getValue(), with an empty string as default"""
+    from rst2pdf.rson import loads
+    try:
+        return loads(conf_parser.get("general", key))
+    except Exception:
+        return ""
+
+
+def get_rst2pdf_stylesheet_files(conf_file="", extra_args=""):
+    """
+    Return (stylesheet name, resolved path or None) pairs for the custom stylesheets that rst2pdf
+    loads with these settings, resolved like rst2pdf does (search path, then implicit extensions).
+    """
+    import rst2pdf
+
+    conf_parser = configparser.ConfigParser()
+    if conf_file:
+        conf_parser.read(conf_file)
+
+    args_parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    args_parser.add_argument("-s", "--stylesheets", action="append", default=[])
+    args_parser.add_argument("--stylesheet-path")
+    options, _ = args_parser.parse_known_args(shlex.split(extra_args or ""))
+
+    stylesheet_names = [os.path.expanduser(x) for x in
+                        ",".join([_get_rst2pdf_conf_value(conf_parser, "stylesheets")] + options.stylesheets).split(",")
+                        if x]
+    stylesheet_path = options.stylesheet_path or _get_rst2pdf_conf_value(conf_parser, "stylesheet_path")
+    search_folders = ([os.path.expanduser(x) for x in stylesheet_path.split(os.pathsep)] +
+                      [".", os.path.join(os.path.dirname(rst2pdf.__file__), "styles"), os.path.expanduser("~/.rst2pdf/styles")])
+
+    stylesheet_files = []
+    for stylesheet_name in stylesheet_names:
+        candidates = ((stylesheet_name + ext) if os.path.isabs(stylesheet_name) else os.path.join(folder, stylesheet_name + ext)
+                      for ext in RST2PDF_STYLESHEET_EXTENSIONS for folder in search_folders)
+        stylesheet_files.append((stylesheet_name, next((x for x in candidates if os.path.isfile(x)), None)))
+    return stylesheet_files
+
+
+def get_rst_image_files(rst_file):
+    """Return paths of the local images referenced by the RST file, resolved like rst2pdf does"""
+    with open(rst_file, "r", encoding="utf8") as f:
+        rst_data = f.read()
+    base_dir = os.path.dirname(os.path.abspath(rst_file))
+    return [os.path.join(base_dir, uri) for uri in _RST_IMAGE_REGEX.findall(rst_data) if "://" not in uri]
+
 
-    #print("Current directory: %s" % os.getcwd())
-    logging.debug("Executing command: %s" % command)  # FIXME
+def compute_rst2pdf_settings_digest(conf_file="", extra_args=""):
+    """Return the digest of the config file and stylesheets that rst2pdf loads with these settings"""
+    parts = [conf_file, compute_file_digest(conf_file), extra_args]
+    for stylesheet_name, stylesheet_file in get_rst2pdf_stylesheet_files(conf_file, extra_args=extra_args):
+        parts.extend((stylesheet_name, compute_file_digest(stylesheet_file)))
+    return compute_digest(*parts)
 
-    res = os.system(command)
 
-    assert res == 0, "Error when calling rst2pdf"
+def compute_rst2pdf_dependencies_digest(rst_file, conf_file="", extra_args=""):
+    """Return the digest of the files that rst2pdf loads besides the RST file: config, stylesheets and images"""
+    parts = [compute_rst2pdf_settings_digest(conf_file, extra_args=extra_args)]
+    for image_file in get_rst_image_files(rst_file):
+        parts.extend((image_file, compute_file_digest(image_file)))
+    return compute_digest(*parts)
 
 
-def convert_rst_content_to_pdf(filepath_base: Path, rst_content, conf_file="", extra_args=""):  #FIXME remove this??
+def convert_rst_content_to_pdf(filepath_base: Path, rst_content, conf_file="", extra_args="", backend="library"):  #FIXME remove this??
     """
     We use an intermediate RST file, both for simplicity and debugging.
     """
@@ -242,22 +1038,85 @@ def convert_rst_content_to_pdf(filepath_base: Path, rst_content, conf_file="", e
     pdf_file = filepath_base.with_suffix(".pdf")
 
     write_rst_file(rst_file, data=rst_content)
-    convert_rst_file_to_pdf(rst_file, pdf_file, conf_file=conf_file, extra_args=extra_args)
+    convert_rst_file_to_pdf(rst_file, pdf_file, conf_file=conf_file, extra_args=extra_args, backend=backend)
 
 
-def generate_rst_and_pdf_files(rst_content, relative_path, storygen_settings):
-    """
-    We use an intermediate RST file, both for simplicity and debugging.
-    """
+def get_rst_and_pdf_file_paths(relative_path, storygen_settings):
     assert not Path(relative_path).is_absolute(), relative_path
     rst_file = storygen_settings.build_root_dir.joinpath(relative_path).with_suffix(".txt")  # Better than .rst for non-techs
-
     pdf_file = storygen_settings.output_root_dir.joinpath(relative_path).with_suffix(".pdf")
+    return rst_file, pdf_file
+
+
+def generate_rst_and_pdf_files(rst_content, relative_path, storygen_settings, on_generated=None):
+    """
+    We use an intermediate RST file, both for simplicity and debugging.
+
+    The RST content can be a string, or an iterable of string chunks, which is then streamed to disk.
+
+    If a build manifest is available, files are not regenerated when the RST content, the
+    rst2pdf settings, and the stylesheets and images they use are the same as in the previous build.
+
+    With the "subprocess" rst2pdf backend, and a converter job runner, the PDF conversion is only
+    queued in this runner. The optional on_generated callback is called once both files are
+    successfully generated (or found up-to-date), so never for failed or cancelled conversions.
+    """
+    rst_file, pdf_file = get_rst_and_pdf_file_paths(relative_path, storygen_settings)
+
+    conf_file = storygen_settings.dynamic_settings.get("rst2pdf_conf_file", "")
+    extra_args = storygen_settings.dynamic_settings.get("rst2pdf_extra_args", "")
+
+    rst_chunks = (rst_content,) if isinstance(rst_content, str) else rst_content
+
+    # We write to a temporary file, since we only know the digest of the content at the end
+    tmp_rst_file = rst_file.with_name(rst_file.name + ".tmp")
+    try:
+        rst_digest = write_rst_chunks_to_file(tmp_rst_file, chunks=rst_chunks)
+    except BaseException:
+        if os.path.exists(tmp_rst_file):
+            os.remove(tmp_rst_file)
+        raise
+
+    build_manifest = storygen_settings.build_manifest
+    manifest_key = Path(relative_path).as_posix()
+    digest = compute_digest(rst_digest, conf_file, compute_file_digest(conf_file), extra_args, " ".join(RST2PDF_COMMON_ARGS),
+                            compute_rst2pdf_dependencies_digest(tmp_rst_file, conf_file=conf_file, extra_args=extra_args))
+    if build_manifest is not None and build_manifest.is_up_to_date(manifest_key, digest, rst_file, pdf_file):
+        logging.debug("Skipping generation of up-to-date RST and PDF files for '%s'", relative_path)
+        os.remove(tmp_rst_file)
+        if on_generated is not None:
+            on_generated()
+        return
+
+    os.replace(tmp_rst_file, rst_file)
+
+    backend = storygen_settings.dynamic_settings.get("rst2pdf_backend", "library")
+    converter_job_runner = storygen_settings.converter_job_runner
+    if backend == "subprocess" and converter_job_runner is not None:
+        # The conversion is deferred, to run concurrently with others
+        assert not conf_file or os.path.exists(conf_file), conf_file  # must be in CWD
+        _create_missing_parent_folders(pdf_file)
+
+        async def _convert_rst_file_to_pdf():
+            await converter_job_runner.run_command(
+                "rst2pdf", get_rst2pdf_command(rst_file, pdf_file, conf_file=conf_file, extra_args=extra_args))
+            if build_manifest is not None:
+                build_manifest.record(manifest_key, digest)
+            if on_generated is not None:
+                on_generated()
+
+        converter_job_runner.add_job(_convert_rst_file_to_pdf)
+        return
 
-    write_rst_file(rst_file, data=rst_content)
     convert_rst_file_to_pdf(rst_file, pdf_file,
-                            conf_file=storygen_settings.dynamic_settings.get("rst2pdf_conf_file", ""),
-                            extra_args=storygen_settings.dynamic_settings.get("rst2pdf_extra_args", ""))
+                            conf_file=conf_file,
+                            extra_args=extra_args,
+                            backend=backend)
+
+    if build_manifest is not None:
+        build_manifest.record(manifest_key, digest)
+    if on_generated is not None:
+        on_generated()
 
 
 
@@ -268,8 +1127,8 @@ def generate_rst_and_pdf_files(rst_content, relative_path, storygen_settings):
 
 def render_with_jinja_and_convert_to_pdf(source_filename=None, *, relative_path=None, jinja_context, storygen_settings):
 
-    rst_content = render_with_jinja(filename=source_filename, jinja_env=storygen_settings.jinja_env,
-                                    jinja_context=jinja_context)
+    rst_content = generate_with_jinja(filename=source_filename, jinja_env=storygen_settings.jinja_env,
+                                      jinja_context=jinja_context)  # Streamed to disk
 
     relative_path = relative_path or Path(source_filename).with_suffix("")
     assert not relative_path.is_absolute(), relative_path
@@ -0,0 +1,94 @@
+"""
+Optional NumPy-backed (facts x players) knowledge matrix, built from a FactsRegistry.
+
+Coherence checks then run as vectorized boolean operations over the whole matrix, and messages
+are only built for offending cells. Aggregate queries are exposed too, for summary templates.
+"""
+from pychronia_storygen.facts_registry import FACT_FLAGS, IS_AUTHOR, IS_VIEWER, IN_CHEAT_SHEET, IN_NORMAL_SHEET
+
+try:
+    import numpy
+except ImportError:  # Optional dependency, pure-python coherence checks are used instead
+    numpy = None
+
+
+def is_facts_matrix_available():
+    return numpy is not None
+
+
+class FactKnowledgeMatrix:
+    """
+    Matrix of fact bitmasks, with facts sorted by name as rows, and players as columns
+    (in the order of their first appearance in the registry).
+
+    Amongst these players, character_ids are the ones taken into account by "all characters" queries
+    (by default, all players); this excludes e.g. the game master and lore sheets.
+    """
+
+    def __init__(self, fact_names, player_ids, bitmasks, character_ids=None):
+        assert bitmasks.shape == (len(fact_names), len(player_ids)), bitmasks.shape
+        self.fact_names = fact_names
+        self.player_ids = player_ids
+        self.bitmasks = bitmasks  # 2D uint8 array
+        self.character_ids = tuple(player_ids if character_ids is None else character_ids)
+        assert set(self.character_ids) <= set(player_ids), (self.character_ids, player_ids)
+
+    @classmethod
+    def from_registry(cls, facts_registry, character_ids=None):
+        """Characters which don't know any fact get their (empty) column too"""
+        assert is_facts_matrix_available()
+        player_ids = facts_registry.player_ids
+        if character_ids is not None:
+            player_ids += tuple(x for x in dict.fromkeys(character_ids) if x not in player_ids)
+        rows = sorted(facts_registry.iterate_bitmask_rows())
+        bitmasks = numpy.zeros((len(rows), len(player_ids)), dtype=numpy.uint8)
+        for fact_index, (_, row) in enumerate(rows):
+            bitmasks[fact_index, :len(row)] = numpy.frombuffer(row, dtype=numpy.uint8)
+        return cls(fact_names=[fact_name for (fact_name, _) in rows], player_ids=player_ids, bitmasks=bitmasks,
+                   character_ids=character_ids)
+
+    def get_flag_matrix(self, flag_name):
+        """Return the (facts x players) boolean matrix of a single flag, e.g. "is_author" """
+        return (self.bitmasks & FACT_FLAGS[flag_name]) != 0
+
+    @property
+    def knowledge(self):
+        """(facts x players x flags) boolean array, flags being in the order of FACT_FLAGS"""
+        bits = numpy.array(list(FACT_FLAGS.values()), dtype=numpy.uint8)
+        return (self.bitmasks[:, :, numpy.newaxis] & bits) != 0
+
+    def get_facts_known_by_all_characters(self):
+        """Return names of the facts known (as author or viewer) by all characters"""
+        columns = [self.player_ids.index(character_id) for character_id in self.character_ids]
+        if not columns:
+            return []
+        is_known_by_everyone = (self.bitmasks[:, columns] != 0).all(axis=1)
+        return [self.fact_names[index] for index in numpy.flatnonzero(is_known_by_everyone)]
+
+    def get_facts_without_author(self):
+        """Return names of the facts that no player is the author of"""
+        has_no_author = ~self.get_flag_matrix("is_author").any(axis=1)
+        return [self.fact_names[index] for index in numpy.flatnonzero(has_no_author)]
+
+    def get_fact_counts_per_player(self):
+        """Return a (player_id -> number of known facts) dict"""
+        counts = (self.bitmasks != 0).sum(axis=0)
+        return {player_id: int(count) for (player_id, count) in zip(self.player_ids, counts)}
+
+    def iterate_incoherent_cells(self):
+        """
+        Yield (fact_name, player_id, bitmask) for cells breaking coherence rules (fact only in cheat-sheet,
+        or player both author and viewer of fact), sorted by fact and then by player.
+        """
+        bitmasks = self.bitmasks
+        is_known = bitmasks != 0
+
+        # Sanity checks
+        assert not (is_known & ((bitmasks & (IN_CHEAT_SHEET | IN_NORMAL_SHEET)) == 0)).any()
+        assert not (is_known & ((bitmasks & (IS_AUTHOR | IS_VIEWER)) == 0)).any()
+
+        is_only_in_cheat_sheet = (bitmasks & (IN_CHEAT_SHEET | IN_NORMAL_SHEET)) == IN_CHEAT_SHEET
+        is_author_and_viewer = (bitmasks & (IS_AUTHOR | IS_VIEWER)) == (IS_AUTHOR | IS_VIEWER)
+
+        for fact_index, player_index in numpy.argwhere(is_only_in_cheat_sheet | is_author_and_viewer):
+            yield self.fact_names[fact_index], self.player_ids[player_index], int(bitmasks[fact_index, player_index])
@@ -0,0 +1,171 @@
+"""
+Compact registry of game facts, and of the knowledge that each player has of them.
+
+Each (fact, player) cell is a small bitmask, stored in a per-fact bytes array indexed by player,
+whereas fact names and player IDs are interned once. Read-only mapping views expose the registry
+as the legacy (fact_name -> player_id -> {"is_author": ..., "is_viewer": ..., ...}) nested dicts,
+so that summary templates and coherence checks can browse it as before.
+"""
+import sys
+from array import array
+from collections.abc import Mapping
+
+IS_AUTHOR = 1
+IS_VIEWER = 2
+IN_CHEAT_SHEET = 4
+IN_NORMAL_SHEET = 8
+
+FACT_FLAGS = dict(is_author=IS_AUTHOR, is_viewer=IS_VIEWER,
+                  in_cheat_sheet=IN_CHEAT_SHEET, in_normal_sheet=IN_NORMAL_SHEET)  # Legacy key -> bit
+
+
+def get_fact_flags(is_author, is_cheat_sheet):
+    """Return the bitmask of a single occurrence of a fact in a sheet"""
+    return ((IS_AUTHOR if is_author else IS_VIEWER) |
+            (IN_CHEAT_SHEET if is_cheat_sheet else IN_NORMAL_SHEET))
+
+
+class FactFlagsView(Mapping):
+    """Read-only (legacy key -> bool) view of the bitmask of a single (fact, player) cell"""
+
+    __slots__ = ("flags",)
+
+    def __init__(self, flags):
+        self.flags = flags
+
+    def __getitem__(self, key):
+        return bool(self.flags & FACT_FLAGS[key])
+
+    def __iter__(self):
+        return iter(FACT_FLAGS)
+
+    def __len__(self):
+        return len(FACT_FLAGS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class FactKnowersView(Mapping):
+    """Read-only (player_id -> FactFlagsView) view of the players knowing a single fact"""
+
+    __slots__ = ("_player_ids", "_player_indices", "_row")
+
+    def __init__(self, player_ids, player_indices, row):
+        self._player_ids = player_ids
+        self._player_indices = player_indices
+        self._row = row
+
+    def __getitem__(self, player_id):
+        index = self._player_indices.get(player_id)
+        flags = self._row[index] if index is not None and index < len(self._row) else 0
+        if not flags:
+            raise KeyError(player_id)
+        return FactFlagsView(flags)
+
+    def __iter__(self):
+        return (self._player_ids[index] for (index, flags) in enumerate(self._row) if flags)
+
+    def __len__(self):
+        return len(self._row) - self._row.count(0)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class FactsRegistry(Mapping):
+    """
+    Registry of game facts, behaving like a read-only (fact_name -> FactKnowersView) mapping.
+
+    Knowledge of facts is only ever added, by OR-ing bitmasks into cells.
+    """
+
+    __slots__ = ("_rows", "_player_ids", "_player_indices")
+
+    def __init__(self):
+        self._rows = {}  # Interned fact name -> array of bitmasks, indexed by player index
+        self._player_ids = []  # Player index -> interned player ID
+        self._player_indices = {}  # Player ID -> player index
+
+    def _get_player_index(self, player_id):
+        index = self._player_indices.get(player_id)
+        if index is None:
+            index = self._player_indices[sys.intern(player_id)] = len(self._player_ids)
+            self._player_ids.append(sys.intern(player_id))
+        return index
+
+    def _get_row(self, fact_name, min_length):
+        row = self._rows.get(fact_name)
+        if row is None:
+            row = self._rows[sys.intern(fact_name)] = array("B")
+        if len(row) < min_length:
+            row.frombytes(bytes(min_length - len(row)))
+        return row
+
+    def add_fact_flags(self, fact_name, player_id, flags):
+        assert flags and not flags & ~0xF, flags
+        index = self._get_player_index(player_id)
+        self._get_row(fact_name, index + 1)[index] |= flags
+
+    def get_fact_flags(self, fact_name, player_id):
+        """Return the bitmask of a (fact, player) cell, 0 if this player doesn't know this fact"""
+        row = self._rows.get(fact_name)
+        index = self._player_indices.get(player_id)
+        if row is None or index is None or index >= len(row):
+            return 0
+        return row[index]
+
+    @property
+    def player_ids(self):
+        """Player IDs, in the order of their indices in bitmask rows"""
+        return tuple(self._player_ids)
+
+    def iterate_bitmask_rows(self):
+        """Yield (fact_name, row) pairs, rows being arrays of bitmasks indexed like player_ids (maybe shorter)"""
+        return iter(self._rows.items())
+
+    def __getitem__(self, fact_name):
+        return FactKnowersView(self._player_ids, self._player_indices, self._rows[fact_name])
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __repr__(self):
+        return "FactsRegistry(%r)" % self.to_dict()
+
+    def clear(self):
+        self._rows.clear()
+        self._player_ids.clear()
+        self._player_indices.clear()
+
+    def copy(self):
+        registry = type(self)()
+        registry.update(self)
+        return registry
+
+    def update(self, other):
+        """
+        Merge another FactsRegistry, or legacy nested dicts of flags (e.g. loaded from JSON),
+        into this registry, by OR-ing the bitmasks of their cells.
+        """
+        if isinstance(other, FactsRegistry):
+            player_indices = [self._get_player_index(player_id) for player_id in other._player_ids]
+            for fact_name, other_row in other._rows.items():
+                row = self._get_row(fact_name, max(player_indices[:len(other_row)], default=-1) + 1)
+                for other_index, flags in enumerate(other_row):
+                    if flags:
+                        row[player_indices[other_index]] |= flags
+            return
+        for fact_name, fact_data in other.items():
+            for player_id, fact_player_params in fact_data.items():
+                flags = sum(bit for (key, bit) in FACT_FLAGS.items() if fact_player_params.get(key))
+                if flags:
+                    self.add_fact_flags(fact_name, player_id, flags)
+
+    def to_dict(self):
+        """Return the registry as legacy nested dicts, e.g. to be serialized as JSON"""
+        return {fact_name: {player_id: dict(flags_view) for (player_id, flags_view) in knowers.items()}
+                for (fact_name, knowers) in self.items()}
@@ -1,57 +1,218 @@
 import re
+from array import array
+from collections.abc import Mapping, Sequence
 
+# Optional "@CRATE-NAME " prefix (if followed by something), and surrounding whitespace, of titles
+# already stripped of their important-marker
+_TITLE_REGEX = re.compile(r"^\s*(?:@(?P<crate_name>\S+)\s(?=\s*\S))?\s*(?P<title>.*?)\s*$", re.DOTALL)
 
-def _extract_important_marker_from_title(title, important_marker):
-    new_title = title
-    assert new_title, repr(new_title)
-    is_important = (important_marker in new_title)
-    if is_important:
-        new_title = new_title.replace(important_marker, "")
-    return is_important, new_title.strip()
 
+def _parse_title(title, important_marker):
+    """Return (is_important, crate_name or None, normalized title), in a single regex match"""
+    assert title, repr(title)
+    is_important = (important_marker in title)
+    match = _TITLE_REGEX.match(title.replace(important_marker, "") if is_important else title)
+    assert match.group("title"), repr(title)  # E.g. title made only of the important-marker
+    return is_important, match.group("crate_name"), match.group("title")
 
-def _extract_crate_name_from_title(title):
-    crate_name = None
-    new_title = title
-    assert new_title, repr(new_title)
-    # print(">>>>> SEARCHING CRATE IN TITLE", _title)
-    match = re.search(r"^@\S+\s", new_title)
-    if match:
-        crate_name = match.group(0)
-        new_title = new_title.replace(crate_name, "", 1)
-        crate_name = crate_name.replace("@", "", 1).strip()  # Remove @ and trailing space
-    return crate_name, new_title.strip()
 
+class InventoryItem(Mapping):
+    """
+    Read-only view of a single item of a GameInventory, also behaving like the legacy item dicts,
+    i.e. as a mapping of ITEM_KEYS (other data is only exposed as attributes).
+    """
 
-def analyze_and_normalize_game_items(game_items_raw, important_marker: str):
+    ITEM_KEYS = ("item_is_important", "item_title")  # Same order as legacy item dicts
+
+    __slots__ = ("_inventory", "_index")
+
+    def __init__(self, inventory, index):
+        self._inventory = inventory
+        self._index = index
+
+    @property
+    def item_title(self):
+        return self._inventory.item_titles[self._index]
+
+    @property
+    def item_is_important(self):
+        return bool(self._inventory.item_importances[self._index])
+
+    @property
+    def section_title(self):
+        return self._inventory.section_titles[self._inventory.item_section_ids[self._index]]
+
+    @property
+    def crate_name(self):
+        return self._inventory.crate_names[self._inventory.item_crate_ids[self._index]]
+
+    def __getitem__(self, key):
+        if key not in self.ITEM_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.ITEM_KEYS)
+
+    def __len__(self):
+        return len(self.ITEM_KEYS)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class InventoryItemsView(Sequence):
+    """Read-only sequence of the items of a GameInventory, at the given indexes"""
+
+    __slots__ = ("_inventory", "_indexes")
+
+    def __init__(self, inventory, indexes):
+        self._inventory = inventory
+        self._indexes = indexes
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return type(self)(self._inventory, self._indexes[position])
+        return InventoryItem(self._inventory, self._indexes[position])
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class InventoryIndexView(Mapping):
+    """Read-only (key -> InventoryItemsView) mapping, keys being in order of first appearance"""
 
-    # Nowadays Python3 preserves ORDERING of keys!
-    game_items_per_section = {}
-    game_items_per_crate = {}
+    __slots__ = ("_inventory", "_indexes_per_key")
 
-    for section_title, item_titles in game_items_raw.items():
+    def __init__(self, inventory, indexes_per_key):
+        self._inventory = inventory
+        self._indexes_per_key = indexes_per_key  # Key -> array of item indexes
 
-        section_is_important, section_title = _extract_important_marker_from_title(section_title, important_marker=important_marker)
-        section_crate, section_title = _extract_crate_name_from_title(section_title)
-        section_crate = section_crate or section_title  # Fallback if none is specified
-        assert section_title == section_title.strip()
+    def __getitem__(self, key):
+        return InventoryItemsView(self._inventory, self._indexes_per_key[key])
 
-        for item_title in item_titles:
+    def __iter__(self):
+        return iter(self._indexes_per_key)
 
-            item_is_important, item_title = _extract_important_marker_from_title(item_title, important_marker=important_marker)
-            item_crate, item_title = _extract_crate_name_from_title(item_title)
-            item_crate = item_crate or section_crate  # Fallback if none is specified
-            assert item_title == item_title.strip()
+    def __len__(self):
+        return len(self._indexes_per_key)
 
-            item_data = dict(
-                item_is_important=(section_is_important or item_is_important),
-                item_title=item_title,
-            )
+    def get_counts(self):
+        """Return a (key -> number of items) dict"""
+        return {key: len(indexes) for (key, indexes) in self._indexes_per_key.items()}
 
-            game_items_per_section_sublist = game_items_per_section.setdefault(section_title, [])
-            game_items_per_section_sublist.append(item_data)
 
-            game_items_per_crate_sublist = game_items_per_crate.setdefault(item_crate, [])
-            game_items_per_crate_sublist.append(item_data)
+class GameInventory:
+    """
+    Columnar storage of game items, with indexes by section, by crate and by importance.
 
-    return (game_items_per_section, game_items_per_crate)
\ No newline at end of file
+    Items are only stored once, as positions in parallel arrays; all listings are views over these.
+    """
+
+    __slots__ = ("item_titles", "item_importances", "item_section_ids", "item_crate_ids",
+                 "section_titles", "crate_names", "_section_ids", "_crate_ids",
+                 "_section_indexes", "_crate_indexes", "_important_indexes")
+
+    def __init__(self):
+        self.item_titles = []
+        self.item_importances = bytearray()
+        self.item_section_ids = array("I")  # Positions in section_titles
+        self.item_crate_ids = array("I")  # Positions in crate_names
+        self.section_titles = []
+        self.crate_names = []
+        self._section_ids = {}  # Section title -> position in section_titles
+        self._crate_ids = {}  # Crate name -> position in crate_names
+        self._section_indexes = {}  # Section title -> array of item indexes
+        self._crate_indexes = {}  # Crate name -> array of item indexes
+        self._important_indexes = array("I")
+
+    @classmethod
+    def from_raw_data(cls, game_items_raw, important_marker: str):
+        """
+        Parse a (section title -> item titles) mapping, where titles may contain the important_marker, and
+        be prefixed by "@CRATE-NAME " (items default to the crate of their section, else to its title).
+        """
+        inventory = cls()
+        for section_title, item_titles in game_items_raw.items():
+            section_is_important, section_crate, section_title = _parse_title(section_title, important_marker=important_marker)
+            section_crate = section_crate or section_title  # Fallback if none is specified
+            for item_title in item_titles:
+                item_is_important, item_crate, item_title = _parse_title(item_title, important_marker=important_marker)
+                inventory.add_item(item_title, is_important=(section_is_important or item_is_important),
+                                   section_title=section_title, crate_name=item_crate or section_crate)
+        return inventory
+
+    def add_item(self, item_title, is_important, section_title, crate_name):
+        index = len(self.item_titles)
+        self.item_titles.append(item_title)
+        self.item_importances.append(bool(is_important))
+
+        section_id = self._section_ids.get(section_title)
+        if section_id is None:
+            section_id = self._section_ids[section_title] = len(self.section_titles)
+            self.section_titles.append(section_title)
+            self._section_indexes[section_title] = array("I")
+        self.item_section_ids.append(section_id)
+        self._section_indexes[section_title].append(index)
+
+        crate_id = self._crate_ids.get(crate_name)
+        if crate_id is None:
+            crate_id = self._crate_ids[crate_name] = len(self.crate_names)
+            self.crate_names.append(crate_name)
+            self._crate_indexes[crate_name] = array("I")
+        self.item_crate_ids.append(crate_id)
+        self._crate_indexes[crate_name].append(index)
+
+        if is_important:
+            self._important_indexes.append(index)
+
+    def __len__(self):
+        return len(self.item_titles)
+
+    @property
+    def items(self):
+        return InventoryItemsView(self, range(len(self.item_titles)))
+
+    @property
+    def important_items(self):
+        return InventoryItemsView(self, self._important_indexes)
+
+    @property
+    def items_per_section(self):
+        return InventoryIndexView(self, self._section_indexes)
+
+    @property
+    def items_per_crate(self):
+        return InventoryIndexView(self, self._crate_indexes)
+
+    def _get_important_indexes(self, indexes_per_key):
+        important_indexes_per_key = {}
+        for key, indexes in indexes_per_key.items():
+            important_indexes = array("I", (index for index in indexes if self.item_importances[index]))
+            if important_indexes:
+                important_indexes_per_key[key] = important_indexes
+        return important_indexes_per_key
+
+    @property
+    def important_items_per_section(self):
+        """Like items_per_section, but restricted to important items (sections without any are omitted)"""
+        return InventoryIndexView(self, self._get_important_indexes(self._section_indexes))
+
+    @property
+    def important_items_per_crate(self):
+        """Like items_per_crate, but restricted to important items (crates without any are omitted)"""
+        return InventoryIndexView(self, self._get_important_indexes(self._crate_indexes))
+
+    @property
+    def crate_item_counts(self):
+        """Return a (crate name -> number of items) dict"""
+        return self.items_per_crate.get_counts()
+
+
+def analyze_and_normalize_game_items(game_items_raw, important_marker: str):
+    """Return the (items_per_section, items_per_crate) views of a GameInventory built from raw data"""
+    inventory = GameInventory.from_raw_data(game_items_raw, important_marker=important_marker)
+    return (inventory.items_per_section, inventory.items_per_crate)
@@ -25,7 +25,8 @@ Version: 0.1 (April 7, 2006)
 
 
 
-import sys, zipfile, xml.dom.minidom
+import sys, zipfile
+import xml.etree.ElementTree as ET
 
 IGNORED_TAGS = []  # or ["office:annotation"]
 
@@ -99,10 +100,30 @@ class ListProperties :
         self.ordered = value
 
 
-    
-class OpenDocumentTextFile :
 
 
+NAMESPACES = {
+    "office": "urn:oasis:names:tc:opendocument:xmlns:office:1.0",
+    "style": "urn:oasis:names:tc:opendocument:xmlns:style:1.0",
+    "text": "urn:oasis:names:tc:opendocument:xmlns:text:1.0",
+    "fo": "urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0",
+    "xlink": "http://www.w3.org/1999/xlink",
+}
+
+
+def qname (prefixedName) :
+    """ Converts a "prefix:name" into the "{namespace}name" form used by ElementTree. """
+    prefix, name = prefixedName.split(":", 1)
+    return "{%s}%s" % (NAMESPACES[prefix], name)
+
+
+class OpenDocumentTextFile :
+    """
+    Converts an ODT file, whose XML parts are parsed incrementally with iterparse() directly from the zip
+    archive: styles are processed as soon as they're parsed, and each top-level block of the body is
+    converted then dropped, so that the whole document tree never stays in memory.
+    """
+
     def __init__ (self, filepath) :
         self.footnotes = []
         self.footnoteCounter = 0
@@ -111,6 +132,7 @@ class OpenDocumentTextFile :
         self.listStyles = {}
         self.fixedFonts = []
         self.hasTitle = 0
+        self.ignoredTags = set(qname(tag) for tag in IGNORED_TAGS)
 
         self.load(filepath)
         
@@ -119,9 +141,9 @@ class OpenDocumentTextFile :
         """ Extracts necessary font information from a font-declaration
             element.
             """
-        for fontFace in fontDecl.getElementsByTagName("style:font-face") :
-            if fontFace.getAttribute("style:font-pitch") == "fixed" :
-                self.fixedFonts.append(fontFace.getAttribute("style:name"))
+        for fontFace in fontDecl.iter(qname("style:font-face")) :
+            if fontFace.get(qname("style:font-pitch")) == "fixed" :
+                self.fixedFonts.append(fontFace.get(qname("style:name"), ""))
         
 
 
@@ -130,23 +152,16 @@ class OpenDocumentTextFile :
         
         textProps = TextProps()
         
-        if parent :
-            parentProp = self.textStyles.get(parent, None)
-            if parentProp :
-                textProp = parentProp
-            
-        textPropEl = style.getElementsByTagName("style:text-properties")
-        if not textPropEl : return textProps
-        
-        textPropEl = textPropEl[0]
+        textPropEl = style.find(".//" + qname("style:text-properties"))
+        if textPropEl is None : return textProps
 
-        italic = textPropEl.getAttribute("fo:font-style")
-        bold = textPropEl.getAttribute("fo:font-weight")
+        italic = textPropEl.get(qname("fo:font-style"), "")
+        bold = textPropEl.get(qname("fo:font-weight"), "")
 
         textProps.setItalic(italic)
         textProps.setBold(bold)
 
-        if textPropEl.getAttribute("style:font-name") in self.fixedFonts :
+        if textPropEl.get(qname("style:font-name"), "") in self.fixedFonts :
             textProps.setFixed(True)
 
         return textProps
@@ -156,7 +171,7 @@ class OpenDocumentTextFile :
 
         paraProps = ParagraphProps()
 
-        name = style.getAttribute("style:name")
+        name = style.get(qname("style:name"), "")
 
         if name.startswith("Heading_20_") :
             level = name[11:]
@@ -169,10 +184,9 @@ class OpenDocumentTextFile :
         if name == "Title" :
             paraProps.setTitle(True)
         
-        paraPropEl = style.getElementsByTagName("style:paragraph-properties")
-        if paraPropEl :
-            paraPropEl = paraPropEl[0]
-            leftMargin = paraPropEl.getAttribute("fo:margin-left")
+        paraPropEl = style.find(".//" + qname("style:paragraph-properties"))
+        if paraPropEl is not None :
+            leftMargin = paraPropEl.get(qname("fo:margin-left"), "")
             if leftMargin :
                 try :
                     leftMargin = float(leftMargin[:-2])
@@ -188,211 +202,252 @@ class OpenDocumentTextFile :
         return paraProps
     
 
-    def processStyles(self, styleElements) :
-        """ Runs through "style" elements extracting necessary information.
-            """
+    def processStyle (self, style) :
+        """ Extracts necessary information from a "style" element. """
 
-        for style in styleElements :
+        name = style.get(qname("style:name"), "")
 
-            name = style.getAttribute("style:name")
+        if name == "Standard" : return
 
-            if name == "Standard" : continue
+        family = style.get(qname("style:family"), "")
+        parent = style.get(qname("style:parent-style-name"), "")
 
-            family = style.getAttribute("style:family")
-            parent = style.getAttribute("style:parent-style-name")
+        if family == "text" :
+            self.textStyles[name] = self.extractTextProperties(style, parent)
 
-            if family == "text" : 
-                self.textStyles[name] = self.extractTextProperties(style,
-                                                                   parent)
+        elif family == "paragraph":
+            self.paragraphStyles[name] = self.extractParagraphProperties(style, parent)
 
-            elif family == "paragraph":
-                self.paragraphStyles[name] = (
-                                 self.extractParagraphProperties(style,
-                                                                 parent))
-    def processListStyles (self, listStyleElements) :
+    def processListStyle (self, style) :
 
-        for style in listStyleElements :
-            name = style.getAttribute("style:name")
+        name = style.get(qname("style:name"), "")
 
-            prop = ListProperties()
-            if style.childNodes :
-                if ( style.childNodes[0].tagName
-                     == "text:list-level-style-number" ) :
-                    prop.setOrdered(True)
+        prop = ListProperties()
+        if len(style) :
+            if style[0].tag == qname("text:list-level-style-number") :
+                prop.setOrdered(True)
+
+        self.listStyles[name] = prop
 
-            self.listStyles[name] = prop
-        
+
+    def iterparseStyles (self, xmlFile) :
+        """
+        Processes the font declarations, styles and list styles of an XML part as soon as they're parsed,
+        and yields all (event, element) pairs, for further processing.
+
+        Font declarations come first in ODF documents, so they're known when processing styles.
+        """
+        fontDeclarationsFound = False
+
+        for event, element in ET.iterparse(xmlFile, events=("start", "end")) :
+
+            if event == "end" :
+                tag = element.tag
+                if tag == qname("office:font-face-decls") and not fontDeclarationsFound :
+                    self.processFontDeclarations(element)
+                    fontDeclarationsFound = True
+                    element.clear()
+                elif tag == qname("style:style") :
+                    self.processStyle(element)
+                    element.clear()
+                elif tag == qname("text:list-style") :
+                    self.processListStyle(element)
+                    element.clear()
+
+            yield event, element
+
+        assert fontDeclarationsFound, "No font declarations found in ODT file"
 
     def load(self, filepath) :
-        """ Loads an ODT file. """
-        
-        zip = zipfile.ZipFile(filepath)
-
-        styles_doc = xml.dom.minidom.parseString(zip.read("styles.xml"))
-        self.processFontDeclarations(styles_doc.getElementsByTagName(
-            "office:font-face-decls")[0])
-        self.processStyles(styles_doc.getElementsByTagName("style:style"))
-        self.processListStyles(styles_doc.getElementsByTagName(
-            "text:list-style"))
+        """ Loads the styles of an ODT file, its content being only parsed by iterateStrings(). """
         
-        self.content = xml.dom.minidom.parseString(zip.read("content.xml"))
-        self.processFontDeclarations(self.content.getElementsByTagName(
-            "office:font-face-decls")[0])
-        self.processStyles(self.content.getElementsByTagName("style:style"))
-        self.processListStyles(self.content.getElementsByTagName(
-            "text:list-style"))
-
-    def compressCodeBlocks(self, text) :
-        """ Removes extra blank lines from code blocks. """
-
-        lines = text.split("\n")
-        buffer = ""
-        numLines = len(lines)
-        for i in range(numLines) :
-            
-            if (lines[i].strip() or i == numLines-1  or i == 0 or
-                not ( lines[i-1].startswith("    ")
-                      and lines[i+1].startswith("    ") ) ):
-                buffer += "\n" + lines[i]
+        self.zip = zipfile.ZipFile(filepath)
+
+        with self.zip.open("styles.xml") as stylesFile :
+            for event, element in self.iterparseStyles(stylesFile) :
+                pass
+
+    def iterateBlocks (self) :
+        """ Yields the string of each top-level block of the document body, then its footnotes. """
+
+        depth = 0
+        textDepth = None  # Depth of the "office:text" element, while it's being parsed
+        textElement = None
+        blockTags = (qname("text:p"), qname("text:h"), qname("text:list"))
+
+        with self.zip.open("content.xml") as contentFile :
+            for event, element in self.iterparseStyles(contentFile) :
+
+                if event == "start" :
+                    depth += 1
+                    if element.tag == qname("office:text") and textElement is None :
+                        textElement, textDepth = element, depth
+                    continue
+
+                if textDepth is not None and depth == textDepth + 1 :
+                    if element.tag == qname("text:list") :
+                        text = self.listToString(element)
+                    elif element.tag in blockTags :
+                        text = self.paragraphToString(element)
+                    else :
+                        text = None
+                    if text :
+                        yield text + "\n\n"
+                    textElement.remove(element)  # Free memory as we go
+                elif element is textElement :
+                    textDepth = None
+                depth -= 1
 
-        return buffer
+        if self.footnotes :
 
+            yield "--------\n\n"
+            for cite, body in self.footnotes :
+                yield "[^%s]: %s\n\n" % (cite, body)
+
+    def compressCodeBlocks(self, strings) :
+        """ Removes extra blank lines from code blocks, and yields the resulting strings. """
+
+        lineIndex = 0
+        previousLine = currentLine = None
+        partialLine = []
+
+        def processLine(nextLine) :
+            # Decides whether currentLine is kept, now that its neighbours are known
+            if (currentLine.strip() or lineIndex == 0 or
+                not ( previousLine.startswith("    ")
+                      and nextLine.startswith("    ") ) ):
+                return "\n" + currentLine
+            return ""
+
+        for string in strings :
+            parts = string.split("\n")
+            if len(parts) == 1 :
+                partialLine.append(string)
+                continue
+            partialLine.append(parts[0])
+            buffer = []
+            for line in ["".join(partialLine)] + parts[1:-1] :
+                if currentLine is not None :
+                    buffer.append(processLine(line))
+                    previousLine = currentLine
+                    lineIndex += 1
+                currentLine = line
+            partialLine = [parts[-1]]
+            yield "".join(buffer)
+
+        lastLine = "".join(partialLine)
+        if currentLine is not None :
+            yield processLine(lastLine)
+        yield "\n" + lastLine
 
 
     def listToString (self, listElement) :
 
-        buffer = ""
+        buffer = []
 
-        styleName = listElement.getAttribute("text:style-name")
+        styleName = listElement.get(qname("text:style-name"), "")
         props = self.listStyles.get(styleName, ListProperties())
 
-        
-            
         i = 0
-        for item in listElement.childNodes :
+        for item in listElement :
             i += 1
             if props.ordered :
                 number = str(i)
                 number = number + "." + " "*(2-len(number))
-                buffer += number + self.paragraphToString(item.childNodes[0],
-                                                        indent=3)
+                buffer.append(number + self.paragraphToString(item[0], indent=3))
             else :
-                buffer += "* " + self.paragraphToString(item.childNodes[0],
-                                                        indent=2)
-            buffer += "\n\n"
+                buffer.append("* " + self.paragraphToString(item[0], indent=2))
+            buffer.append("\n\n")
             
-        return buffer
+        return "".join(buffer)
+
+    def iterateStrings (self) :
+        """ Converts the document to strings, yielded as the content is parsed. """
+        return self.compressCodeBlocks(self.iterateBlocks())
 
     def toString (self) :
         """ Converts the document to a string. """
-        body = self.content.getElementsByTagName("office:body")[0]
-        text = self.content.getElementsByTagName("office:text")[0]
-
-        buffer = u""
-
-
-        paragraphs = [el for el in text.childNodes
-                      if el.tagName in ["text:p", "text:h",
-                                        "text:list"]]
-
-        for paragraph in paragraphs :
-            if paragraph.tagName == "text:list" :
-                text = self.listToString(paragraph)
-            else :
-                text = self.paragraphToString(paragraph)
-            if text :
-                buffer += text + "\n\n"
-
-        if self.footnotes :
-
-            buffer += "--------\n\n"
-            for cite, body in self.footnotes :
-                buffer += "[^%s]: %s\n\n" % (cite, body)
-
-
-        return self.compressCodeBlocks(buffer)
+        return "".join(self.iterateStrings())
 
     def textToString(self, element) :
 
-        buffer = u""
+        buffer = []
 
-        for node in element.childNodes :
+        if element.text :
+            buffer.append(element.text)
 
-            if node.nodeType == xml.dom.Node.TEXT_NODE :
-                buffer += node.nodeValue
+        for node in element :
 
-            elif node.nodeType == xml.dom.Node.ELEMENT_NODE :
-                tag = node.tagName
+            tag = node.tag
 
-                if tag == "text:span" :
+            if tag == qname("text:span") :
 
-                    text = self.textToString(node) 
+                text = self.textToString(node)
 
-                    if not text.strip() :
-                        continue  # don't apply styles to white space
+                if text.strip() :  # don't apply styles to white space
 
-                    styleName = node.getAttribute("text:style-name")
+                    styleName = node.get(qname("text:style-name"), "")
                     style = self.textStyles.get(styleName, None)
 
-                    #print styleName, str(style)
+                    if style is not None and style.fixed :
+                        buffer.append("`" + text + "`")
 
-                    if style.fixed :
-                        buffer += "`" + text + "`"
-                        continue
-                    
-                    if style :
-                        if style.italic and style.bold :
-                            mark = "***"
-                        elif style.italic :
-                            mark = "*"
-                        elif style.bold :
-                            mark = "**"
-                        else :
-                            mark = ""
                     else :
-                        mark = "<" + styleName + ">"
+                        if style :
+                            if style.italic and style.bold :
+                                mark = "***"
+                            elif style.italic :
+                                mark = "*"
+                            elif style.bold :
+                                mark = "**"
+                            else :
+                                mark = ""
+                        else :
+                            mark = "<" + styleName + ">"
 
-                    buffer += "%s%s%s" % (mark, text, mark)
-                    
-                elif tag == "text:note" :
-                    cite = (node.getElementsByTagName("text:note-citation")[0]
-                                .childNodes[0].nodeValue)
-                               
-                    body = (node.getElementsByTagName("text:note-body")[0]
-                                .childNodes[0])
+                        buffer.append("%s%s%s" % (mark, text, mark))
 
-                    self.footnotes.append((cite, self.textToString(body)))
+            elif tag == qname("text:note") :
+                cite = node.find(".//" + qname("text:note-citation")).text
 
-                    buffer += "[^%s]" % cite
+                noteBody = node.find(".//" + qname("text:note-body"))
+                body = "" if noteBody.text else self.textToString(noteBody[0])
 
-                elif tag in IGNORED_TAGS :
-                    pass
+                self.footnotes.append((cite, body))
 
-                elif tag == "text:s" :
-                    try :
-                        num = int(node.getAttribute("text:c"))
-                        buffer += " "*num
-                    except :
-                        buffer += " "
+                buffer.append("[^%s]" % cite)
 
-                elif tag == "text:tab" :
-                    buffer += "    "
+            elif tag in self.ignoredTags :
+                pass
+
+            elif tag == qname("text:s") :
+                try :
+                    num = int(node.get(qname("text:c"), ""))
+                    buffer.append(" "*num)
+                except :
+                    buffer.append(" ")
 
-                elif tag == "text:a" :
+            elif tag == qname("text:tab") :
+                buffer.append("    ")
 
-                    text = self.textToString(node)
-                    link = node.getAttribute("xlink:href")
-                    buffer += "[%s](%s)" % (text, link)
+            elif tag == qname("text:a") :
 
-                else:
-                    buffer += "\n" + self.textToString(node)
+                text = self.textToString(node)
+                link = node.get(qname("xlink:href"), "")
+                buffer.append("[%s](%s)" % (text, link))
+
+            else:
+                buffer.append("\n" + self.textToString(node))
+
+            if node.tail :
+                buffer.append(node.tail)
                     
-        return buffer
+        return "".join(buffer)
 
     def paragraphToString(self, paragraph, indent = 0) :
 
 
-        style_name = paragraph.getAttribute("text:style-name")
+        style_name = paragraph.get(qname("text:style-name"), "")
         paraProps = self.paragraphStyles.get(style_name) #, None)
         text = self.textToString(paragraph)
 
@@ -427,24 +482,24 @@ class OpenDocumentTextFile :
     def wrapParagraph(self, text, indent = 0, blockquote=False) :
 
         counter = 0
-        buffer = ""
+        buffer = []
         LIMIT = 50
 
         if blockquote :
-            buffer += "> "
+            buffer.append("> ")
         
         for token in text.split() :
 
             if counter > LIMIT - indent :
-                buffer += "\n" + " "*indent
+                buffer.append("\n" + " "*indent)
                 if blockquote :
-                    buffer += "> "
+                    buffer.append("> ")
                 counter = 0
 
-            buffer += token + " "
+            buffer.append(token + " ")
             counter += len(token)
 
-        return buffer
+        return "".join(buffer)
         
 
 
@@ -453,14 +508,5 @@ if __name__ == "__main__" :
 
     odt = OpenDocumentTextFile(sys.argv[1])
 
-    #print odt.fixedFonts
-
-    #sys.exit(0)
-    #out = open("out.txt", "wb")
-
-    unicode = odt.toString()
-    out_utf8 = unicode.encode("utf-8")
-
-    sys.stdout.write(out_utf8)
-
-    #out.write(
+    for string in odt.iterateStrings() :
+        sys.stdout.write(string)
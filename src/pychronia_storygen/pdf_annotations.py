@@ -0,0 +1,341 @@
+"""
+Object-level removal of annotations (e.g. gamemaster comments) from PDF files.
+
+The PDF file is memory-mapped, and only the dictionaries of its objects get parsed: objects still
+reachable once the "/Annots" entries of pages are removed are copied, chunk by chunk, to a new file
+with a rewritten cross-reference table. Annotation objects (and everything only they referenced,
+like their appearance streams) are thus really dropped, while memory usage doesn't depend on the
+size of embedded streams (e.g. scanned images).
+
+Only PDF files with classic cross-reference tables are supported (no cross-reference/object streams).
+"""
+import logging
+import mmap
+import os
+import re
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_WHITESPACES_RE = re.compile(rb"(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)*")
+_REGULAR_CHARS_RE = re.compile(rb"[^\x00\t\n\x0c\r ()<>\[\]{}/%]+")  # Numbers, keywords, name contents
+_LITERAL_STRING_TOKEN_RE = re.compile(rb"\\.|[()]", re.DOTALL)
+_REFERENCE_RE = re.compile(rb"(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+R(?![^\x00\t\n\x0c\r ()<>\[\]{}/%])")
+_OBJECT_HEADER_RE = re.compile(rb"(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj")
+_STARTXREF_RE = re.compile(rb"startxref[\x00\t\n\x0c\r ]+(\d+)")
+_XREF_SUBSECTION_RE = re.compile(rb"(\d+)[ \t]+(\d+)")
+_XREF_ENTRY_RE = re.compile(rb"(\d{10}) (\d{5}) ([nf])")
+
+_TRAILER_KEYS_TO_REBUILD = (b"/Size", b"/Prev", b"/XRefStm")
+
+
+class UnsupportedPdfStructure(ValueError):
+    """The PDF file uses features (or contains errors) that this module can't handle"""
+
+
+def _skip_whitespaces(data, pos):
+    return _WHITESPACES_RE.match(data, pos).end()
+
+
+def _skip_literal_string(data, pos):
+    depth = 0
+    for match in _LITERAL_STRING_TOKEN_RE.finditer(data, pos):
+        token = match.group()
+        if token == b"(":
+            depth += 1
+        elif token == b")":
+            depth -= 1
+            if not depth:
+                return match.end()
+    raise UnsupportedPdfStructure("Unterminated literal string at offset %d" % pos)
+
+
+def _parse_value(data, pos, references):
+    """Return the end offset of the PDF value at pos, and append the (number, generation) references it contains"""
+    pos = _skip_whitespaces(data, pos)
+    char = data[pos:pos + 1]
+    if char == b"<":
+        if data[pos + 1:pos + 2] == b"<":
+            end, entries = _parse_dictionary(data, pos)
+            for entry in entries.values():
+                references.extend(entry[3])
+            return end
+        end = data.find(b">", pos)
+        if end < 0:
+            raise UnsupportedPdfStructure("Unterminated hex string at offset %d" % pos)
+        return end + 1
+    if char == b"[":
+        pos += 1
+        while True:
+            pos = _skip_whitespaces(data, pos)
+            if data[pos:pos + 1] == b"]":
+                return pos + 1
+            pos = _parse_value(data, pos, references)
+    if char == b"(":
+        return _skip_literal_string(data, pos)
+    if char == b"/":
+        match = _REGULAR_CHARS_RE.match(data, pos + 1)
+        return match.end() if match else pos + 1
+    match = _REFERENCE_RE.match(data, pos)
+    if match:
+        references.append((int(match.group(1)), int(match.group(2))))
+        return match.end()
+    match = _REGULAR_CHARS_RE.match(data, pos)
+    if not match:
+        raise UnsupportedPdfStructure("Unexpected PDF syntax at offset %d" % pos)
+    return match.end()
+
+
+def _parse_dictionary(data, pos):
+    """
+    Return the end offset of the PDF dictionary at pos, and a (key -> (key_start, value_start, value_end, references))
+    mapping of its entries.
+    """
+    assert data[pos:pos + 2] == b"<<", pos
+    pos += 2
+    entries = {}
+    while True:
+        pos = _skip_whitespaces(data, pos)
+        if data[pos:pos + 2] == b">>":
+            return pos + 2, entries
+        if data[pos:pos + 1] != b"/":
+            raise UnsupportedPdfStructure("Invalid dictionary key at offset %d" % pos)
+        key_start = pos
+        match = _REGULAR_CHARS_RE.match(data, pos + 1)
+        key_end = match.end() if match else pos + 1
+        value_start = _skip_whitespaces(data, key_end)
+        references = []
+        pos = _parse_value(data, value_start, references)
+        entries[bytes(data[key_start:key_end])] = (key_start, value_start, pos, references)
+
+
+def _get_entry_value(data, entries, key):
+    entry = entries.get(key)
+    return bytes(data[entry[1]:entry[2]]) if entry else None
+
+
+class _PdfFileReader:
+    """Lazy access to the objects of a memory-mapped PDF file, through its cross-reference tables"""
+
+    def __init__(self, data):
+        self.data = data
+        self.xref_entries = {}  # Object number -> (offset, generation), or None for free objects
+        self.trailer_entries = None  # Those of the latest trailer
+        self._read_cross_reference_tables()
+
+    def _read_cross_reference_tables(self):
+        data = self.data
+        matches = list(_STARTXREF_RE.finditer(data, max(0, len(data) - 2048)))
+        if not matches:
+            raise UnsupportedPdfStructure("No startxref found")
+        xref_offset = int(matches[-1].group(1))
+        visited_offsets = set()
+
+        while xref_offset is not None:  # Follow the chain of incremental updates, latest first
+            if xref_offset in visited_offsets:
+                raise UnsupportedPdfStructure("Loop in cross-reference tables")
+            visited_offsets.add(xref_offset)
+            pos = _skip_whitespaces(data, xref_offset)
+            if data[pos:pos + 4] != b"xref":
+                raise UnsupportedPdfStructure("No cross-reference table at offset %d (stream?)" % xref_offset)
+            pos = _skip_whitespaces(data, pos + 4)
+            while True:
+                match = _XREF_SUBSECTION_RE.match(data, pos)
+                if not match:
+                    break
+                first_number, count = int(match.group(1)), int(match.group(2))
+                pos = _skip_whitespaces(data, match.end())
+                for number in range(first_number, first_number + count):
+                    entry_match = _XREF_ENTRY_RE.match(data, pos)
+                    if not entry_match:
+                        raise UnsupportedPdfStructure("Invalid cross-reference entry at offset %d" % pos)
+                    if number not in self.xref_entries:  # Entries of later updates take precedence
+                        offset, generation, kind = entry_match.groups()
+                        self.xref_entries[number] = (int(offset), int(generation)) if kind == b"n" else None
+                    pos = _skip_whitespaces(data, entry_match.end())
+            if data[pos:pos + 7] != b"trailer":
+                raise UnsupportedPdfStructure("No trailer at offset %d" % pos)
+            pos = _skip_whitespaces(data, pos + 7)
+            if data[pos:pos + 2] != b"<<":
+                raise UnsupportedPdfStructure("Invalid trailer dictionary at offset %d" % pos)
+            _, trailer_entries = _parse_dictionary(data, pos)
+            if b"/XRefStm" in trailer_entries:
+                raise UnsupportedPdfStructure("Hybrid cross-reference streams are not supported")
+            if self.trailer_entries is None:
+                self.trailer_entries = trailer_entries
+            previous_offset = _get_entry_value(data, trailer_entries, b"/Prev")
+            if previous_offset and not previous_offset.isdigit():
+                raise UnsupportedPdfStructure("Invalid /Prev offset %r" % previous_offset)
+            xref_offset = int(previous_offset) if previous_offset else None
+
+    def get_object_offset(self, number, generation):
+        xref_entry = self.xref_entries.get(number)
+        if xref_entry is None or xref_entry[1] != generation:
+            return None  # References to missing objects are equivalent to null
+        return xref_entry[0]
+
+    def read_integer_object(self, number, generation):
+        offset = self.get_object_offset(number, generation)
+        match = offset is not None and _OBJECT_HEADER_RE.match(self.data, offset)
+        if not match:
+            raise UnsupportedPdfStructure("Can't find integer object %d %d" % (number, generation))
+        value_start = _skip_whitespaces(self.data, match.end())
+        value_match = _REGULAR_CHARS_RE.match(self.data, value_start)
+        if not value_match or not value_match.group().isdigit():
+            raise UnsupportedPdfStructure("Object %d %d is not an integer" % (number, generation))
+        return int(value_match.group())
+
+    def read_object(self, number, generation):
+        """
+        Return (object end offset, dictionary entries or None, references outside of a top-level dictionary)
+        for the object at the given offset.
+        """
+        data = self.data
+        offset = self.get_object_offset(number, generation)
+        match = offset is not None and _OBJECT_HEADER_RE.match(data, offset)
+        if not match or int(match.group(1)) != number:
+            raise UnsupportedPdfStructure("Invalid offset %d for object %d" % (offset, number))
+
+        value_start = _skip_whitespaces(data, match.end())
+        entries = None
+        other_references = []
+        if data[value_start:value_start + 2] == b"<<":
+            value_end, entries = _parse_dictionary(data, value_start)
+        else:
+            value_end = _parse_value(data, value_start, other_references)
+
+        pos = _skip_whitespaces(data, value_end)
+        if data[pos:pos + 6] == b"stream":
+            pos += 6
+            pos += 2 if data[pos:pos + 2] == b"\r\n" else 1
+            stream_end = -1
+            length = _get_entry_value(data, entries or {}, b"/Length")
+            if length:
+                reference_match = _REFERENCE_RE.fullmatch(length)
+                if reference_match:
+                    length = self.read_integer_object(int(reference_match.group(1)), int(reference_match.group(2)))
+                elif length.isdigit():
+                    length = int(length)
+                else:
+                    raise UnsupportedPdfStructure("Invalid stream length %r in object %d" % (length, number))
+                endstream_pos = _skip_whitespaces(data, pos + length)
+                if data[endstream_pos:endstream_pos + 9] == b"endstream":
+                    stream_end = endstream_pos
+            if stream_end < 0:  # Wrong or missing length, we look for the end of the stream instead
+                stream_end = data.find(b"endstream", pos)
+                if stream_end < 0:
+                    raise UnsupportedPdfStructure("Unterminated stream in object %d" % number)
+            pos = _skip_whitespaces(data, stream_end + 9)
+        if data[pos:pos + 6] != b"endobj":
+            raise UnsupportedPdfStructure("Missing endobj for object %d" % number)
+        return pos + 6, entries, other_references
+
+
+def _copy_data(data, start, end, output):
+    for chunk_start in range(start, end, COPY_CHUNK_SIZE):
+        output.write(data[chunk_start:min(chunk_start + COPY_CHUNK_SIZE, end)])
+
+
+def _collect_objects_without_annotations(reader):
+    """
+    Return the (object number -> (generation, start, end, removed span or None)) mapping of objects still
+    reachable from the trailer once annotations are removed, and the number of pages which had some.
+    """
+    data = reader.data
+    kept_objects = {}
+    annotated_page_count = 0
+    pending_references = [reference
+                          for key, entry in reader.trailer_entries.items() if key not in _TRAILER_KEYS_TO_REBUILD
+                          for reference in entry[3]]
+    visited_numbers = set()
+
+    while pending_references:
+        number, generation = pending_references.pop()
+        if number in visited_numbers:
+            continue
+        visited_numbers.add(number)
+        offset = reader.get_object_offset(number, generation)
+        if offset is None:
+            continue
+        end, entries, references = reader.read_object(number, generation)
+        removed_span = None
+        if entries is not None:
+            if _get_entry_value(data, entries, b"/Type") == b"/Annot":
+                continue  # Annotation referenced from elsewhere than a page, e.g. a popup
+            annotations_entry = entries.pop(b"/Annots", None)
+            if annotations_entry:
+                removed_span = (annotations_entry[0], annotations_entry[2])
+                annotated_page_count += 1
+            references = [reference for entry in entries.values() for reference in entry[3]]
+        kept_objects[number] = (generation, offset, end, removed_span)
+        pending_references.extend(references)
+
+    return kept_objects, annotated_page_count
+
+
+def _write_pdf_file(reader, kept_objects, output):
+    data = reader.data
+    header_start = data.find(b"%PDF-", 0, 1024)
+    if header_start < 0:
+        raise UnsupportedPdfStructure("No PDF header found")
+    output.write(bytes(data[header_start:header_start + 8]) + b"\n%\xe2\xe3\xcf\xd3\n")
+
+    new_offsets = {}
+    for number in sorted(kept_objects):
+        generation, start, end, removed_span = kept_objects[number]
+        new_offsets[number] = output.tell()
+        if removed_span:
+            _copy_data(data, start, removed_span[0], output)
+            _copy_data(data, removed_span[1], end, output)
+        else:
+            _copy_data(data, start, end, output)
+        output.write(b"\n")
+
+    trailer_size = _get_entry_value(data, reader.trailer_entries, b"/Size")
+    size = max(int(trailer_size) if trailer_size and trailer_size.isdigit() else 0, max(reader.xref_entries, default=0) + 1)
+    free_numbers = [number for number in range(1, size) if number not in new_offsets]
+    next_free_numbers = dict(zip([0] + free_numbers, free_numbers + [0]))  # Linked list of free objects
+
+    xref_offset = output.tell()
+    output.write(b"xref\n0 %d\n" % size)
+    for number in range(size):
+        if number in new_offsets:
+            output.write(b"%010d %05d n \n" % (new_offsets[number], kept_objects[number][0]))
+        else:
+            xref_entry = reader.xref_entries.get(number)
+            generation = 65535 if not number else min(xref_entry[1] + 1 if xref_entry else 0, 65535)
+            output.write(b"%010d %05d f \n" % (next_free_numbers[number], generation))
+
+    output.write(b"trailer\n<<")
+    for key, (key_start, value_start, value_end, references) in reader.trailer_entries.items():
+        if key not in _TRAILER_KEYS_TO_REBUILD:
+            output.write(data[key_start:value_end] + b" ")
+    output.write(b"/Size %d>>\nstartxref\n%d\n%%%%EOF\n" % (size, xref_offset))
+
+
+def remove_annotations_from_pdf_file(pdf_file):
+    """
+    Remove all annotations from the PDF file, in place, and return the number of pages which had some.
+
+    Raises UnsupportedPdfStructure if the PDF file can't be processed (it's then left untouched),
+    including when it's malformed in ways that the parser doesn't explicitly check.
+    """
+    tmp_file = "%s.%d.tmp" % (pdf_file, os.getpid())
+    try:
+        with open(pdf_file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            reader = _PdfFileReader(data)
+            kept_objects, annotated_page_count = _collect_objects_without_annotations(reader)
+            if not annotated_page_count:
+                return 0
+            try:
+                with open(tmp_file, "wb") as output:
+                    _write_pdf_file(reader, kept_objects, output)
+            except BaseException:
+                os.remove(tmp_file)
+                raise
+    except UnsupportedPdfStructure:
+        raise
+    except (ValueError, AttributeError, TypeError, IndexError, KeyError, RecursionError) as exc:
+        raise UnsupportedPdfStructure("Malformed PDF file: %r" % exc) from exc  # E.g. an empty file can't be mmapped
+    os.replace(tmp_file, pdf_file)
+    logging.debug("Removed annotations from %d pages of PDF file '%s'", annotated_page_count, pdf_file)
+    return annotated_page_count
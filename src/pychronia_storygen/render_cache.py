@@ -0,0 +1,172 @@
+"""
+In-memory memoization of template renderings, keyed on the template name and on the values of the
+context variables that the template actually read while rendering.
+
+Game-tags events triggered by a rendering are memoized along with its output, so that they can be
+replayed on cache hits (e.g. for each player sharing a common sheet part).
+
+Templates compiled from strings (e.g. by the dangerous_render filter) are cached too.
+"""
+import collections
+import dataclasses
+import json
+import logging
+
+from jinja2.runtime import Context
+
+from pychronia_storygen.build_cache import compute_digest
+
+MISSING_VALUE_MARKER = "<missing>"
+
+STRING_TEMPLATES_CACHE_SIZE = 512
+
+# Callable jinja globals which return the same output for the same arguments (unlike e.g. lipsum)
+PURE_GLOBAL_NAMES = frozenset(["range", "dict", "cycler", "joiner", "namespace"])
+
+
+class TrackingContext(Context):
+    """
+    Jinja context recording the names of the variables it resolves, while a render recording is active
+    (contexts created meanwhile, e.g. for included templates, are recorded too).
+
+    Renderings which call impure global functions can't be memoized, since their output is not
+    determined by the values of the variables they read.
+    """
+
+    def __init__(self, environment, *args, **kwargs):
+        super().__init__(environment, *args, **kwargs)
+        recording = getattr(environment, "active_render_recording", None)
+        if recording is not None:
+            recording.contexts.append(self)
+
+    def resolve_or_missing(self, key):
+        value = super().resolve_or_missing(key)
+        recording = getattr(self.environment, "active_render_recording", None)
+        if recording is not None:
+            recording.variable_names.add(key)
+            if (callable(value) and key not in PURE_GLOBAL_NAMES and key not in self.vars and
+                    self.environment.globals.get(key) is value):
+                recording.is_cacheable = False
+        return value
+
+
+@dataclasses.dataclass
+class RenderRecording:
+    """What a rendering in progress depends on, and the game-tags events it triggered"""
+    fact_recipient: tuple  # (player_id, is_cheat_sheet) of the top-level context
+    variable_names: set = dataclasses.field(default_factory=set)
+    template_names: set = dataclasses.field(default_factory=set)
+    fact_events: list = dataclasses.field(default_factory=list)  # (fact_name, is_author, player_id, is_cheat_sheet)
+    symbol_events: list = dataclasses.field(default_factory=list)  # (symbol_name, symbol_value)
+    item_events: list = dataclasses.field(default_factory=list)  # (item_name, item_status)
+    contexts: list = dataclasses.field(default_factory=list)  # Jinja contexts created during the rendering
+    is_cacheable: bool = True
+
+    def is_variable_assigned(self, name):
+        """Whether a template assigned this variable in its context, possibly shadowing that of the rendering"""
+        return any(name in context.vars or name in context.exported_vars for context in self.contexts)
+
+
+@dataclasses.dataclass(frozen=True)
+class RenderResult:
+    output: str
+    template_names: frozenset
+    fact_events: tuple  # Player ID and cheat-sheet flag are None when they must be those of the replaying context
+    symbol_events: tuple
+    item_events: tuple
+
+    @property
+    def has_relative_fact_events(self):
+        return any(player_id is None for (_, _, player_id, _) in self.fact_events)
+
+
+class RenderCache:
+    """
+    Cache of RenderResult, which must be cleared whenever templates might have changed.
+    """
+
+    def __init__(self):
+        self._variable_names_per_template = {}  # Template name -> list of sorted tuples of variable names
+        self._results = {}  # (template name, variable names, variables digest) -> RenderResult
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self._variable_names_per_template.clear()
+        self._results.clear()
+
+    @staticmethod
+    def _compute_variables_digest(variable_names, jinja_context, jinja_globals):
+        values = []
+        for name in variable_names:
+            if name in jinja_context:
+                values.append(jinja_context[name])
+            else:
+                values.append(jinja_globals.get(name, MISSING_VALUE_MARKER))
+        try:
+            serialized_values = json.dumps(values, sort_keys=True, default=repr)
+        except (TypeError, ValueError):  # E.g. dicts with keys of mixed types
+            return None
+        return compute_digest(serialized_values)
+
+    def lookup(self, template_name, jinja_context, jinja_globals, fact_recipient):
+        """Return the RenderResult of an equivalent previous rendering, or None"""
+        for variable_names in self._variable_names_per_template.get(template_name, ()):
+            digest = self._compute_variables_digest(variable_names, jinja_context, jinja_globals)
+            result = self._results.get((template_name, variable_names, digest))
+            if result is None:
+                continue
+            if fact_recipient[0] is None and result.has_relative_fact_events:
+                continue  # Fact tags output nothing when there is no current player
+            self.hits += 1
+            logging.debug("Reusing memoized rendering of template '%s'", template_name)
+            return result
+        self.misses += 1
+        return None
+
+    def store(self, template_name, jinja_context, jinja_globals, recording: RenderRecording, output):
+        if not recording.is_cacheable:
+            return
+        variable_names = tuple(sorted(recording.variable_names))
+        digest = self._compute_variables_digest(variable_names, jinja_context, jinja_globals)
+        if digest is None:
+            return
+        known_variable_names = self._variable_names_per_template.setdefault(template_name, [])
+        if variable_names not in known_variable_names:
+            known_variable_names.append(variable_names)
+        self._results[(template_name, variable_names, digest)] = RenderResult(
+            output=output,
+            template_names=frozenset(recording.template_names),
+            fact_events=tuple(recording.fact_events),
+            symbol_events=tuple(recording.symbol_events),
+            item_events=tuple(recording.item_events))
+
+
+class StringTemplateCache:
+    """
+    Bounded LRU cache of templates compiled from strings, keyed on the digest of their source, and on a
+    signature of the environment settings which change the generated code (e.g. the macro registry).
+    """
+
+    def __init__(self, maxsize=STRING_TEMPLATES_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._templates = collections.OrderedDict()  # Source digest -> Template
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self):
+        self._templates.clear()
+
+    def get_template(self, source, compile_template, environment_signature=None):
+        """Return the cached template for this source, else compile it with compile_template(source)"""
+        key = compute_digest(environment_signature, source)
+        template = self._templates.get(key)
+        if template is not None:
+            self.hits += 1
+            self._templates.move_to_end(key)
+            return template
+        self.misses += 1
+        template = self._templates[key] = compile_template(source)
+        if len(self._templates) > self.maxsize:
+            self._templates.popitem(last=False)
+        return template
@@ -1,4 +1,6 @@
 
+import collections
+import contextlib
 import copy
 import functools
 import logging
@@ -15,10 +17,9 @@ from jinja2.ext import Extension
 from jinja2.runtime import Context
 from markupsafe import Markup
 
+from pychronia_storygen.facts_matrix import FactKnowledgeMatrix, is_facts_matrix_available
+from pychronia_storygen.facts_registry import FactsRegistry, FactFlagsView, get_fact_flags
 
-# Markers inserted into RST chunks, to be recognized later when generating full sheets
-MARKER_FORMAT = r'{#>%(fact_name)s||%(as_what)s||%(player_id)s||%(is_cheat_sheet)s||%(no_output)s<#}'
-MARKER_REGEX = r'\{#>(?P<fact_name>.+?)\|\|(?P<as_what>.*?)\|\|(?P<player_id>.*?)\|\|(?P<is_cheat_sheet>.+?)\|\|(?P<no_output>.+?)<#\}'
 
 IS_CHEAT_SHEET_VARNAME = "is_cheat_sheet"
 CURRENT_PLAYER_VARNAME = "current_player_id"
@@ -31,6 +32,18 @@ ERROR_LEVEL_MARKER = "ERROR"
 WARNING_LEVEL_MARKER = "WARNING"
 
 
+def get_fact_recipient(jinja_context):
+    """
+    Return the (player_id, is_cheat_sheet) pair that facts are registered for, in a jinja context (or dict).
+
+    Variables are looked up without being tracked as dependencies of a memoized rendering.
+    """
+    if isinstance(jinja_context, Context):
+        jinja_context = collections.ChainMap(jinja_context.vars, jinja_context.parent)
+    return (jinja_context.get(CURRENT_PLAYER_VARNAME, DUMMY_GAMEMASTER_NAME),
+            bool(jinja_context.get(IS_CHEAT_SHEET_VARNAME, False)))
+
+
 class StoryChecksExtension(Extension):
     """
     With this extension, used via render_with_jinja_and_fact_tags(), coherence of
@@ -62,18 +75,74 @@ class StoryChecksExtension(Extension):
     def __init__(self, environment):
         super(StoryChecksExtension, self).__init__(environment)
 
-        self.facts_registry = {}
-        self.symbols_registry = {}
-        self.items_registry = {}
+        self._fact_events = None  # Collector of the generation in progress, else facts are registered at once
 
-        ## add registries to the environment
         environment.extend(
-            facts_registry=self.facts_registry,  # (fact_name -> fact_data_dict) mapping
-            symbols_registry=self.symbols_registry,  # (symbol_name -> symbol_values_set) mapping
-            items_registry=self.items_registry,  # (items_name -> items_statuses_set) mapping
-            extract_facts_from_intermediate_markup=functools.partial(extract_facts_from_intermediate_markup, facts_registry=self.facts_registry)
+            iterate_with_fact_events=self.iterate_with_fact_events,
+            replay_story_tag_events=self.replay_story_tag_events,
+            swap_story_tags_registries=self.swap_story_tags_registries,
         )
 
+        ## add registries to the environment
+        self.swap_story_tags_registries(facts_registry=FactsRegistry(), symbols_registry={}, items_registry={})
+
+    def swap_story_tags_registries(self, facts_registry, symbols_registry, items_registry):
+        """
+        Make tags fill these game-tags registries, which also get exposed on the environment,
+        and return the previous registries (as a dict of keyword arguments for this method).
+        """
+        previous_registries = dict(facts_registry=getattr(self, "facts_registry", None),
+                                   symbols_registry=getattr(self, "symbols_registry", None),
+                                   items_registry=getattr(self, "items_registry", None))
+
+        self.facts_registry = facts_registry
+        self.symbols_registry = symbols_registry
+        self.items_registry = items_registry
+
+        environment = self.environment
+        environment.facts_registry = facts_registry  # (fact_name -> player_id -> fact_flags) read-only mapping
+        environment.symbols_registry = symbols_registry  # (symbol_name -> symbol_values_set) mapping
+        environment.items_registry = items_registry  # (items_name -> items_statuses_set) mapping
+
+        return previous_registries
+
+    def iterate_with_fact_events(self, chunks):
+        """
+        Yield the chunks of a template generation, while its fact tags push their events to a dedicated
+        collector (instead of registering them one by one, like in plain renderings).
+
+        The collector is only active while a chunk is being generated, so that other generations
+        (e.g. nested ones, via the dangerous_render filter) get their own collector.
+        Facts are registered once all chunks are consumed.
+        """
+        fact_events = []
+        chunks = iter(chunks)
+        while True:
+            previous_fact_events, self._fact_events = self._fact_events, fact_events
+            try:
+                chunk = next(chunks, None)
+            finally:
+                self._fact_events = previous_fact_events
+            if chunk is None:
+                break
+            yield chunk
+        _register_fact_events(fact_events, facts_registry=self.facts_registry)
+
+    def replay_story_tag_events(self, render_result, fact_recipient):
+        """Replay the game-tags events of a memoized rendering, for the given (player_id, is_cheat_sheet)"""
+        replayed_player_id, replayed_is_cheat_sheet = str(fact_recipient[0]), fact_recipient[1]
+        fact_events = [(fact_name, is_author, replayed_player_id, replayed_is_cheat_sheet) if player_id is None else
+                       (fact_name, is_author, player_id, is_cheat_sheet)
+                       for (fact_name, is_author, player_id, is_cheat_sheet) in render_result.fact_events]
+        if self._fact_events is not None:
+            self._fact_events.extend(fact_events)
+        else:
+            _register_fact_events(fact_events, facts_registry=self.facts_registry)
+        for symbol_name, symbol_value in render_result.symbol_events:
+            self.symbols_registry.setdefault(symbol_name, set()).add(symbol_value)
+        for item_name, item_status in render_result.item_events:
+            self.items_registry.setdefault(item_name, set()).add(item_status)
+
     def parse(self, parser):
 
         template_name = parser.name
@@ -160,8 +229,21 @@ class StoryChecksExtension(Extension):
 
         fact_name = self._normalize_title_string(fact_name, normalize_case=False)
 
-        player_id = context.get(CURRENT_PLAYER_VARNAME, DUMMY_GAMEMASTER_NAME)  # FIXME CHANGE THIS NAME
-        is_cheat_sheet = context.get(IS_CHEAT_SHEET_VARNAME, False)
+        fact_recipient = get_fact_recipient(context)
+        player_id, is_cheat_sheet = fact_recipient  # FIXME CHANGE THIS NAME
+
+        recording = getattr(self.environment, "active_render_recording", None)
+        is_relative_fact_recipient = False  # Whether this fact gets registered for the player of a memoized rendering
+        if recording is not None:
+            # Equal values aren't enough, these variables must come from the context of the rendering itself
+            is_relative_fact_recipient = (player_id is not None and fact_recipient == recording.fact_recipient and
+                                          CURRENT_PLAYER_VARNAME in context and IS_CHEAT_SHEET_VARNAME in context and
+                                          not recording.is_variable_assigned(CURRENT_PLAYER_VARNAME) and
+                                          not recording.is_variable_assigned(IS_CHEAT_SHEET_VARNAME))
+            if not is_relative_fact_recipient:
+                # The rendering then depends on these variables, so we track them
+                context.get(CURRENT_PLAYER_VARNAME)
+                context.get(IS_CHEAT_SHEET_VARNAME)
 
         ##print(">> >> PROCESSING FACT", fact_name, as_what, player_id)
 
@@ -179,10 +261,15 @@ class StoryChecksExtension(Extension):
         if as_what not in AUTHORIZED_FACT_RECIPIENTS:
             raise RuntimeError("Abnormal fact status: %r for %r (authorized: %s)" % (as_what, fact_name, AUTHORIZED_FACT_RECIPIENTS))
 
-        marker = MARKER_FORMAT % dict(fact_name=fact_name, as_what=as_what,
-                                      player_id=player_id, is_cheat_sheet=int(is_cheat_sheet),
-                                      no_output=int(no_output))
-        return marker  # special marker for final extraction
+        fact_event = (fact_name, as_what == "author", str(player_id), is_cheat_sheet)
+        if self._fact_events is not None:
+            self._fact_events.append(fact_event)
+        else:  # E.g. plain render_with_jinja()
+            _register_fact_events([fact_event], facts_registry=self.facts_registry)
+        if recording is not None:
+            recording.fact_events.append((fact_name, as_what == "author",
+                                          *((None, None) if is_relative_fact_recipient else (str(player_id), is_cheat_sheet))))
+        return "" if no_output else fact_name  # output the fact itself if needed
 
     def _fact_processing_no_output(self, fact_name, as_what, context):
         return self._fact_processing(fact_name, as_what, context, no_output=True)
@@ -192,6 +279,9 @@ class StoryChecksExtension(Extension):
         symbol_name = self._normalize_title_string(symbol_name)
         symbols_list = self.symbols_registry.setdefault(symbol_name, set())
         symbols_list.add(symbol_value)
+        recording = getattr(self.environment, "active_render_recording", None)
+        if recording is not None:
+            recording.symbol_events.append((symbol_name, symbol_value))
         return "" if no_output else symbol_value  # output the symbol itself if needed
 
     def _symbol_processing_no_output(self, symbol_name, symbol_value, context):
@@ -201,40 +291,53 @@ class StoryChecksExtension(Extension):
         item_name = self._normalize_title_string(item_name, normalize_case=False)
         item_statuses = self.items_registry.setdefault(item_name.lower(), set())  # BEWARE we normalize case here!
         item_statuses.add(item_status)
+        recording = getattr(self.environment, "active_render_recording", None)
+        if recording is not None:
+            recording.item_events.append((item_name.lower(), item_status))
         return "" if no_output else item_name  # output the item itself if needed
 
     def _item_processing_no_output(self, symbol_name, symbol_value, context):
         return self._item_processing(symbol_name, symbol_value, context, no_output=True)
 
 
-def extract_facts_from_intermediate_markup(source, facts_registry):
+def _register_fact_events(fact_events, facts_registry):
+    """Register (fact_name, is_author, player_id, is_cheat_sheet) events into facts_registry"""
+    # Batch update of registry, duplicate events being very common
+    for (fact_name, is_author, player_id, is_cheat_sheet) in dict.fromkeys(fact_events):
+        ##print(">> WE GATHER FACT", fact_name, is_author, player_id, is_cheat_sheet)
+        facts_registry.add_fact_flags(fact_name.lower(), player_id,  # BEWARE we normalize case here!
+                                      get_fact_flags(is_author=is_author, is_cheat_sheet=is_cheat_sheet))
+
+
+def merge_story_tags_registries(jinja_env, facts_registry, symbols_registry, items_registry):
     """
-    Browse a transformed output, and extract facts from the special markup left in it by StoryChecksExtension.
+    Merge game-tags registries, gathered separately (e.g. in another process), into those of jinja_env.
     """
+    jinja_env.facts_registry.update(facts_registry)  # Accepts FactsRegistry instances and legacy nested dicts
 
-    def _process_fact(matchobj):
-        ##print(">> WE GATHER FACT", matchobj.groups())
-        fact_name = matchobj.group("fact_name")
-        as_what = matchobj.group("as_what")
-        player_id = matchobj.group("player_id")
-        is_cheat_sheet = int(matchobj.group("is_cheat_sheet"))
-        no_output = int(matchobj.group("no_output"))
-        assert as_what in AUTHORIZED_FACT_RECIPIENTS, as_what
-        is_author = (as_what == "author")
-
-        fact_params = facts_registry.setdefault(fact_name.lower(), {})  # BEWARE we normalize case here!
-        fact_player_params = fact_params.setdefault(player_id, {})
+    for symbol_name, symbol_values in symbols_registry.items():
+        jinja_env.symbols_registry.setdefault(symbol_name, set()).update(symbol_values)
 
-        fact_player_params['is_author'] = fact_player_params.get('is_author') or is_author
-        fact_player_params['is_viewer'] = fact_player_params.get('is_viewer') or not is_author
+    for item_name, item_statuses in items_registry.items():
+        jinja_env.items_registry.setdefault(item_name, set()).update(item_statuses)
 
-        fact_player_params['in_cheat_sheet'] = fact_player_params.get('in_cheat_sheet') or is_cheat_sheet
-        fact_player_params['in_normal_sheet'] = fact_player_params.get('in_normal_sheet') or not is_cheat_sheet
 
-        return "" if no_output else fact_name  # output the fact itself if needed
+@contextlib.contextmanager
+def isolated_story_tags_registries(jinja_env):
+    """
+    Temporarily make jinja_env fill fresh game-tags registries, and yield them as a dict.
+    On exit, they are merged back into the original registries of jinja_env.
 
-    cleaned_source = re.sub(MARKER_REGEX, _process_fact, source, flags=0)
-    return cleaned_source
+    Original registries are swapped out rather than copied, so that this costs nothing
+    however big they are.
+    """
+    isolated_registries = dict(facts_registry=FactsRegistry(), symbols_registry={}, items_registry={})
+    original_registries = jinja_env.swap_story_tags_registries(**isolated_registries)
+    try:
+        yield isolated_registries
+    finally:
+        jinja_env.swap_story_tags_registries(**original_registries)
+        merge_story_tags_registries(jinja_env, **isolated_registries)
 
 
 def detect_game_item_errors(items_registry):
@@ -263,7 +366,8 @@ def detect_game_symbol_errors(symbols_registry):
     return has_serious_errors, error_messages
 
 
-def detect_game_fact_errors(facts_registry):
+def detect_game_fact_errors(facts_registry, facts_matrix=None):
+    """The FactKnowledgeMatrix of facts_registry may be given, if it was already built"""
     '''
     def __UNUSED_replace_all_players_set(names):
         """When all real players know a fact, replace their names by a symbol"""
@@ -297,6 +401,17 @@ def detect_game_fact_errors(facts_registry):
             _has_serious_errors = True
         return _has_serious_errors, _error_messages
 
+    if facts_matrix is None and isinstance(facts_registry, FactsRegistry) and is_facts_matrix_available():
+        facts_matrix = FactKnowledgeMatrix.from_registry(facts_registry)
+    if facts_matrix is not None:
+        # Vectorized checks, only offending cells are checked again to build their messages
+        for fact_name, player_id, flags in facts_matrix.iterate_incoherent_cells():
+            _has_serious_errors, _error_messages = _check_fact_leaf(
+                fact_name, player_id=player_id, fact_node=FactFlagsView(flags))
+            has_serious_errors = has_serious_errors or _has_serious_errors
+            error_messages.extend(_error_messages)
+        return has_serious_errors, error_messages
+
     facts_items = sorted(facts_registry.items())
 
     for (fact_name, fact_data) in facts_items:
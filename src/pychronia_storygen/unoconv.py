@@ -20,6 +20,7 @@ from distutils.version import LooseVersion
 import getopt
 import glob
 import os
+import pathlib
 import signal
 import subprocess
 import sys
@@ -549,6 +550,7 @@ class Options:
         self.preserve = False
         self.server = '127.0.0.1'
         self.showlist = False
+        self.splits = []
         self.stdin = False
         self.stdout = False
         self.template = None
@@ -567,7 +569,7 @@ class Options:
                 ['connection=', 'debug', 'doctype=', 'export=', 'field=', 'format=',
                  'help', 'import=', 'import-filter-name=', 'listener', 'meta=', 'no-launch',
                  'output=', 'outputpath', 'password=', 'pipe=', 'port=', 'preserve',
-                 'server=', 'timeout=', 'user-profile=', 'show', 'stdin',
+                 'server=', 'split=', 'timeout=', 'user-profile=', 'show', 'stdin',
                  'stdout', 'template', 'printer=', 'verbose', 'version'] )
         except getopt.error as exc:
             print('unoconv: %s, try unoconv -h for a list of all the options' % str(exc))
@@ -650,6 +652,12 @@ class Options:
                 self.server = arg
             elif opt in ['--show']:
                 self.showlist = True
+            elif opt in ['--split']:
+                l = arg.split(':', 1)
+                if len(l) == 2:
+                    self.splits.append(tuple(l))
+                else:
+                    print('Warning: Option %s cannot be parsed, ignoring.' % arg, file=sys.stderr)
             elif opt in ['--stdin']:
                 self.stdin = True
             elif opt in ['--stdout']:
@@ -770,6 +778,9 @@ unoconv options:
   -s, --server=server                 specify the server address (default: 127.0.0.1)
                                         to be used by client or listener
       --show                          list the available output formats
+      --split=pagerange:file          export this page range of the document to this file,
+                                      the document being loaded only once for all splits
+                                        eg. --split 1-2:recipes.pdf --split 3-3:map.pdf
       --stdin                         read from stdin (filenames are ignored if provided)
       --stdout                        write output to stdout
   -t, --template=file                 import the styles from template (.ott)
@@ -836,7 +847,7 @@ class Convertor:
                 else:
                     args = [office.binary, "--headless", "--invisible", "--nocrashreport", "--nodefault", "--nofirststartwizard", "--nologo", "--norestore", "--accept=%s" % op.connection]
                 if op.userProfile:
-                    args.append("-env:UserInstallation=file://" + realpath(op.userProfile))
+                    args.append("-env:UserInstallation=" + pathlib.Path(realpath(op.userProfile)).as_uri())
                 info(2, '%s listener arguments are %s.' % (product.ooName, args))
                 ooproc = subprocess.Popen(args, env=os.environ)
                 info(2, '%s listener successfully started. (pid=%s)' % (product.ooName, ooproc.pid))
@@ -1103,6 +1114,23 @@ class Convertor:
                         printer[i].Value.Height = op.papersize[1]
                 document.setPrinter(printer)
 
+            ### Batch export of page ranges, from the single loaded document
+            if op.splits and not op.stdout:
+                for pagerange, splitfn in op.splits:
+                    splitfilter = op.exportfilter + [ PropertyValue( "PageRange", 0, pagerange, 0 ) ]
+                    splitprops = outputprops + ( PropertyValue( "FilterData", 0, uno.Any("[]com.sun.star.beans.PropertyValue", tuple( splitfilter ), ), 0 ), )
+                    spliturl = unohelper.absolutize( self.cwd, unohelper.systemPathToFileUrl(realpath(splitfn)) )
+                    info(1, "Output file: %s (pages %s)" % (spliturl, pagerange))
+                    try:
+                        document.storeToURL(spliturl, tuple(splitprops) )
+                    except IOException as e:
+                        raise UnoException("Unable to store document to %s (ErrCode %d)\n\nProperties: %s" % (spliturl, e.ErrCode, splitprops), None)
+
+                phase = "dispose"
+                document.dispose()
+                document.close(True)
+                return
+
             ### Cannot use UnoProps for FilterData property
             if op.exportfilter:
                 outputprops += ( PropertyValue( "FilterData", 0, uno.Any("[]com.sun.star.beans.PropertyValue", tuple( op.exportfilter ), ), 0 ), )
@@ -1203,6 +1231,8 @@ class Listener:
                 cmd = [office.binary, "-headless", "-invisible", "-nocrashreport", "-nodefault", "-nologo", "-nofirststartwizard", "-norestore", "-accept=%s" % op.connection]
             else:
                 cmd = [office.binary, "--headless", "--invisible", "--nocrashreport", "--nodefault", "--nologo", "--nofirststartwizard", "--norestore", "--accept=%s" % op.connection]
+            if op.userProfile:
+                cmd.append("-env:UserInstallation=" + pathlib.Path(realpath(op.userProfile)).as_uri())
 
             # The rationale for using subprocess.Popen is to be able to handle
             # a SIGTERM signal below and properly terminate the started office
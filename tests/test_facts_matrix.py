@@ -0,0 +1,46 @@
+"""
+Tests of the NumPy knowledge matrix, used for fact coherence checks and summary queries.
+"""
+import pytest
+
+from pychronia_storygen import facts_matrix
+from pychronia_storygen.facts_registry import FactsRegistry, get_fact_flags
+from pychronia_storygen.story_tags import DUMMY_GAMEMASTER_NAME, detect_game_fact_errors
+
+if not facts_matrix.is_facts_matrix_available():
+    pytest.skip("NumPy is not installed", allow_module_level=True)
+
+
+@pytest.fixture
+def facts_registry():
+    facts_registry = FactsRegistry()
+    for player_id in ("hero", "enemy", "world_history", DUMMY_GAMEMASTER_NAME):
+        facts_registry.add_fact_flags("shared fact", player_id, get_fact_flags(is_author=False, is_cheat_sheet=False))
+    facts_registry.add_fact_flags("lore fact", "world_history", get_fact_flags(is_author=True, is_cheat_sheet=False))
+    facts_registry.add_fact_flags("bad fact", "hero", get_fact_flags(is_author=False, is_cheat_sheet=True))
+    return facts_registry
+
+
+def test_facts_known_by_all_characters(facts_registry):
+    matrix = facts_matrix.FactKnowledgeMatrix.from_registry(facts_registry, character_ids=["hero", "enemy"])
+    assert matrix.get_facts_known_by_all_characters() == ["shared fact"]
+
+    # Characters who know nothing still count
+    matrix = facts_matrix.FactKnowledgeMatrix.from_registry(facts_registry, character_ids=["hero", "enemy", "goblin"])
+    assert matrix.get_facts_known_by_all_characters() == []
+    assert matrix.get_fact_counts_per_player()["goblin"] == 0
+
+    # By default, all players are characters
+    matrix = facts_matrix.FactKnowledgeMatrix.from_registry(facts_registry)
+    assert matrix.get_facts_known_by_all_characters() == ["shared fact"]
+    facts_registry.add_fact_flags("secret fact", "enemy", get_fact_flags(is_author=True, is_cheat_sheet=False))
+    matrix = facts_matrix.FactKnowledgeMatrix.from_registry(facts_registry)
+    assert matrix.get_facts_known_by_all_characters() == ["shared fact"]
+
+
+def test_fact_errors_with_prebuilt_matrix(facts_registry):
+    matrix = facts_matrix.FactKnowledgeMatrix.from_registry(facts_registry, character_ids=["hero", "goblin"])
+    expected = detect_game_fact_errors(facts_registry)
+    assert detect_game_fact_errors(facts_registry, facts_matrix=matrix) == expected
+    has_serious_errors, error_messages = expected
+    assert has_serious_errors and len(error_messages) == 1 and "'bad fact'" in error_messages[0][1]
@@ -0,0 +1,76 @@
+"""
+Tests of the compact game inventory, whose items must keep behaving like the legacy item dicts.
+"""
+import json
+
+import pytest
+
+from pychronia_storygen.document_formats import load_jinja_environment
+from pychronia_storygen.inventory import GameInventory, analyze_and_normalize_game_items
+
+IMPORTANT_MARKER = "**"
+
+GAME_ITEMS_RAW = {
+    "@main-crate Weapons": ["Sword **", "@other-crate Bow"],
+    "Potions **": ["Healing potion"],
+}
+
+
+@pytest.fixture
+def inventory():
+    return GameInventory.from_raw_data(GAME_ITEMS_RAW, important_marker=IMPORTANT_MARKER)
+
+
+def test_items_behave_like_legacy_dicts(inventory):
+    item = inventory.items_per_section["Weapons"][0]
+    expected = dict(item_is_important=True, item_title="Sword")
+
+    assert "item_title" in item
+    assert "crate_name" not in item
+    assert dict(item) == expected
+    assert item == expected
+    assert list(item.keys()) == list(expected.keys())
+    assert list(item.items()) == list(expected.items())
+    assert item.get("item_title") == "Sword"
+    assert item.get("section_title", "default") == "default"
+    assert len(item) == 2
+    assert repr(item) == repr(expected)
+
+    assert (item.section_title, item.crate_name) == ("Weapons", "main-crate")
+
+
+def test_items_per_section_and_crate(inventory):
+    items_per_section, items_per_crate = analyze_and_normalize_game_items(GAME_ITEMS_RAW,
+                                                                          important_marker=IMPORTANT_MARKER)
+    assert {section: [dict(item) for item in items] for section, items in items_per_section.items()} == {
+        "Weapons": [dict(item_is_important=True, item_title="Sword"),
+                    dict(item_is_important=False, item_title="Bow")],
+        "Potions": [dict(item_is_important=True, item_title="Healing potion")],
+    }
+    assert {crate: [item["item_title"] for item in items] for crate, items in items_per_crate.items()} == {
+        "main-crate": ["Sword"],
+        "other-crate": ["Bow"],
+        "Potions": ["Healing potion"],
+    }
+
+
+def test_items_in_templates(inventory, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    jinja_env = load_jinja_environment(["."], use_macro_tags=False)
+    template = jinja_env.from_string(
+        '{% for item in items %}{{ item.item_title }}{% if "item_is_important" in item %}!{% endif %} '
+        '{{ item.get("item_is_important") }} {% for key, value in item.items() %}{{ key }}{% endfor %};'
+        '{% endfor %}{{ items|tojson }}')
+    output = template.render(items=inventory.items_per_crate["main-crate"])
+    text, json_data = output.split(";")
+    assert text == "Sword! True item_is_importantitem_title"
+    assert json.loads(json_data) == [dict(item_is_important=True, item_title="Sword")]
+
+    with pytest.raises(TypeError):
+        jinja_env.from_string("{{ value|tojson }}").render(value=object())
+
+
+@pytest.mark.parametrize("title", ["", "**", "  ** "])
+def test_empty_titles_are_rejected(title):
+    with pytest.raises(AssertionError):
+        GameInventory.from_raw_data({"Section": [title]}, important_marker=IMPORTANT_MARKER)
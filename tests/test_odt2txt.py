@@ -0,0 +1,134 @@
+"""
+Regression tests of the ODT to text conversion, against outputs of the original (minidom-based) converter.
+"""
+import re
+import zipfile
+from pathlib import Path
+
+from pychronia_storygen.odt2txt import OpenDocumentTextFile
+
+TESTS_DATA_DIR = Path(__file__).parent / "data"
+EXAMPLE_PROJECT_DIR = Path(__file__).parents[1] / "example_project"
+
+XML_NAMESPACES = ('xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+                  'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+                  'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+                  'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" '
+                  'xmlns:xlink="http://www.w3.org/1999/xlink"')
+
+FONT_FACE_DECLS = """
+<office:font-face-decls>
+  <style:font-face style:name="Liberation Mono" style:font-pitch="fixed"/>
+  <style:font-face style:name="Liberation Serif" style:font-pitch="variable"/>
+</office:font-face-decls>
+"""
+
+STYLES_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-styles %s>
+%s
+<office:styles>
+  <style:style style:name="Standard" style:family="paragraph"/>
+  <style:style style:name="Title" style:family="paragraph"/>
+  <style:style style:name="Heading_20_1" style:family="paragraph"/>
+  <style:style style:name="Heading_20_2" style:family="paragraph"/>
+  <style:style style:name="Preformatted_20_Text" style:family="paragraph">
+    <style:text-properties style:font-name="Liberation Mono"/>
+  </style:style>
+  <style:style style:name="Quotations" style:family="paragraph">
+    <style:paragraph-properties fo:margin-left="1.5cm"/>
+  </style:style>
+  <style:style style:name="Footnote" style:family="paragraph"/>
+  <style:style style:name="Emphasis" style:family="text">
+    <style:text-properties fo:font-style="italic"/>
+  </style:style>
+  <style:style style:name="Strong_20_Emphasis" style:family="text">
+    <style:text-properties fo:font-weight="bold"/>
+  </style:style>
+  <style:style style:name="Source_20_Text" style:family="text">
+    <style:text-properties style:font-name="Liberation Mono"/>
+  </style:style>
+  <text:list-style style:name="Numbering_20_123">
+    <text:list-level-style-number text:level="1"/>
+  </text:list-style>
+  <text:list-style style:name="List_20_1">
+    <text:list-level-style-bullet text:level="1"/>
+  </text:list-style>
+</office:styles>
+</office:document-styles>
+""" % (XML_NAMESPACES, FONT_FACE_DECLS)
+
+CONTENT_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-content %s>
+%s
+<office:automatic-styles>
+  <style:style style:name="T1" style:family="text">
+    <style:text-properties fo:font-style="italic" fo:font-weight="bold"/>
+  </style:style>
+  <style:style style:name="P1" style:family="paragraph" style:parent-style-name="Preformatted_20_Text">
+    <style:text-properties style:font-name="Liberation Mono"/>
+  </style:style>
+</office:automatic-styles>
+<office:body>
+<office:text>
+  <text:p text:style-name="Title">The clues</text:p>
+  <text:h text:style-name="Heading_20_1" text:outline-level="1">First part</text:h>
+  <text:p text:style-name="Standard">Some <text:span text:style-name="Emphasis">italic</text:span>,
+    <text:span text:style-name="Strong_20_Emphasis">bold</text:span> and
+    <text:span text:style-name="T1">both</text:span> words, some <text:span text:style-name="Source_20_Text">code</text:span>,
+    a <text:span text:style-name="Emphasis"> </text:span>blank span and
+    a <text:a xlink:href="http://example.com/page">link</text:a>.</text:p>
+  <text:p text:style-name="Standard">A fact<text:note text:id="ftn1" text:note-class="footnote"><text:note-citation>1</text:note-citation><text:note-body><text:p text:style-name="Footnote">First <text:span text:style-name="Emphasis">footnote</text:span> text.</text:p></text:note-body></text:note>
+    and another one<text:note text:id="ftn2" text:note-class="footnote"><text:note-citation>2</text:note-citation><text:note-body><text:p text:style-name="Footnote">Second footnote.</text:p></text:note-body></text:note>, with<text:s text:c="3"/>spaces<text:s/>and<text:tab/>tabs.</text:p>
+  <text:p text:style-name="Quotations">A long indented quotation, which is long enough to be wrapped over several lines of text by the converter.</text:p>
+  <text:list text:style-name="Numbering_20_123">
+    <text:list-item><text:p text:style-name="Standard">First numbered item</text:p></text:list-item>
+    <text:list-item><text:p text:style-name="Standard">Second numbered item, long enough to be wrapped over several lines of text.</text:p></text:list-item>
+  </text:list>
+  <text:list text:style-name="List_20_1">
+    <text:list-item><text:p text:style-name="Standard">A bullet</text:p></text:list-item>
+    <text:list-item><text:p text:style-name="Standard">Another <text:span text:style-name="Strong_20_Emphasis">bullet</text:span></text:p></text:list-item>
+  </text:list>
+  <text:h text:style-name="Heading_20_2" text:outline-level="2">Code blocks</text:h>
+  <text:p text:style-name="Preformatted_20_Text">def function():</text:p>
+  <text:p text:style-name="P1">    return 42<text:line-break/>  # Continued</text:p>
+  <text:p text:style-name="Preformatted_20_Text"/>
+  <text:p text:style-name="Preformatted_20_Text">print(function())</text:p>
+  <text:p text:style-name="Standard"/>
+  <text:p text:style-name="Standard">Between code blocks.</text:p>
+  <text:p text:style-name="Preformatted_20_Text">last = "code block"</text:p>
+</office:text>
+</office:body>
+</office:document-content>
+""" % (XML_NAMESPACES, FONT_FACE_DECLS)
+
+
+def _write_odt_file(odt_file):
+    with zipfile.ZipFile(odt_file, "w") as archive:
+        archive.writestr("mimetype", "application/vnd.oasis.opendocument.text")
+        for name, xml in (("styles.xml", STYLES_XML), ("content.xml", CONTENT_XML)):
+            archive.writestr(name, re.sub(r">\n\s*<", "><", xml))  # Like office suites, without indentation
+
+
+def test_example_project_document():
+    odt = OpenDocumentTextFile(EXAMPLE_PROJECT_DIR / "documents" / "clues_for_game.odt")
+    expected_text = (TESTS_DATA_DIR / "clues_for_game.txt").read_text(encoding="utf8")
+    assert odt.toString() == expected_text
+
+
+def test_footnotes_lists_and_code_blocks(tmp_path):
+    odt_file = tmp_path / "features.odt"
+    _write_odt_file(odt_file)
+    odt = OpenDocumentTextFile(odt_file)
+    expected_text = (TESTS_DATA_DIR / "footnotes_lists_and_code_blocks.txt").read_text(encoding="utf8")
+    assert odt.toString() == expected_text
+
+
+def test_streamed_strings_match_whole_text(tmp_path):
+    odt_file = tmp_path / "features.odt"
+    _write_odt_file(odt_file)
+    expected_text = OpenDocumentTextFile(odt_file).toString()
+
+    odt = OpenDocumentTextFile(odt_file)
+    strings = list(odt.compressCodeBlocks(character  # Code blocks lookahead must not depend on chunking
+                                          for string in odt.iterateBlocks() for character in string))
+    assert "".join(strings) == expected_text
@@ -0,0 +1,154 @@
+"""
+Tests of the object-level removal of PDF annotations, on small PDF files built on the fly.
+"""
+import random
+
+import pypdf
+import pytest
+
+from pychronia_storygen import document_formats
+from pychronia_storygen.pdf_annotations import remove_annotations_from_pdf_file, UnsupportedPdfStructure
+
+PDF_HEADER = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+
+PAGE_CONTENT = b"0 0 m 100 100 l S"
+ANNOTATION_APPEARANCE = b"1 0 0 rg 0 0 10 10 re f"
+
+
+def _stream(entries, content):
+    return b"<< %s /Length %d >>\nstream\n%s\nendstream" % (entries, len(content), content)
+
+
+def _get_document_objects(first_page_annotations=b"/Annots [6 0 R]"):
+    return {
+        1: b"<< /Type /Catalog /Pages 2 0 R >>",
+        2: b"<< /Type /Pages /Kids [3 0 R 4 0 R] /Count 2 >>",
+        3: b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] /Contents 5 0 R %s >>" % first_page_annotations,
+        4: b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 200 200] /Contents 5 0 R >>",
+        5: b"<< /Length 7 0 R >>\nstream\n%s\nendstream" % PAGE_CONTENT,  # Indirect length
+        6: (b"<< /Type /Annot /Subtype /Text /Rect [0 0 10 10] /Contents (Gamemaster note \\(secret\\)) "
+            b"/AP << /N 8 0 R >> >>"),
+        7: b"%d" % len(PAGE_CONTENT),
+        8: _stream(b"/Type /XObject /Subtype /Form /BBox [0 0 10 10]", ANNOTATION_APPEARANCE),
+    }
+
+
+def _build_pdf(objects, size, previous=None, previous_xref_offset=None):
+    """
+    Return the bytes of a PDF file with a classic cross-reference table, and the offset of this table.
+
+    If previous is given, objects are appended to it as an incremental update.
+    """
+    output = bytearray(previous or PDF_HEADER)
+    offsets = {}
+    for number, body in sorted(objects.items()):
+        offsets[number] = len(output)
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_offset = len(output)
+    output += b"xref\n"
+    if previous is None:
+        output += b"0 1\n0000000000 65535 f \n"
+    for number, offset in sorted(offsets.items()):
+        output += b"%d 1\n%010d 00000 n \n" % (number, offset)
+    previous_entry = b" /Prev %d" % previous_xref_offset if previous is not None else b""
+    output += b"trailer\n<< /Size %d /Root 1 0 R%s >>\nstartxref\n%d\n%%%%EOF\n" % (size, previous_entry, xref_offset)
+    return bytes(output), xref_offset
+
+
+def _build_pdf_with_xref_stream(objects):
+    """Return the bytes of a PDF file whose cross-reference data is a (PDF 1.5) stream"""
+    output = bytearray(PDF_HEADER)
+    offsets = {}
+    for number, body in sorted(objects.items()):
+        offsets[number] = len(output)
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref_number = max(objects) + 1
+    offsets[xref_number] = xref_offset = len(output)
+    xref_data = b"".join(b"\x01" + offset.to_bytes(4, "big") + b"\x00\x00" if offset is not None
+                         else b"\x00\x00\x00\x00\x00\xff\xff"
+                         for offset in [None] + [offsets[number] for number in range(1, xref_number + 1)])
+    output += b"%d 0 obj\n%s\nendobj\n" % (xref_number, _stream(
+        b"/Type /XRef /Size %d /W [1 4 2] /Root 1 0 R" % (xref_number + 1), xref_data))
+    output += b"startxref\n%d\n%%%%EOF\n" % xref_offset
+    return bytes(output)
+
+
+def _check_pdf_without_annotations(pdf_file):
+    reader = pypdf.PdfReader(pdf_file, strict=True)
+    assert len(reader.pages) == 2
+    for page in reader.pages:
+        assert "/Annots" not in page
+        assert page.get_contents().get_data() == PAGE_CONTENT
+    data = pdf_file.read_bytes()
+    assert b"Gamemaster note" not in data and ANNOTATION_APPEARANCE not in data  # Really dropped
+
+
+def test_remove_annotations(tmp_path):
+    pdf_file = tmp_path / "annotated.pdf"
+    pdf_file.write_bytes(_build_pdf(_get_document_objects(), size=9)[0])
+
+    assert remove_annotations_from_pdf_file(pdf_file) == 1
+    _check_pdf_without_annotations(pdf_file)
+
+    data = pdf_file.read_bytes()
+    assert remove_annotations_from_pdf_file(pdf_file) == 0
+    assert pdf_file.read_bytes() == data  # Untouched
+
+
+def test_remove_annotations_added_by_incremental_update(tmp_path):
+    original_data, xref_offset = _build_pdf(_get_document_objects(first_page_annotations=b""), size=9)
+    updated_objects = {number: body for (number, body) in _get_document_objects().items() if number in (3, 6, 8)}
+    pdf_file = tmp_path / "updated.pdf"
+    pdf_file.write_bytes(_build_pdf(updated_objects, size=9, previous=original_data, previous_xref_offset=xref_offset)[0])
+
+    assert remove_annotations_from_pdf_file(pdf_file) == 1
+    _check_pdf_without_annotations(pdf_file)
+    assert b"/Prev" not in pdf_file.read_bytes()  # Single cross-reference table
+
+
+def test_cross_reference_streams_fall_back_to_pypdf(tmp_path):
+    pdf_file = tmp_path / "xref_stream.pdf"
+    pdf_file.write_bytes(_build_pdf_with_xref_stream(_get_document_objects()))
+    pypdf.PdfReader(pdf_file, strict=True)  # Sanity check of the fixture
+
+    with pytest.raises(UnsupportedPdfStructure):
+        remove_annotations_from_pdf_file(pdf_file)
+
+    document_formats._remove_annotations_from_pdf_file(pdf_file)
+    reader = pypdf.PdfReader(pdf_file, strict=True)
+    assert all("/Annots" not in page for page in reader.pages)
+
+
+@pytest.mark.parametrize("replaced, replacement", [
+    (b"/Length 7 0 R", b"/Length abc"),  # Invalid stream length
+    (b"7 0 obj\n%d" % len(PAGE_CONTENT), b"7 0 obj\n(%d)" % len(PAGE_CONTENT)),  # Non-integer indirect length
+    (b"/Root 1 0 R", b"/Root 1 0 R /Prev xyz"),  # Invalid previous cross-reference table
+    (b"endobj\n", b""),  # Missing endobj
+])
+def test_malformed_pdf_raises_unsupported_structure(tmp_path, replaced, replacement):
+    data = _build_pdf(_get_document_objects(), size=9)[0]
+    assert replaced in data
+    pdf_file = tmp_path / "malformed.pdf"
+    pdf_file.write_bytes(data.replace(replaced, replacement, 1))
+
+    with pytest.raises(UnsupportedPdfStructure):
+        remove_annotations_from_pdf_file(pdf_file)
+
+
+def test_empty_or_corrupted_pdf_raises_unsupported_structure(tmp_path):
+    pdf_file = tmp_path / "corrupted.pdf"
+    pdf_file.write_bytes(b"")
+    with pytest.raises(UnsupportedPdfStructure):
+        remove_annotations_from_pdf_file(pdf_file)
+
+    data = _build_pdf(_get_document_objects(), size=9)[0]
+    rng = random.Random(42)
+    for _ in range(300):
+        corrupted_data = bytearray(data)
+        for _ in range(rng.randint(1, 4)):
+            corrupted_data[rng.randrange(len(corrupted_data))] = rng.choice(b"0123456789 /<>[]()Rnf\n")
+        pdf_file.write_bytes(bytes(corrupted_data))
+        try:
+            remove_annotations_from_pdf_file(pdf_file)
+        except UnsupportedPdfStructure:
+            assert pdf_file.read_bytes() == corrupted_data  # Left untouched
@@ -0,0 +1,111 @@
+"""
+Tests of the memoization of template renderings, and of the replay of the game-tags events they triggered.
+"""
+import collections
+import random
+
+import pytest
+
+from pychronia_storygen.document_formats import (load_jinja_environment, refresh_macros_from_template_file,
+                                                 render_with_jinja, render_with_jinja_and_fact_tags)
+
+PLAYER_IDS = ["goblin", "hero", "enemy"]
+
+TEMPLATES = {
+    "_shared_part.txt": '{% fact "Shared fact" %} and {% fact "Shared authored fact" as author %}',
+    "_forced_player.txt": '{% set current_player_id = "goblin" %}{% fact "Forced goblin fact" %}',
+    "_forced_player_outer.txt": '{% set current_player_id = "goblin" %}{% include "_forced_player_inner.txt" %}',
+    "_forced_player_inner.txt": '{% fact "Included goblin fact" %}',
+    "_forced_normal_sheet.txt": '{% set is_cheat_sheet = False %}{% fact "Normal-sheet fact" %}',
+    "_random_text.txt": '{{ lipsum(1, html=False) }} {{ random_number() }}',
+    "_pure_globals.txt": '{% for i in range(3) %}{{ i }}{% endfor %}{{ dict(a=1)|length }}',
+}
+
+
+@pytest.fixture
+def jinja_env(tmp_path, monkeypatch):
+    for template_name, source in TEMPLATES.items():
+        tmp_path.joinpath(template_name).write_text(source, encoding="utf8")
+    monkeypatch.chdir(tmp_path)
+    return load_jinja_environment(["."], use_macro_tags=False)
+
+
+def _render_for_players(jinja_env, filename, is_cheat_sheet=False):
+    outputs = []
+    for player_id in PLAYER_IDS:
+        jinja_context = collections.ChainMap(dict(current_player_id=player_id, is_cheat_sheet=is_cheat_sheet))
+        outputs.append(render_with_jinja_and_fact_tags(filename=filename, jinja_env=jinja_env, jinja_context=jinja_context))
+    return outputs
+
+
+def test_shared_part_is_replayed_for_each_player(jinja_env):
+    outputs = _render_for_players(jinja_env, "_shared_part.txt")
+    assert outputs == ["Shared fact and Shared authored fact"] * len(PLAYER_IDS)
+    assert jinja_env.render_cache.misses == 1 and jinja_env.render_cache.hits == len(PLAYER_IDS) - 1
+
+    facts_registry = jinja_env.facts_registry
+    assert sorted(facts_registry["shared fact"]) == sorted(PLAYER_IDS)
+    assert sorted(facts_registry["shared authored fact"]) == sorted(PLAYER_IDS)
+    for player_id in PLAYER_IDS:
+        assert dict(facts_registry["shared fact"][player_id]) == dict(
+            is_author=False, is_viewer=True, in_cheat_sheet=False, in_normal_sheet=True)
+        assert facts_registry["shared authored fact"][player_id]["is_author"]
+
+    _render_for_players(jinja_env, "_shared_part.txt", is_cheat_sheet=True)
+    assert all(facts_registry["shared fact"][player_id]["in_cheat_sheet"] for player_id in PLAYER_IDS)
+
+
+@pytest.mark.parametrize("filename, fact_name", [
+    ("_forced_player.txt", "forced goblin fact"),
+    ("_forced_player_outer.txt", "included goblin fact"),
+])
+def test_player_assigned_in_template_is_not_replayed_for_other_players(jinja_env, filename, fact_name):
+    _render_for_players(jinja_env, filename)
+    assert list(jinja_env.facts_registry[fact_name]) == ["goblin"]
+
+
+def test_cheat_sheet_flag_assigned_in_template_is_kept_on_replay(jinja_env):
+    _render_for_players(jinja_env, "_forced_normal_sheet.txt")
+    _render_for_players(jinja_env, "_forced_normal_sheet.txt", is_cheat_sheet=True)
+    facts_registry = jinja_env.facts_registry
+    assert sorted(facts_registry["normal-sheet fact"]) == sorted(PLAYER_IDS)
+    for player_id in PLAYER_IDS:
+        assert not facts_registry["normal-sheet fact"][player_id]["in_cheat_sheet"]
+
+
+def test_renderings_calling_impure_globals_are_not_memoized(jinja_env):
+    jinja_env.globals["random_number"] = random.random
+    outputs = _render_for_players(jinja_env, "_random_text.txt")
+    assert len(set(outputs)) == len(PLAYER_IDS)
+    assert jinja_env.render_cache.hits == 0
+
+    outputs = _render_for_players(jinja_env, "_pure_globals.txt")
+    assert outputs == ["0121"] * len(PLAYER_IDS)
+    assert jinja_env.render_cache.hits == len(PLAYER_IDS) - 1
+
+
+def test_plain_renderings_register_facts_directly(jinja_env):
+    jinja_context = dict(current_player_id="hero", is_cheat_sheet=False)
+    output = render_with_jinja(filename="_shared_part.txt", jinja_env=jinja_env, jinja_context=jinja_context)
+    assert output == "Shared fact and Shared authored fact"
+    assert list(jinja_env.facts_registry["shared fact"]) == ["hero"]
+    assert jinja_env.facts_registry["shared authored fact"]["hero"]["is_author"]
+
+
+def test_string_templates_follow_changes_of_macro_registry(tmp_path, monkeypatch):
+    tmp_path.joinpath("macros_v1.txt").write_text("{% macro greet(name) %}Hello {{ name }}{% endmacro %}", encoding="utf8")
+    monkeypatch.chdir(tmp_path)
+    jinja_env = load_jinja_environment(["."], use_macro_tags=True)
+
+    def render():
+        return render_with_jinja_and_fact_tags(content='<{ greet name="Bob" }/>', jinja_env=jinja_env, jinja_context={}).strip()
+
+    assert render() == render() == "Hello Bob"
+    assert jinja_env.string_template_cache.hits == 1
+
+    # Macro moved to another file, like in watch mode
+    tmp_path.joinpath("macros_v1.txt").write_text("", encoding="utf8")
+    tmp_path.joinpath("macros_v2.txt").write_text("{% macro greet(name) %}Bye {{ name }}{% endmacro %}", encoding="utf8")
+    assert refresh_macros_from_template_file(jinja_env, "macros_v1.txt")
+    assert refresh_macros_from_template_file(jinja_env, "macros_v2.txt")
+    assert render() == "Bye Bob"
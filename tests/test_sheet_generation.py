@@ -0,0 +1,80 @@
+"""
+Tests of the generation of sheets, and of the dependency manifest allowing to skip it on later builds.
+"""
+import collections
+import sys
+from pathlib import Path
+
+import pytest
+
+from pychronia_storygen import cli, document_formats
+from pychronia_storygen.build_cache import BuildManifest, SheetDependencyManifest
+from pychronia_storygen.converter_jobs import ConverterCommandError, ConverterJobRunner
+from pychronia_storygen.document_formats import load_jinja_environment
+
+
+@pytest.fixture
+def sheet_job(tmp_path, monkeypatch):
+    tmp_path.joinpath("sheet.txt").write_text('Hello {% fact "Some fact" %}', encoding="utf8")
+    monkeypatch.chdir(tmp_path)
+    storygen_settings = cli.StorygenSettings(
+        project_root_dir=tmp_path,
+        build_root_dir=tmp_path.joinpath("_build"),
+        output_root_dir=tmp_path.joinpath("_output"),
+        jinja_env=load_jinja_environment(["."], use_macro_tags=False),
+        dynamic_variables=collections.ChainMap(),
+        dynamic_settings=collections.ChainMap(dict(rst2pdf_backend="subprocess")),
+        build_manifest=BuildManifest(tmp_path.joinpath("build_manifest.json")),
+        dependency_manifest=SheetDependencyManifest(tmp_path.joinpath("sheet_dependencies.json")),
+        converter_job_runner=ConverterJobRunner())
+    storygen_settings.build_root_dir.mkdir()
+    return cli.SheetGenerationJob(sheet_parts=("sheet.txt",), relative_filepath_base=Path("sheet"),
+                                  jinja_context=collections.ChainMap(dict(current_player_id="hero", is_cheat_sheet=False)),
+                                  storygen_settings=storygen_settings)
+
+
+def _fake_rst2pdf_command(exit_code):
+    def get_rst2pdf_command(rst_file, pdf_file, conf_file="", extra_args=""):
+        script = "import sys; open(sys.argv[1], 'wb').close(); sys.exit(%d)" % exit_code
+        return [sys.executable, "-c", script, str(pdf_file)]
+    return get_rst2pdf_command
+
+
+def _is_sheet_up_to_date(sheet_job):
+    return cli._get_replayable_sheet_registries(
+        sheet_job, get_template_digest=sheet_job.storygen_settings.jinja_env.get_template_digest) is not None
+
+
+def test_failed_deferred_conversion_does_not_mark_sheet_as_up_to_date(sheet_job, monkeypatch):
+    storygen_settings = sheet_job.storygen_settings
+
+    monkeypatch.setattr(document_formats, "get_rst2pdf_command", _fake_rst2pdf_command(exit_code=1))
+    cli._generate_sheet_files(sheet_job)
+    assert not _is_sheet_up_to_date(sheet_job)  # Conversion not run yet
+    with pytest.raises(ConverterCommandError):
+        storygen_settings.converter_job_runner.run_pending_jobs()
+    assert not _is_sheet_up_to_date(sheet_job)
+    assert "sheet" not in storygen_settings.build_manifest.entries
+
+    monkeypatch.setattr(document_formats, "get_rst2pdf_command", _fake_rst2pdf_command(exit_code=0))
+    cli._generate_sheet_files(sheet_job)
+    storygen_settings.converter_job_runner.run_pending_jobs()
+    assert _is_sheet_up_to_date(sheet_job)
+    assert "sheet" in storygen_settings.build_manifest.entries
+    assert storygen_settings.dependency_manifest.get_story_tags_registries("sheet")["facts_registry"]
+
+
+def test_rst2pdf_renderers_are_reloaded_when_their_stylesheets_change(tmp_path, monkeypatch):
+    pytest.importorskip("rst2pdf")
+    monkeypatch.chdir(tmp_path)
+    tmp_path.joinpath("rst2pdf.conf").write_text('[general]\nstylesheets="custom.yaml"\n', encoding="utf8")
+    stylesheet_file = tmp_path.joinpath("custom.yaml")
+    stylesheet_file.write_text("styles:\n  normal:\n    fontSize: 10\n", encoding="utf8")
+
+    renderer = document_formats._get_rst2pdf_renderer("rst2pdf.conf", "")
+    assert document_formats._get_rst2pdf_renderer("rst2pdf.conf", "") is renderer
+
+    stylesheet_file.write_text("styles:\n  normal:\n    fontSize: 12\n", encoding="utf8")
+    new_renderer = document_formats._get_rst2pdf_renderer("rst2pdf.conf", "")
+    assert new_renderer is not renderer
+    assert new_renderer.renderer.styles["normal"].fontSize == 12